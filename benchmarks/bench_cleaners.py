@@ -0,0 +1,93 @@
+"""
+Compare the scalar cleaners in `femsntl.utils` (applied row by row, as the
+notebooks used to) with their column-wise versions.
+
+Usage:
+    poetry run python benchmarks/bench_cleaners.py [NUM_ROWS]
+"""
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from femsntl.utils import (
+    clean_address,
+    clean_addresses,
+    clean_amr_names,
+    clean_amr_names_series,
+    clean_phone_number,
+    clean_phone_numbers,
+    extract_DOB_fromname,
+    extract_DOB_fromname_series,
+    standardize_month,
+    standardize_month_series,
+    standardize_year,
+    standardize_year_series,
+)
+
+NON_NAMES = ["UNK", "CALLER", "UNKNOWN", "MEDICAID", "DOB", "YEARS", "OLD"]
+
+
+def _make_column(rng: np.random.Generator, pool, num_rows: int) -> pd.Series:
+    values = np.array(pool, dtype=object)
+    return pd.Series(values[rng.integers(0, len(values), num_rows)])
+
+
+def _time(func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(num_rows: int = 1_000_000, num_distinct: int = 50_000):
+    rng = np.random.default_rng(1234)
+    first = ["KEVIN", "MARY", "JOHN", "ANA", "UNK", "CALLER"]
+    last = ["WILSON", "SMITH", "GARCIA", "LEE", "O'NEIL"]
+    names = [
+        f"{rng.choice(first)} {rng.choice(last)} {i % 12 + 1}/{i % 28 + 1}/{i % 90 + 10}"
+        for i in range(num_distinct)
+    ] + [None]
+    phones = [f"202-555-{i:04d}" for i in range(num_distinct)] + ["NOPHONE", None]
+    addresses = [f"{i} Main St.  Washington DC" for i in range(num_distinct)] + [None]
+    parts = [str(i) for i in range(2000)] + ["None", "nan"]
+
+    columns = {
+        "names": _make_column(rng, names, num_rows),
+        "phones": _make_column(rng, phones, num_rows),
+        "addresses": _make_column(rng, addresses, num_rows),
+        "parts": _make_column(rng, parts, num_rows),
+    }
+    cases = [
+        (
+            "clean_amr_names",
+            "names",
+            lambda name: clean_amr_names(name, non_names=NON_NAMES),
+            lambda col: clean_amr_names_series(col, non_names=NON_NAMES),
+        ),
+        (
+            "extract_DOB_fromname",
+            "names",
+            extract_DOB_fromname,
+            extract_DOB_fromname_series,
+        ),
+        ("standardize_year", "parts", standardize_year, standardize_year_series),
+        ("standardize_month", "parts", standardize_month, standardize_month_series),
+        ("clean_phone_number", "phones", clean_phone_number, clean_phone_numbers),
+        ("clean_address", "addresses", clean_address, clean_addresses),
+    ]
+
+    print(f"{'cleaner':<24}{'scalar (s)':>12}{'column (s)':>12}{'speedup':>10}")
+    for name, column, scalar_func, series_func in cases:
+        col = columns[column]
+        scalar_time = _time(lambda: [scalar_func(value) for value in col])
+        series_time = _time(lambda: series_func(col))
+        print(
+            f"{name:<24}{scalar_time:>12.2f}{series_time:>12.2f}"
+            f"{scalar_time / series_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -1,16 +1,55 @@
 import json
 import shutil
 import subprocess
+import sys
 import textwrap
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import ExitStack
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import click
 import papermill as pm
 import yaml
 
-from .datafiles import NOTEBOOK_DIR, OUTPUT_DIR, SRC_DIR, TEST_DIR
-from .utils import _open_or_yield, compute_sha
+from .datafiles import (
+    CREDENTIALS_FILE,
+    NOTEBOOK_DIR,
+    OUTPUT_DIR,
+    PRIVATE_DATA_DIR,
+    SRC_DIR,
+    TEST_DIR,
+)
+from .inventory import (
+    INVENTORY_FILE,
+    SHA_CACHE_FILE,
+    ShaCache,
+    compute_shas,
+    verify_inventory,
+)
+from .profiling import (
+    PROFILE_DIR,
+    StageProfile,
+    cell_durations,
+    compare_reports,
+    find_reports,
+    format_comparison,
+    read_report,
+    run_profiled,
+    write_report,
+)
+from .safetypad import BASE_URL, SafetyPadClient, pull_pcrs, read_pcr_ids
+from .stages import (
+    FileSpec,
+    RunLedger,
+    fingerprint,
+    get_stage,
+    relative_path,
+    specs_overlap,
+    stage_dependencies,
+)
+from .synth import DEFAULT_SEED, synthesize
+from .utils import _open_or_yield
 
 
 @click.group()
@@ -52,52 +91,332 @@ def style_command(source_dir: Optional[Tuple[str]]):
         )
 
 
-@cli.command("run-all")
-@click.option("--step", "-s", default=None)
-def run_all_command(step: Optional[str]):
+def _execute_stage(filename: Path, output_dir: Path, log_path: Optional[Path] = None):
+    """
+    Execute a single notebook, R script or R markdown file. If `log_path` is passed,
+    its output goes there instead of to the terminal.
+    """
+    output_dir.mkdir(exist_ok=True, parents=True)
+    with ExitStack() as stack:
+        log = None
+        if log_path:
+            log_path.parent.mkdir(exist_ok=True, parents=True)
+            log = stack.enter_context(open(log_path, "wt"))
+        stderr = subprocess.STDOUT if log else None
+
+        if filename.name.endswith("ipynb"):
+            pm.execute_notebook(
+                filename,
+                output_dir / filename.name,
+                progress_bar=log is None,
+                stdout_file=log,
+                stderr_file=log,
+            )
+        elif filename.name.endswith("R"):
+            subprocess.run(["Rscript", filename], check=True, stdout=log, stderr=stderr)
+        elif filename.name.endswith("Rmd"):
+            subprocess.run(
+                ["Rscript", "-e", f'rmarkdown::render("{filename}")'],
+                check=True,
+                stdout=log,
+                stderr=stderr,
+            )
+            shutil.move(
+                str(filename.with_suffix(".html")),
+                output_dir / filename.with_suffix(".html").name,
+            )
+        else:
+            raise ValueError(f"Unsupported filetype extesion for {filename}")
+
+
+def _profile_stage(
+    filename: Path, output_dir: Path, log_path: Optional[Path] = None
+) -> StageProfile:
+    """
+    Execute a stage with `_execute_stage` in a process of its own and measure it.
+    For notebooks, the time of each cell comes from the executed copy.
+    """
+    usage = run_profiled(_execute_stage, filename, output_dir, log_path)
+    executed_path = output_dir / filename.name
+    cells: Tuple = ()
+    if filename.suffix == ".ipynb" and executed_path.exists():
+        cells = tuple(cell_durations(executed_path))
+    return StageProfile(relative_path(Path(filename).absolute()), *usage, cells=cells)
+
+
+def _find_stage_files(step: Optional[str]) -> List[Tuple[Path, Path]]:
+    """ The files `run-all` executes, in order, with where their output goes """
     base_output_dir = OUTPUT_DIR / "notebooks"
+    stage_files: List[Tuple[Path, Path]] = []
 
     if not step or step == "1":
         # Run the pre-analysis
         preanalysis_dir = NOTEBOOK_DIR / "100_preanalysis"
         output_dir = base_output_dir / "100_preanalysis"
-        output_dir.mkdir(exist_ok=True, parents=True)
-
         for filename in sorted(preanalysis_dir.glob("*.ipynb")):
-            click.echo(f"Running {filename}...")
-            pm.execute_notebook(filename, output_dir / filename.name)
+            stage_files.append((filename, output_dir))
 
     if not step or step == "3":
         # Execute merging scripts
         merging_dir = NOTEBOOK_DIR / "300_merge_and_clean"
         output_dir = base_output_dir / "300_merge_and_clean"
-        output_dir.mkdir(exist_ok=True, parents=True)
-
         for filename in sorted(merging_dir.glob("*.ipynb")):
-            click.echo(f"Running {filename}...")
-            pm.execute_notebook(filename, output_dir / filename.name)
+            stage_files.append((filename, output_dir))
 
     if not step or step == "4":
-
         output_dir = base_output_dir / "400_analysis"
-        output_dir.mkdir(exist_ok=True, parents=True)
-        filenames = sorted(Path("src").rglob("400_analysis/*"), key=lambda x: x.name)
+        filenames = sorted(SRC_DIR.rglob("400_analysis/*"), key=lambda x: x.name)
         for filename in filenames:
-            click.echo(f"Running {filename}...")
-            if filename.name.endswith("ipynb"):
-                pm.execute_notebook(filename, output_dir / filename.name)
-            elif filename.name.endswith("R"):
-                subprocess.run(["Rscript", filename], check=True)
-            elif filename.name.endswith("Rmd"):
-                subprocess.run(
-                    ["Rscript", "-e", f'rmarkdown::render("{filename}")'], check=True
-                )
-                shutil.move(
-                    str(filename.with_suffix(".html")),
-                    output_dir / filename.with_suffix(".html").name,
+            stage_files.append((filename, output_dir))
+
+    return stage_files
+
+
+def _log_path(filename: Path) -> Path:
+    """ Where the output of a stage goes when stages are run in parallel """
+    return OUTPUT_DIR / "logs" / filename.parent.name / f"{filename.stem}.log"
+
+
+@cli.command("run-all")
+@click.option("--step", "-s", default=None)
+@click.option(
+    "--force",
+    "-f",
+    is_flag=True,
+    help="Run every stage, even those whose code and inputs have not changed",
+)
+@click.option(
+    "--dry-run",
+    "-n",
+    is_flag=True,
+    help="Only report which stages would run and which would be skipped",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=1,
+    help=(
+        "How many stages to run at once. Each stage waits for the stages that write "
+        "what it reads, and its output goes to output/logs instead of the terminal"
+    ),
+)
+@click.option(
+    "--profile",
+    "-p",
+    is_flag=True,
+    help=(
+        "Record the wall time, CPU time and peak memory of each stage that runs, "
+        "and the time of each notebook cell, in a report under output/profiles"
+    ),
+)
+def run_all_command(
+    step: Optional[str], force: bool, dry_run: bool, jobs: int, profile: bool
+):
+    """
+    Run the analysis. Stages whose code and inputs have not changed since they last
+    ran successfully (according to the run ledger) and whose outputs still exist
+    are skipped. Files missing from the stage manifest are always run.
+    """
+    ledger = RunLedger()
+    stage_files = _find_stage_files(step)
+    stages = [get_stage(filename) for filename, _ in stage_files]
+    # Outputs of stages that (would) run, which make their readers stale in a dry run
+    pending_outputs: List[FileSpec] = []
+
+    def _plan(index: int) -> Tuple[Optional[str], Optional[str]]:
+        """ A stage's fingerprint and why it has to run, or None if it does not """
+        stage = stages[index]
+        if stage is None:
+            return None, "not in the stage manifest"
+
+        stage_fingerprint = fingerprint(stage)
+        if force:
+            return stage_fingerprint, "forced"
+        if dry_run and any(
+            specs_overlap(spec, output)
+            for spec in stage.inputs
+            for output in pending_outputs
+        ):
+            return stage_fingerprint, "an upstream stage would run"
+        if stage.name not in ledger.entries:
+            return stage_fingerprint, "no previous run"
+        if not ledger.is_current(stage, stage_fingerprint):
+            return stage_fingerprint, "code, inputs or outputs changed"
+        return stage_fingerprint, None
+
+    def _record(index: int, stage_fingerprint: Optional[str]):
+        stage = stages[index]
+        if stage is not None and stage_fingerprint:
+            ledger.record(stage, stage_fingerprint)
+
+    if dry_run:
+        for index, (filename, _) in enumerate(stage_files):
+            _, reason = _plan(index)
+            if reason is None:
+                click.echo(f"Skipping {filename} (unchanged)")
+                continue
+            click.echo(f"Would run {filename} ({reason})")
+            stage = stages[index]
+            if stage is not None:
+                pending_outputs.extend(stage.outputs)
+        return
+
+    profiles: List[StageProfile] = []
+
+    def _write_profile(complete: bool):
+        """ Also called when a stage fails, as the time the others took is of use """
+        if not profile:
+            return
+        if not profiles:
+            click.echo("No stages ran, so there is no profile")
+            return
+        path = write_report(
+            profiles, PROFILE_DIR, step=step, jobs=jobs, complete=complete
+        )
+        click.echo(f"Wrote the profile to {path}")
+
+    if jobs == 1:
+        for index, (filename, output_dir) in enumerate(stage_files):
+            stage_fingerprint, reason = _plan(index)
+            if reason is None:
+                click.echo(f"Skipping {filename} (unchanged)")
+                continue
+            click.echo(f"Running {filename} ({reason})...")
+            try:
+                if profile:
+                    profiles.append(_profile_stage(filename, output_dir))
+                else:
+                    _execute_stage(filename, output_dir)
+            except Exception:
+                _write_profile(complete=False)
+                raise
+            _record(index, stage_fingerprint)
+        _write_profile(complete=True)
+        return
+
+    # Stages still to start, with the stages each is waiting for
+    waiting = dict(enumerate(stage_dependencies(stages)))
+    running: Dict[Future, Tuple[int, Optional[str]]] = {}
+
+    def _finish(index: int):
+        for dependencies in waiting.values():
+            dependencies.discard(index)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while waiting or running:
+            for index in [index for index, deps in waiting.items() if not deps]:
+                del waiting[index]
+                filename, output_dir = stage_files[index]
+                stage_fingerprint, reason = _plan(index)
+                if reason is None:
+                    click.echo(f"Skipping {filename} (unchanged)")
+                    _finish(index)
+                    continue
+
+                log_path = _log_path(filename)
+                click.echo(f"Running {filename} ({reason}), logging to {log_path}...")
+                future = pool.submit(
+                    _profile_stage if profile else _execute_stage,
+                    filename,
+                    output_dir,
+                    log_path,
                 )
-            else:
-                raise ValueError(f"Unsupported filetype extesion for {filename}")
+                running[future] = (index, stage_fingerprint)
+
+            if not running:
+                # Every ready stage was skipped, which may have unblocked others
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, stage_fingerprint = running.pop(future)
+                filename, _ = stage_files[index]
+                error = future.exception()
+                if error is not None:
+                    for other in running:
+                        other.cancel()
+                    if running:
+                        click.echo(
+                            f"Waiting for {len(running)} running stage(s) to finish..."
+                        )
+                    _write_profile(complete=False)
+                    raise click.ClickException(
+                        f"{filename} failed ({error}); see {_log_path(filename)}"
+                    )
+
+                click.echo(f"Finished {filename}")
+                if profile:
+                    profiles.append(future.result())
+                _record(index, stage_fingerprint)
+                _finish(index)
+
+    _write_profile(complete=True)
+
+
+@cli.group("profile")
+def profile_group():
+    """
+    Commands related to the profiles `run-all --profile` writes
+    """
+
+
+@profile_group.command("compare")
+@click.argument("old", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.argument("new", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--threshold",
+    "-t",
+    type=click.FloatRange(min=0),
+    default=0.25,
+    help="How much slower (or larger) a stage or cell has to get to be flagged",
+)
+@click.option(
+    "--min-seconds",
+    type=click.FloatRange(min=0),
+    default=1.0,
+    help="Ignore stages and cells whose time grew by less than this",
+)
+def profile_compare_command(
+    old: Optional[str], new: Optional[str], threshold: float, min_seconds: float
+):
+    """
+    Compare two profiles, by default the two most recent in output/profiles, and
+    list the stages and cells of OLD that got slower (or used more memory) in NEW.
+    Exits with a non-zero status if any did.
+    """
+    if new is None:
+        reports = find_reports(PROFILE_DIR)
+        if old is not None or len(reports) < 2:
+            raise click.UsageError(
+                f"Pass two profiles, or have at least two in {PROFILE_DIR}"
+            )
+        old, new = reports[-2:]
+    click.echo(f"Comparing {old} to {new}")
+
+    comparison = compare_reports(
+        read_report(Path(old)),
+        read_report(Path(new)),
+        threshold=threshold,
+        min_seconds=min_seconds,
+    )
+    # The total over the stages that ran both times
+    totals = comparison[
+        comparison.cell.isnull() & (comparison.metric == "wall_seconds")
+    ].dropna(subset=["old", "new"])
+    click.echo(
+        f"Total wall time of {len(totals)} stage(s) in both: "
+        f"{totals.old.sum():.1f}s -> {totals.new.sum():.1f}s"
+    )
+
+    regressions = comparison[comparison.is_regression].drop(columns="is_regression")
+    if regressions.empty:
+        click.echo(f"No regressions above {threshold:.0%}")
+        return
+
+    click.echo(f"{len(regressions)} regression(s) above {threshold:.0%}:")
+    click.echo(format_comparison(regressions))
+    sys.exit(1)
 
 
 @cli.group("inventory")
@@ -107,6 +426,15 @@ def inventory_group():
     """
 
 
+_jobs_option = click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=None,
+    help="How many files to hash at once. Default is the number of CPUs",
+)
+
+
 @inventory_group.command("create")
 @click.option(
     "--data-dir",
@@ -116,20 +444,26 @@ def inventory_group():
     default="data",
     help="The directory containing the data to inventory",
 )
-def create_inventory_command(data: str):
-    """ Create an inventory from a directory """
+@_jobs_option
+def create_inventory_command(data: str, jobs: Optional[int]):
+    """ Create an inventory from a directory. Hidden files and caches are skipped """
     data_dir = Path(data)
-    objs = []
-    for path in data_dir.rglob("*"):
-        if path.name == "inventory.yml" or not path.is_file():
-            continue
-        objs.append(
-            {
-                "path": str(path.relative_to(data_dir)),
-                "sha256": compute_sha(path),
-            }
-        )
-    with open(data_dir / "inventory.yml", "wt") as outfile:
+    paths = [
+        path
+        for path in data_dir.rglob("*")
+        if path.name != INVENTORY_FILE
+        and not any(part.startswith(".") for part in path.relative_to(data_dir).parts)
+        and path.is_file()
+    ]
+    cache = ShaCache(data_dir / SHA_CACHE_FILE)
+    shas = compute_shas(paths, cache=cache, deep=True, jobs=jobs)
+    cache.save()
+
+    objs = [
+        {"path": str(path.relative_to(data_dir)), "sha256": sha}
+        for path, sha in shas.items()
+    ]
+    with open(data_dir / INVENTORY_FILE, "wt") as outfile:
         yaml.dump({"files": objs}, outfile)
 
 
@@ -141,18 +475,25 @@ def create_inventory_command(data: str):
     type=click.Path(exists=True, dir_okay=True, file_okay=False, readable=True),
     default="data",
 )
-def compute_sha_command(data: str):
+@_jobs_option
+def compute_sha_command(data: str, jobs: Optional[int]):
     """ Append the shas to every entry in an inventory file """
     data_dir = Path(data)
-    with open(data_dir / "inventory.yml", "rt") as infile:
+    with open(data_dir / INVENTORY_FILE, "rt") as infile:
         inventory = yaml.safe_load(infile)
 
+    cache = ShaCache(data_dir / SHA_CACHE_FILE)
+    shas = compute_shas(
+        [data_dir / file_obj["path"] for file_obj in inventory["files"]],
+        cache=cache,
+        deep=True,
+        jobs=jobs,
+    )
+    cache.save()
     for file_obj in inventory["files"]:
-        file_path = Path(file_obj["path"])
-        sha = compute_sha(data_dir / file_path)
-        file_obj["sha256"] = sha
+        file_obj["sha256"] = shas[data_dir / file_obj["path"]]
 
-    with open(data_dir / "inventory.yml", "wt") as outfile:
+    with open(data_dir / INVENTORY_FILE, "wt") as outfile:
         yaml.safe_dump(inventory, outfile)
 
 
@@ -164,21 +505,30 @@ def compute_sha_command(data: str):
     type=click.Path(exists=True, dir_okay=True, file_okay=False, readable=True),
     default="data",
 )
-def verify_inventory_command(data: str):
-    """ Verify that all data files match the shas in inventory """
+@click.option(
+    "--deep",
+    is_flag=True,
+    help="Reread every file, even those unchanged since they were last hashed",
+)
+@_jobs_option
+def verify_inventory_command(data: str, deep: bool, jobs: Optional[int]):
+    """
+    Verify that all data files match the shas in inventory. Prints a JSON summary
+    and exits with a non-zero status if any file is missing or does not match.
+    """
     data_dir = Path(data)
-    with open(data_dir / "inventory.yml", "rt") as infile:
+    with open(data_dir / INVENTORY_FILE, "rt") as infile:
         inventory = yaml.safe_load(infile)
 
-    for file_obj in inventory["files"]:
-        expected_sha = file_obj.get("sha256")
-        if not expected_sha:
-            continue
+    summary = verify_inventory(data_dir, inventory, deep=deep, jobs=jobs)
+    for path in summary.mismatched:
+        click.echo(f"file {path} does not match sha", err=True)
+    for path in summary.missing:
+        click.echo(f"file {path} is missing", err=True)
 
-        file_path = Path(file_obj["path"])
-        sha = compute_sha(data_dir / file_path)
-        if not sha == expected_sha:
-            click.echo(f"file {file_obj['path']} does not match sha")
+    click.echo(json.dumps({"ok": summary.ok, **summary._asdict()}, indent=2))
+    if not summary.ok:
+        sys.exit(1)
 
 
 @inventory_group.command("recreate-data-dir")
@@ -212,6 +562,125 @@ def recreate_data_dir_command(old_data: str, new_data: str):
     (new_data_dir / "data_shared_externally").mkdir(exist_ok=True, parents=True)
 
 
+@cli.command("synth")
+@click.option(
+    "--scale",
+    "-s",
+    type=click.FloatRange(min=0, min_open=True),
+    default=1.0,
+    help="How many times the size of the study to make the data; 10 is ~10M claims",
+)
+@click.option(
+    "--data-dir",
+    "-d",
+    type=click.Path(file_okay=False),
+    default="synthetic_data",
+    help="Where to write the synthetic data tree",
+)
+@click.option("--seed", type=int, default=DEFAULT_SEED, help="What to draw from")
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=2_000,
+    help="How many members' claims to hold in memory at once",
+)
+def synth_command(scale: float, data_dir: str, seed: int, chunk_size: int):
+    """ Write a synthetic data tree with the files and columns of the private data """
+    if (Path(data_dir) / "inventory.yml").exists():
+        raise click.UsageError(
+            f"{data_dir} has an inventory.yml, so it looks like the real data"
+        )
+    written = synthesize(data_dir, scale=scale, seed=seed, chunk_size=chunk_size)
+    click.echo(json.dumps(written, indent=2))
+
+
+@cli.group("safetypad")
+def safetypad_group():
+    """
+    Commands related to the SafetyPAD API
+    """
+
+
+@safetypad_group.command("pull")
+@click.option(
+    "--pcr-file",
+    "-p",
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+    required=True,
+    help="A pickle, or a file with one ID per line, of the PCRs to pull",
+)
+@click.option(
+    "--manifest",
+    "-m",
+    type=click.Path(dir_okay=False),
+    default=str(PRIVATE_DATA_DIR / "pcrs" / "pulled_pcrs.jsonl"),
+    help="The JSON lines file the PCRs are appended to; rerun to resume",
+)
+@click.option(
+    "--api-key",
+    envvar="SAFETYPAD_API_KEY",
+    default=None,
+    help="Defaults to $SAFETYPAD_API_KEY or safetypad.api_key in creds.yml",
+)
+@click.option("--base-url", default=BASE_URL, help="Where the SafetyPAD API lives")
+@click.option("--rate", type=float, default=1.0, help="Requests per second")
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=4,
+    help="How many requests to have in flight at once",
+)
+@click.option(
+    "--max-retries",
+    type=click.IntRange(min=0),
+    default=5,
+    help="How many times to retry each failed request, with exponential backoff",
+)
+def safetypad_pull_command(
+    pcr_file: str,
+    manifest: str,
+    api_key: Optional[str],
+    base_url: str,
+    rate: float,
+    jobs: int,
+    max_retries: int,
+):
+    """ Pull PCRs from SafetyPAD, skipping those already in the manifest """
+    if not api_key:
+        if not CREDENTIALS_FILE.exists():
+            raise click.UsageError(f"No API key passed and no {CREDENTIALS_FILE}")
+        with open(CREDENTIALS_FILE, "rt") as infile:
+            api_key = yaml.safe_load(infile)["safetypad"]["api_key"]
+
+    client = SafetyPadClient(
+        api_key,
+        base_url=base_url,
+        rate=rate,
+        max_retries=max_retries,
+        pool_size=jobs,
+    )
+    pcr_ids = read_pcr_ids(pcr_file)
+
+    def _progress(num_done: int, num_to_do: int):
+        if num_done % 100 == 0 or num_done == num_to_do:
+            click.echo(f"On {num_done}/{num_to_do}", err=True)
+
+    summary = pull_pcrs(client, pcr_ids, manifest, jobs=jobs, progress=_progress)
+    click.echo(
+        json.dumps(
+            {
+                "skipped": summary.skipped,
+                "pulled": summary.pulled,
+                "failed": summary.failed,
+            },
+            indent=2,
+        )
+    )
+    if summary.failed:
+        sys.exit(1)
+
+
 @cli.command("convert-nb-to-rmd")
 @click.argument("filename")
 @click.option(
@@ -49,13 +49,19 @@ EXTERNAL_DIR = DATA_DIR / "data_shared_externally"
 INTERMEDIATE_DIR = DATA_DIR / "intermediate_objects"
 OUTPUT_DIR = BASE_DIR / "output"
 SAFETYPAD_DIR = PRIVATE_DATA_DIR / "safetypad"
+# Derived copies of the data kept only to speed things up; not inventoried
+CACHE_DIR = DATA_DIR / ".cache"
 
 CREDENTIALS_FILE = BASE_DIR / "creds.yml"
 
 EMS_EVENTS_2016 = PUBLIC_DATA_DIR / "2016_EMS_Events.csv.gz"
+NYU_ED_FILE = PUBLIC_DATA_DIR / "nyu_ed.xlsx"
 
 SQL_DUMP_FILE = PRIVATE_DATA_DIR / "ntl_sql_dump.parquet"
 PKL_FILE = PRIVATE_DATA_DIR / "ntl_summary_raw.pkl"
 
+PT_LEVEL_BENEFICIARY = INTERMEDIATE_DIR / "ptlevel_beneficonly.csv"
+PT_LEVEL_WBOUNDS = INTERMEDIATE_DIR / "ptlevel_forrobust.csv"
+
 NTL_START_DATE = "2018-03-19"
 NTL_END_DATE = "2019-03-01"
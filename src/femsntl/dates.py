@@ -0,0 +1,137 @@
+"""
+Parse whole columns of messy dates (e.g., dates of birth) at once
+"""
+import enum
+import re
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from dateutil import parser
+
+
+class DateFormat(enum.IntEnum):
+    """ Which parser a date was read with """
+
+    MISSING = 0
+    MDY = 1  # 1/15/1980
+    MDY_SHORT_YEAR = 2  # 1/15/80
+    YMD = 3  # 1980/1/15
+    ISO = 4  # 1980-01-15
+    ISO_MIDNIGHT = 5  # 1980-01-15 00:00:00
+    FALLBACK = 6  # anything else dateutil can make sense of
+    FAILED = 7
+
+
+class _FixedFormat(NamedTuple):
+    date_format: DateFormat
+    pattern: "re.Pattern[str]"
+    strptime_format: str
+
+
+FIXED_FORMATS: Tuple[_FixedFormat, ...] = (
+    _FixedFormat(DateFormat.MDY, re.compile(r"\d{1,2}/\d{1,2}/\d{4}"), "%m/%d/%Y"),
+    _FixedFormat(
+        DateFormat.MDY_SHORT_YEAR, re.compile(r"\d{1,2}/\d{1,2}/\d{2}"), "%m/%d/%Y"
+    ),
+    _FixedFormat(DateFormat.YMD, re.compile(r"\d{4}/\d{1,2}/\d{1,2}"), "%Y/%m/%d"),
+    _FixedFormat(DateFormat.ISO, re.compile(r"\d{4}-\d{1,2}-\d{1,2}"), "%Y-%m-%d"),
+    _FixedFormat(
+        DateFormat.ISO_MIDNIGHT,
+        re.compile(r"\d{4}-\d{1,2}-\d{1,2} 00:00:00"),
+        "%Y-%m-%d %H:%M:%S",
+    ),
+)
+
+
+class ParsedDates(NamedTuple):
+    """
+    The result of `parse_dates`:
+        * dates: the parsed dates (NaT where missing or unparseable)
+        * formats: a categorical of `DateFormat` names saying how each was parsed
+        * n_failed: the number of non-missing values that could not be parsed
+    """
+
+    dates: pd.Series
+    formats: pd.Series
+    n_failed: int
+
+
+def _parse_fallback(date: str) -> pd.Timestamp:
+    try:
+        return pd.Timestamp(parser.parse(date).replace(tzinfo=None))
+    except (ValueError, OverflowError, TypeError, pd.errors.OutOfBoundsDatetime):
+        return pd.NaT
+
+
+def parse_dates(
+    values: pd.Series,
+    formats: Optional[Sequence[DateFormat]] = None,
+    century: int = 1900,
+    fallback: bool = True,
+) -> ParsedDates:
+    """
+    Parse a column of date strings in one pass. Each distinct string is parsed only
+    once: first by the fixed formats in `formats` (in order, each only tried on the
+    strings that look like it), then, if `fallback` is True, the leftovers are given
+    to `dateutil.parser.parse`, which gives the same answer `try_parser` used to.
+
+    Two-digit years are read as being in `century`, as `standardize_year` does, since
+    these are mostly birthdates. Dates outside the range pandas can represent
+    (roughly 1677-2262) count as failures.
+
+    Arguments:
+        values: The strings to parse
+        formats: Which fixed formats to try. Defaults to all of them
+        century: The century two-digit years belong to
+        fallback: Whether to try dateutil on strings no fixed format matches
+
+    Returns:
+        The parsed dates, how each was parsed and the number of failures
+    """
+    values = pd.Series(values)
+    formats = list(formats) if formats is not None else list(DateFormat)
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object).astype(str).str.strip()
+
+    parsed = pd.Series(pd.NaT, index=uniques.index, dtype="datetime64[ns]")
+    parsed_with = np.full(len(uniques), DateFormat.FAILED, dtype=np.int8)
+    for fixed in FIXED_FORMATS:
+        if fixed.date_format not in formats:
+            continue
+        todo = (parsed_with == DateFormat.FAILED) & uniques.str.fullmatch(
+            fixed.pattern
+        ).values
+        if not todo.any():
+            continue
+
+        strings = uniques[todo]
+        if fixed.date_format == DateFormat.MDY_SHORT_YEAR:
+            strings = strings.str[:-2] + str(century // 100) + strings.str[-2:]
+        dates = pd.to_datetime(strings, format=fixed.strptime_format, errors="coerce")
+        parsed[todo] = dates
+        parsed_with[np.flatnonzero(todo)[dates.notna().values]] = fixed.date_format
+
+    if fallback:
+        todo = parsed_with == DateFormat.FAILED
+        dates = pd.to_datetime(
+            pd.Series([_parse_fallback(date) for date in uniques[todo]], dtype=object)
+        )
+        parsed[todo] = dates.values
+        parsed_with[np.flatnonzero(todo)[dates.notna().values]] = DateFormat.FALLBACK
+
+    # Missing values are coded as -1, which picks up the last entry
+    all_dates = np.append(parsed.values, np.datetime64("NaT", "ns"))
+    all_formats = np.append(parsed_with, np.int8(DateFormat.MISSING))
+    row_formats = all_formats[codes]
+    return ParsedDates(
+        dates=pd.Series(all_dates[codes], index=values.index, name=values.name),
+        formats=pd.Series(
+            pd.Categorical.from_codes(
+                row_formats, categories=[date_format.name for date_format in DateFormat]
+            ),
+            index=values.index,
+            name=values.name,
+        ),
+        n_failed=int((row_formats == DateFormat.FAILED).sum()),
+    )
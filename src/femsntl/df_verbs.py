@@ -1,19 +1,102 @@
 """
 A file that contains some extra verbs for interacting with data frames
 """
-from typing import List
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import pandas as pd
 
 
-def case_when(*args) -> np.ndarray:
+# A condition or value of case_when: an array, a Series aligned by index, a
+# scalar, or a function of the rows still to assign (conditions can also be
+# expressions for DataFrame.eval)
+CaseArg = Union[np.ndarray, pd.Series, Callable[[pd.DataFrame], Any], Any]
+
+
+def _is_lazy(arg: CaseArg, is_condition: bool) -> bool:
+    return callable(arg) or (is_condition and isinstance(arg, str))
+
+
+def _evaluate(
+    arg: CaseArg, is_condition: bool, rows: np.ndarray, data: Optional[pd.DataFrame]
+) -> Any:
+    """ The condition or value `arg` at the rows where the mask `rows` is True """
+    every_row = rows.all()
+    if _is_lazy(arg, is_condition):
+        if data is None:
+            raise ValueError("Pass data to evaluate functions and expressions")
+        subset = data if every_row else data[rows]
+        result = subset.eval(arg) if isinstance(arg, str) else arg(subset)
+        return result if np.ndim(result) == 0 else np.asarray(result)
+    if np.ndim(arg) == 0:
+        return arg
+    values = np.asarray(arg)
+    return values if every_row else values[rows]
+
+
+def _as_mask(condition: Any, num_rows: int) -> np.ndarray:
+    """ A condition as a boolean array, with missing values as False """
+    if np.ndim(condition) == 0:
+        return np.full(num_rows, False if pd.isna(condition) else bool(condition))
+    if getattr(condition, "dtype", None) == bool:
+        return np.asarray(condition)
+    return pd.Series(condition).fillna(False).to_numpy(dtype=bool)
+
+
+def _level_codes(values: Any, categories: pd.Index) -> Union[int, np.ndarray]:
+    """
+    The positions of `values` in `categories`, with -1 for missing values
+
+    Raises:
+        ValueError: If a value is neither missing nor in `categories`
+    """
+    values = np.asarray(values, dtype=object)
+    codes = categories.get_indexer(values.ravel()).reshape(values.shape)
+    unknown = (codes == -1) & pd.notna(values)
+    if unknown.any():
+        raise ValueError(f"{values[unknown].ravel()[0]!r} is not one of the levels")
+    return codes
+
+
+def _result_dtype(values: Sequence[Any]) -> np.dtype:
+    """ The dtype np.select would pick for `values`, or object if they have none """
+    try:
+        return np.result_type(*[np.asarray(value).dtype for value in values])
+    except TypeError:
+        return np.dtype(object)
+
+
+def case_when(
+    *args,
+    data: Optional[pd.DataFrame] = None,
+    levels: Optional[Sequence[Any]] = None,
+) -> Union[np.ndarray, pd.Categorical]:
     """
     Perform an if/elif/else for a series of arguments that behave like
     a numpy array. This is the transpose of np.select.
 
     Note: If args as odd length, then the _final_ value is the default.
-    Otherwise, it is 0.
+    Otherwise, it is 0 (or missing if `levels` are passed).
+
+    Conditions and values are evaluated in order, and each only for the rows no
+    earlier condition was true for:
+        * Conditions may be functions of `data` (restricted to those rows) or
+          expressions for `data.eval`, and values may be functions of `data`
+          (restricted to the rows they are for). Neither is called at all once
+          every row has a value
+        * Series are aligned to the index of `data` (or of the first Series
+          passed) before being used
+        * Missing conditions are false
 
     Example::
         case_when(
@@ -22,35 +105,205 @@ def case_when(*args) -> np.ndarray:
             "Coprime to 6"
         )
         # returns np.array(["Even", "Coprime to 6", "Even", "Multiple of 3", "Even"])
+
+        case_when(
+            "has_name & has_dob", "Name and DOB",
+            lambda df: df.has_name, "Name but no DOB",
+            "None",
+            data=df,
+            levels=["Name and DOB", "Name but no DOB", "None"],
+        )
+        # returns a pd.Categorical with the three levels, in that order
+
+    Args:
+        args: Conditions and values, alternating, and optionally a default
+        data: The rows to evaluate functions and expressions on
+        levels: If passed, return a pd.Categorical with these categories rather
+            than an array. Every value must be one of them or missing
+
+    Returns:
+        The value for each row, as an array or a pd.Categorical
+
+    Raises:
+        ValueError: If a function or expression is passed without `data` (or
+            nothing says how many rows there are), or a value is not one of the
+            `levels`
     """
     even_out_len = (len(args) // 2) * 2
-    return np.select(
-        args[:even_out_len:2],
-        args[1:even_out_len:2],
-        default=args[-1] if len(args) % 2 == 1 else 0,
+    default = args[-1] if len(args) % 2 == 1 else (0 if levels is None else np.nan)
+
+    if data is not None:
+        index = data.index
+    else:
+        index = next((arg.index for arg in args if isinstance(arg, pd.Series)), None)
+    args = [
+        arg.reindex(index)
+        if isinstance(arg, pd.Series) and not arg.index.equals(index)
+        else arg
+        for arg in args[:even_out_len] + (default,)
+    ]
+
+    if data is not None:
+        num_rows = len(data)
+    else:
+        sized = [
+            arg
+            for i, arg in enumerate(args)
+            if not _is_lazy(arg, i % 2 == 0 and i < even_out_len) and np.ndim(arg) > 0
+        ]
+        if not sized:
+            raise ValueError("Pass data or at least one array-like argument")
+        num_rows = len(sized[0])
+
+    # The rows each value is for (as masks), and the values at those rows
+    assigned = []
+    every_row = np.ones(num_rows, dtype=bool)
+    unassigned = every_row.copy()
+    for condition, value in zip(args[:even_out_len:2], args[1:even_out_len:2]):
+        if not unassigned.any():
+            break
+        if _is_lazy(condition, True):
+            rows = unassigned.copy()
+            rows[unassigned] = _as_mask(
+                _evaluate(condition, True, unassigned, data), unassigned.sum()
+            )
+        else:
+            rows = unassigned & _as_mask(
+                _evaluate(condition, True, every_row, data), num_rows
+            )
+        unassigned &= ~rows
+        assigned.append((rows, _evaluate(value, False, rows, data)))
+    if unassigned.any() or not _is_lazy(args[-1], False):
+        assigned.append((unassigned, _evaluate(args[-1], False, unassigned, data)))
+
+    if levels is not None:
+        categories = pd.Index(levels)
+        codes = np.full(num_rows, -1, dtype=np.min_scalar_type(-len(categories)))
+        for rows, values in assigned:
+            codes[rows] = _level_codes(values, categories)
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+    output = np.empty(num_rows, dtype=_result_dtype([values for _, values in assigned]))
+    for rows, values in assigned:
+        output[rows] = values
+    return output
+
+
+# The number of pairs cross_join builds at a time
+CHUNK_SIZE = 1_000_000
+
+Predicate = Callable[[pd.DataFrame], Union[np.ndarray, pd.Series]]
+
+
+def _take(df: pd.DataFrame, positions: np.ndarray) -> pd.DataFrame:
+    """ The rows of `df` at `positions`, or rows of missing values if `df` is empty """
+    if len(df) == 0:
+        return df.reset_index(drop=True).reindex(positions)
+    return df.iloc[positions]
+
+
+def _with_suffixes(
+    left_df: pd.DataFrame, right_df: pd.DataFrame, suffixes: Tuple[str, str]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """ Add `suffixes` to the names of columns in both data frames, as merge does """
+    overlap = left_df.columns.intersection(right_df.columns)
+    if len(overlap) == 0:
+        return left_df, right_df
+    return (
+        left_df.rename(columns={col: col + suffixes[0] for col in overlap}),
+        right_df.rename(columns={col: col + suffixes[1] for col in overlap}),
     )
 
 
-def cross_join(left_df: pd.DataFrame, right_df: pd.DataFrame) -> pd.DataFrame:
+def _pairs(
+    left_df: pd.DataFrame,
+    right_df: pd.DataFrame,
+    left_positions: np.ndarray,
+    right_positions: np.ndarray,
+    index: pd.Index,
+) -> pd.DataFrame:
+    """ The pairs of the rows of `left_df` and `right_df` at the given positions """
+    left_rows = _take(left_df, left_positions)
+    right_rows = _take(right_df, right_positions)
+    left_rows.index = right_rows.index = index
+    return pd.concat([left_rows, right_rows], axis=1)
+
+
+def iter_cross_join(
+    left_df: pd.DataFrame,
+    right_df: pd.DataFrame,
+    predicate: Optional[Predicate] = None,
+    chunk_size: int = CHUNK_SIZE,
+    suffixes: Tuple[str, str] = ("_x", "_y"),
+) -> Iterator[pd.DataFrame]:
     """
-    Perform a CROSS JOIN between `left_df` and `right_df`.
+    Perform a CROSS JOIN between `left_df` and `right_df` a chunk of pairs at a
+    time, keeping only the pairs that pass `predicate`. Each chunk is built by
+    position from the two data frames, so at most `chunk_size` pairs (and the
+    pairs kept so far, if the caller keeps them) are ever in memory.
+
+    Pairs come in the order of `left_df`, and then of `right_df`. As with an outer
+    merge, if one data frame is empty, the rows of the other are paired with
+    missing values.
 
     Args:
         left_df: The left hand data frame to cross join
         right_df: The right hand data frame to cross join
+        predicate: If passed, a function of a chunk of pairs returning whether to
+            keep each, e.g., whether the pair's dates are within a week
+        chunk_size: How many pairs to build at a time
+        suffixes: Added to the names of columns in both data frames, as in merge
+
+    Yields:
+        The pairs kept from each chunk, indexed by their position in the full
+        cross join. Chunks with no pairs kept are skipped
     """
-    # Some modifications need to be made to the data frames, so we make copies
-    left_df = left_df.copy()
-    right_df = right_df.copy()
+    left_df, right_df = _with_suffixes(left_df, right_df, suffixes)
+
+    # An empty data frame pairs as a single row of missing values
+    num_right = max(len(right_df), 1)
+    num_pairs = max(len(left_df), 1) * num_right if len(left_df) + len(right_df) else 0
+
+    for start in range(0, num_pairs, chunk_size):
+        pair_ids = np.arange(start, min(start + chunk_size, num_pairs))
+        left_positions, right_positions = np.divmod(pair_ids, num_right)
+        chunk = _pairs(
+            left_df, right_df, left_positions, right_positions, pd.Index(pair_ids)
+        )
+        if predicate is not None:
+            chunk = chunk[np.asarray(predicate(chunk), dtype=bool)]
+        if len(chunk):
+            yield chunk
 
-    key = "key"
-    while key in left_df or key in right_df:
-        key += "key"
 
-    left_df[key] = 0
-    right_df[key] = 0
+def cross_join(
+    left_df: pd.DataFrame,
+    right_df: pd.DataFrame,
+    predicate: Optional[Predicate] = None,
+    chunk_size: int = CHUNK_SIZE,
+    suffixes: Tuple[str, str] = ("_x", "_y"),
+) -> pd.DataFrame:
+    """
+    Perform a CROSS JOIN between `left_df` and `right_df`. If one data frame is
+    empty, the rows of the other are returned with missing values for its columns.
 
-    return left_df.merge(right_df, how="outer", on=key).drop(key, axis=1)
+    Args:
+        left_df: The left hand data frame to cross join
+        right_df: The right hand data frame to cross join
+        predicate: If passed, a function of a chunk of pairs returning whether to
+            keep each. The full cross join is never built, only `chunk_size`
+            pairs at a time; see `iter_cross_join`
+        chunk_size: How many pairs to build at a time
+        suffixes: Added to the names of columns in both data frames, as in merge
+    """
+    chunks = list(
+        iter_cross_join(left_df, right_df, predicate, chunk_size, suffixes=suffixes)
+    )
+    if not chunks:
+        no_rows = np.array([], dtype=int)
+        left_df, right_df = _with_suffixes(left_df, right_df, suffixes)
+        chunks = [_pairs(left_df, right_df, no_rows, no_rows, pd.RangeIndex(0))]
+    return pd.concat(chunks, ignore_index=True)
 
 
 def find_ids(df: pd.DataFrame, id_var: str, subset_var: str) -> List[str]:
@@ -69,6 +322,203 @@ def find_ids(df: pd.DataFrame, id_var: str, subset_var: str) -> List[str]:
     return df.loc[df[subset_var].notna(), id_var].unique()
 
 
+class Window(NamedTuple):
+    """
+    An output of `window`:
+        * column: the column it is computed from; None for outputs that only
+          depend on the order of the rows
+        * function: one of
+            - "max", "min": the largest/smallest value in the group
+            - "count": the number of values in the group which are not missing
+            - "size": the number of rows in the group
+            - "row_number": 1 for the first row in the group, 2 for the next...
+            - "cumcount": the row number minus 1
+            - "rank": 1 + the number of rows in the group before the row,
+              sharing ranks between ties in `order_by` as SQL's RANK does
+            - "ties": the number of rows in the group tied with the row in
+              `order_by`, including itself
+            - "first", "last": the value in the group's first/last row
+            - "lag", "lead": the value `offset` rows before/after in the group
+        * offset: how far "lag" and "lead" look
+    """
+
+    column: Optional[str]
+    function: str
+    offset: int = 1
+
+
+WINDOW_FUNCTIONS = (
+    "max",
+    "min",
+    "count",
+    "size",
+    "row_number",
+    "cumcount",
+    "rank",
+    "ties",
+    "first",
+    "last",
+    "lag",
+    "lead",
+)
+
+
+def _codes(values: pd.Series, ascending: Optional[bool] = None) -> np.ndarray:
+    """
+    Integer codes for `values`, with -1 for missing values. If `ascending` is
+    passed, the codes are in (or in reverse) order of the values.
+    """
+    codes, uniques = pd.factorize(values, sort=ascending is not None)
+    if ascending is False:
+        codes = np.where(codes >= 0, len(uniques) - 1 - codes, -1)
+    return codes
+
+
+def group_codes(df: pd.DataFrame, by: Sequence[str]) -> np.ndarray:
+    """
+    One integer code per combination of the values of `by`, with -1 if any of them
+    is missing, e.g., to sort or search rows by group with numpy
+    """
+    codes = [_codes(df[col]) for col in by]
+    sizes = [max(code.max() + 1, 1) if len(code) else 1 for code in codes]
+    missing = np.any([code < 0 for code in codes], axis=0)
+    combined = np.ravel_multi_index([np.maximum(code, 0) for code in codes], sizes)
+    return np.where(missing, -1, combined)
+
+
+def window(
+    df: pd.DataFrame,
+    by: Union[str, Sequence[str]],
+    order_by: Union[None, str, Sequence[str]] = None,
+    ascending: Union[bool, Sequence[bool]] = True,
+    **outputs: Union[Window, Tuple],
+) -> pd.DataFrame:
+    """
+    Compute several window functions over the groups of `df` in one pass: the
+    groups are found once, the rows sorted once by group and `order_by`, and
+    every output read off the sorted rows. Like `groupby(...).transform(...)`,
+    each row gets its group's value, and rows missing any of `by` get missing
+    values.
+
+    Example::
+        window(
+            calls,
+            "MedicaidSystemID",
+            order_by="date",
+            call_number=(None, "row_number"),
+            first_call=("date", "first"),
+            previous_call=("date", "lag"),
+            max_points=("match_points", "max"),
+        )
+
+    Args:
+        df: The data frame to examine
+        by: The column(s) to group by
+        order_by: The column(s) to order rows within groups by. Ties, and rows
+            when not passed, keep their order in `df`. Missing values sort last
+        ascending: Whether to sort each of `order_by` ascending
+        outputs: The name of each output and the `Window` (or a tuple of its
+            fields) to compute for it
+
+    Returns:
+        The outputs, with the index of `df`. The integer functions ("count",
+        "size", "row_number", "cumcount", "rank" and "ties") are nullable
+        Int64, so they stay integers whether or not any rows are missing
+
+    Raises:
+        ValueError: If a function is not one of WINDOW_FUNCTIONS, or is "rank"
+            or "ties" without `order_by`
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    order_by = [order_by] if isinstance(order_by, str) else list(order_by or [])
+    if isinstance(ascending, bool):
+        ascending = [ascending] * len(order_by)
+    windows = {name: Window(*spec) for name, spec in outputs.items()}
+    for name, spec in windows.items():
+        if spec.function not in WINDOW_FUNCTIONS:
+            raise ValueError(f"Unknown window function {spec.function} for {name}")
+        if spec.function in ("rank", "ties") and not order_by:
+            raise ValueError(f"{spec.function} for {name} needs order_by")
+
+    # Sort the rows by group, then order_by, dropping those without a group.
+    # Missing order values are -1, so move them to the end.
+    groups = group_codes(df, by)
+    order_codes = [_codes(df[col], asc) for col, asc in zip(order_by, ascending)]
+    order_codes = [np.where(code < 0, len(df), code) for code in order_codes]
+    positions = np.lexsort(order_codes[::-1] + [groups])
+    positions = positions[groups[positions] >= 0]
+    num_rows = len(positions)
+    sorted_groups = groups[positions]
+
+    row = np.arange(num_rows)
+    is_group_start = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]][:num_rows]
+    starts = np.flatnonzero(is_group_start)
+    group_ids = np.cumsum(is_group_start) - 1
+    group_start = starts[group_ids]
+    group_size = np.diff(np.r_[starts, num_rows])[group_ids]
+
+    # Runs of rows tied in order_by, and whether the row has all of them
+    is_run_start = is_group_start.copy()
+    has_order = np.ones(num_rows, dtype=bool)
+    for code in order_codes:
+        sorted_code = code[positions]
+        is_run_start[1:] |= sorted_code[1:] != sorted_code[:-1]
+        has_order &= sorted_code < len(df)
+    run_starts = np.flatnonzero(is_run_start)
+    run_ids = np.cumsum(is_run_start) - 1
+
+    # Where each sorted row goes in the output, with -1 (missing) for rows which
+    # have no group
+    output_rows = np.full(len(df), -1)
+    output_rows[positions] = row
+
+    def _output(values: Union[np.ndarray, pd.Series]) -> pd.Series:
+        series = pd.Series(values).reset_index(drop=True).reindex(output_rows)
+        series.index = df.index
+        return series
+
+    def _integers(values: np.ndarray, mask: Optional[np.ndarray] = None) -> pd.Series:
+        series = pd.Series(values, dtype="Int64")
+        return _output(series if mask is None else series.where(mask))
+
+    result = {}
+    for name, (column, function, offset) in windows.items():
+        values = df[column].iloc[positions].reset_index(drop=True) if column else None
+        if function == "size":
+            result[name] = _integers(group_size)
+        elif function == "row_number":
+            result[name] = _integers(row - group_start + 1)
+        elif function == "cumcount":
+            result[name] = _integers(row - group_start)
+        elif function == "rank":
+            result[name] = _integers(run_starts[run_ids] - group_start + 1, has_order)
+        elif function == "ties":
+            run_size = np.diff(np.r_[run_starts, num_rows])[run_ids]
+            result[name] = _integers(run_size, has_order)
+        elif function == "count":
+            counts = np.add.reduceat(values.notna().values, starts) if num_rows else []
+            result[name] = _integers(np.asarray(counts, dtype=int)[group_ids])
+        elif function in ("max", "min") and values.dtype.kind in "biuf" and num_rows:
+            # fmax and fmin skip missing values, as pandas does
+            ufunc = np.fmax if function == "max" else np.fmin
+            result[name] = _output(ufunc.reduceat(values.values, starts)[group_ids])
+        elif function in ("max", "min"):
+            extreme = values.groupby(group_ids, sort=False).transform(function)
+            result[name] = _output(extreme)
+        elif function in ("first", "last"):
+            ends = group_start if function == "first" else group_start + group_size - 1
+            result[name] = _output(values.take(ends).values)
+        else:
+            step = offset if function == "lag" else -offset
+            source = np.where(
+                (row - step >= group_start) & (row - step < group_start + group_size),
+                row - step,
+                -1,
+            )
+            result[name] = _output(values.reindex(source).values)
+    return pd.DataFrame(result, index=df.index)
+
+
 def append_max_and_count(
     df: pd.DataFrame,
     id_col: str = "name_dob_id",
@@ -86,8 +536,13 @@ def append_max_and_count(
     """
     df = df if inplace else df.copy()
 
-    df[f"max_{value_col}"] = df.groupby(id_col)[value_col].transform("max")
-    df[f"count_of_{value_col}"] = df.groupby([id_col, value_col])[value_col].transform(
-        "count"
+    outputs = window(
+        df,
+        id_col,
+        order_by=value_col,
+        max=(value_col, "max"),
+        count=(value_col, "ties"),
     )
+    df[f"max_{value_col}"] = outputs["max"]
+    df[f"count_of_{value_col}"] = outputs["count"]
     return df
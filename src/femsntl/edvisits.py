@@ -0,0 +1,218 @@
+"""
+Coding emergency department (ED) visits in the Medicaid claims, as
+`070_medicaid_constructoutcomes.ipynb` does.
+
+Claims are ED visits and/or inpatient admissions by their revenue codes, and ED
+visits are classified by their primary diagnosis with the NYU ED algorithm
+(`public_data/nyu_ed.xlsx`). The algorithm's table is compiled once into a lookup
+with normalized ICD-10 codes and cached, named for the spreadsheet's sha256, so
+later runs neither reparse the spreadsheet nor merge against it.
+"""
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from . import store
+from .datafiles import CACHE_DIR, NYU_ED_FILE
+from .readers import as_str, source_sha
+
+NYU_ED_CACHE_DIR = CACHE_DIR / "nyu_ed"
+
+# Bump when the compiled lookup changes so that old caches are not reused
+LOOKUP_VERSION = 1
+
+ICD_COLUMN = "icd10cm"
+
+# Revenue codes for an ED visit (045X and the professional fee 0981) and for room
+# and board, i.e., the visit resulted in an inpatient stay
+ED_VISIT_CODES = tuple(f"045{idx}" for idx in range(10)) + ("0981",)
+ROOM_BOARD_CODES = tuple(f"0{idx}" for idx in range(100, 220))
+
+RevenueCodes = Sequence[str]
+
+
+def normalize_icd(codes: pd.Series) -> pd.Series:
+    """ Uppercase ICD-10 codes and drop their dots and spaces: "s01.00xa" -> "S0100XA" """
+    return codes.str.upper().str.replace(r"[.\s]", "", regex=True)
+
+
+class DiagnosisLookup(NamedTuple):
+    """
+    The NYU ED algorithm compiled for lookups:
+        * classes: the algorithm's columns, indexed by normalized ICD-10 code
+        * prefix_lengths: the lengths of the codes in the index, longest first,
+          which are the only prefixes worth trying when a code is not listed
+    """
+
+    classes: pd.DataFrame
+    prefix_lengths: Tuple[int, ...]
+
+
+def compile_lookup(nyu_ed: pd.DataFrame, code_col: str = ICD_COLUMN) -> pd.DataFrame:
+    """
+    Normalize the codes of the NYU ED algorithm's table and sort it by them. If a
+    code is listed more than once after normalizing, its first row is kept.
+    """
+    df = nyu_ed.copy()
+    for col in df.columns[df.dtypes == object]:
+        df[col] = as_str(df[col])
+    df[code_col] = normalize_icd(df[code_col])
+    return (
+        df.dropna(subset=[code_col])
+        .drop_duplicates(subset=[code_col])
+        .sort_values(code_col)
+        .reset_index(drop=True)
+    )
+
+
+def _as_lookup(compiled: pd.DataFrame, code_col: str) -> DiagnosisLookup:
+    classes = compiled.set_index(code_col)
+    lengths = classes.index.str.len().unique()
+    return DiagnosisLookup(classes, tuple(sorted(map(int, lengths), reverse=True)))
+
+
+def read_lookup(
+    filename: Union[str, Path] = NYU_ED_FILE,
+    code_col: str = ICD_COLUMN,
+    cache_dir: Optional[Path] = NYU_ED_CACHE_DIR,
+) -> DiagnosisLookup:
+    """
+    Read the NYU ED algorithm's table and compile it with `compile_lookup`. If
+    `cache_dir` is passed, the compiled table is stored there the first time,
+    named for the spreadsheet's sha256, and later reads come from it. Pass None
+    to always reparse the spreadsheet.
+    """
+    filename = Path(filename)
+    if cache_dir is None:
+        return _as_lookup(compile_lookup(pd.read_excel(filename), code_col), code_col)
+
+    key = f"{source_sha(filename)}-v{LOOKUP_VERSION}"
+    try:
+        compiled = store.read(key, base_dir=cache_dir)
+    except ValueError:
+        compiled = compile_lookup(pd.read_excel(filename), code_col)
+        store.write(key, compiled, base_dir=cache_dir)
+    return _as_lookup(compiled, code_col)
+
+
+def classify_diagnoses(
+    codes: pd.Series, lookup: DiagnosisLookup, prefix_fallback: bool = False
+) -> pd.DataFrame:
+    """
+    Look up the NYU ED classification of each diagnosis code.
+
+    Arguments:
+        codes: ICD-10 codes, with or without dots
+        lookup: The compiled algorithm from `read_lookup`
+        prefix_fallback: If True, codes not in the algorithm take the
+            classification of their longest listed prefix, e.g., an unlisted
+            "S0100XA" is classified as "S0100" if that is listed
+
+    Returns:
+        A row per code, with the same index, holding the normalized code the
+        classification came from (in a column named for the lookup's index) and
+        the algorithm's columns. Codes not found are missing throughout
+    """
+    # Claims repeat a few thousand codes, so only look up each once
+    code_ids, uniques = pd.factorize(codes)
+    uniques = normalize_icd(pd.Series(uniques, dtype=object))
+    positions = lookup.classes.index.get_indexer(uniques)
+
+    if prefix_fallback:
+        for length in lookup.prefix_lengths:
+            unmatched = (positions == -1) & (uniques.str.len() > length).values
+            positions[unmatched] = lookup.classes.index.get_indexer(
+                uniques[unmatched].str[:length]
+            )
+
+    # Missing codes (-1) get a position of -1 too, which reindexing leaves missing
+    rows = np.append(positions, -1)[code_ids]
+    classes = lookup.classes.reset_index().reindex(rows)
+    classes.index = codes.index
+    return classes
+
+
+class ClaimCoding(NamedTuple):
+    """
+    The revenue codes that mark a claim:
+        * ed_visit: an emergency department visit
+        * inpatient_admit: an inpatient admission (room and board)
+    """
+
+    ed_visit: RevenueCodes = ED_VISIT_CODES
+    inpatient_admit: RevenueCodes = ROOM_BOARD_CODES
+
+
+def revenue_flags(
+    revenue_codes: pd.Series, code_sets: Dict[str, RevenueCodes]
+) -> Dict[str, np.ndarray]:
+    """
+    Whether each line's revenue code is in each of `code_sets`. Codes are compared
+    as they are, as 070 always has, so "0450" is an ED visit but 450 is not. Only
+    the distinct codes (the categories of a categorical) are compared, and lines
+    pick up their code's flags by position.
+
+    Example::
+        is_ed_visit = revenue_flags(df.RevenueCode, {"ed": ED_VISIT_CODES})["ed"]
+    """
+    if hasattr(revenue_codes, "cat"):
+        code_ids = revenue_codes.cat.codes.values
+        uniques = revenue_codes.cat.categories
+    else:
+        code_ids, uniques = pd.factorize(revenue_codes)
+    uniques = pd.Series(np.asarray(uniques, dtype=object))
+    return {
+        name: np.append(uniques.isin(codes).values, False)[code_ids]
+        for name, codes in code_sets.items()
+    }
+
+
+def code_claims(
+    df: pd.DataFrame,
+    claim_col: str = "ClaimTCNText",
+    revenue_col: str = "RevenueCode",
+    carry: Sequence[str] = ("MedicaidSystemID", "PrimaryDiagnosisCode"),
+    coding: ClaimCoding = ClaimCoding(),
+) -> pd.DataFrame:
+    """
+    Code each claim as an ED visit and/or inpatient admission. Claims have a line
+    per revenue code, and are an ED visit (or admission) if any of their lines
+    is one.
+
+    Arguments:
+        df: Claim lines
+        claim_col: The column identifying claims
+        revenue_col: The revenue codes, as strings (e.g., "0450") or a
+            categorical of strings
+        carry: Columns which are the same on every line of a claim to keep; the
+            first value which is not missing is kept
+        coding: The revenue codes for each kind of claim
+
+    Returns:
+        A row per claim, sorted by `claim_col`, with `is_ed_visit`,
+        `is_inpatient_admit`, the `carry` columns, and whether the claim is an
+        ED visit without (`is_ed_visit_not_inpatient`) or with
+        (`is_ed_visit_with_inpatient`) an admission
+    """
+    flags = revenue_flags(
+        df[revenue_col],
+        {"is_ed_visit": coding.ed_visit, "is_inpatient_admit": coding.inpatient_admit},
+    )
+    claim_ids, claims = pd.factorize(df[claim_col], sort=True)
+    lines = pd.DataFrame(flags, index=df.index).join(df[list(carry)])
+    has_claim = claim_ids >= 0
+
+    grouped = lines[has_claim].groupby(claim_ids[has_claim], sort=True)
+    output_df = grouped[list(flags)].any().join(grouped[list(carry)].first())
+    output_df.insert(0, claim_col, claims.take(output_df.index))
+    output_df = output_df.reset_index(drop=True)
+
+    output_df["is_ed_visit_not_inpatient"] = (
+        output_df.is_ed_visit & ~output_df.is_inpatient_admit
+    )
+    output_df["is_ed_visit_with_inpatient"] = (
+        output_df.is_ed_visit & output_df.is_inpatient_admit
+    )
+    return output_df
@@ -0,0 +1,203 @@
+"""
+Randomization inference for the effect of the NTL on the outcomes in the patient-level
+tables (`ptlevel_beneficonly.csv` and `ptlevel_forrobust.csv`).
+
+Callers were randomly assigned to the NTL, so we can test the sharp null of no effect
+by reshuffling the assignments: the p-value of an outcome is the share of
+reassignments whose difference in means is at least as large (in absolute value) as
+the one we saw. Every outcome is tested against the same reassignments at once, which
+are drawn as matrices a block at a time so that memory stays bounded.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .datafiles import PT_LEVEL_BENEFICIARY
+
+TREATMENT_DISPOSITION = "NTL treatment"
+
+# The outcomes analyzed in 080_medicaid_analysis.R
+OUTCOMES = (
+    "is_unnecessary_ED_1ormore_optimistic_24ho",
+    "is_unnecessary_ED_1ormore_optimistic_6mo",
+    "is_PCP_oneormore_optimistic_24ho",
+    "is_PCP_oneormore_optimistic_6mo",
+    "logged_expenditures_24",
+    "logged_expenditures_6",
+)
+
+BLOCK_SIZE = 500
+
+# Differences in means this close are treated as ties
+TOLERANCE = 1e-10
+
+
+def read_outcomes(
+    filename: Union[str, Path] = PT_LEVEL_BENEFICIARY,
+) -> pd.DataFrame:
+    """
+    Read a patient-level outcome table and clean it as `clean_medicaid_data` in
+    `080_medicaid_analysis.R` does: add `is_treatment` and, if the table has
+    expenditures, their logs (missing expenditures stay missing, so those patients
+    are left out of the expenditure outcomes)
+    """
+    df = pd.read_csv(filename)
+    df["is_treatment"] = df.dispo_broad == TREATMENT_DISPOSITION
+    for column, logged in [
+        ("total_expenditures_24ho", "logged_expenditures_24"),
+        ("total_expenditures_6mo", "logged_expenditures_6"),
+    ]:
+        if column in df.columns:
+            df[logged] = np.log(df[column] + 1)
+    return df
+
+
+class _Outcomes(NamedTuple):
+    """
+    The outcomes as matrices:
+        * values: patients by outcomes, with missing values as 0
+        * observed: 1 where the value is not missing, else 0
+    """
+
+    values: np.ndarray
+    observed: np.ndarray
+
+
+def _as_matrices(outcomes: pd.DataFrame) -> _Outcomes:
+    values = outcomes.astype(float).values
+    observed = ~np.isnan(values)
+    return _Outcomes(np.where(observed, values, 0.0), observed.astype(float))
+
+
+def _differences(outcomes: _Outcomes, treated: np.ndarray) -> np.ndarray:
+    """
+    The difference in means (treated minus control) of every outcome under each
+    assignment in `treated` (assignments by patients, 1 if treated). Patients
+    missing an outcome are left out of that outcome's means.
+    """
+    treated_sums = treated @ outcomes.values
+    treated_counts = treated @ outcomes.observed
+    control_sums = outcomes.values.sum(axis=0) - treated_sums
+    control_counts = outcomes.observed.sum(axis=0) - treated_counts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return treated_sums / treated_counts - control_sums / control_counts
+
+
+# Set in each worker process so that the outcomes are only sent to it once
+_PERMUTATION_DATA: Dict[str, Union[_Outcomes, np.ndarray]] = {}
+
+
+def _init_permutations(outcomes: _Outcomes, is_treatment: np.ndarray):
+    _PERMUTATION_DATA.update(outcomes=outcomes, is_treatment=is_treatment)
+
+
+def _count_extreme(
+    num_permutations: int, observed: np.ndarray, seed: np.random.SeedSequence
+) -> np.ndarray:
+    """
+    Draw `num_permutations` reassignments as one matrix and count, for each
+    outcome, those with a difference at least as extreme as `observed`
+    """
+    outcomes = _PERMUTATION_DATA["outcomes"]
+    is_treatment = _PERMUTATION_DATA["is_treatment"]
+    rng = np.random.default_rng(seed)
+
+    # The first num_treated of a random ordering of patients are treated
+    num_patients = len(is_treatment)
+    order = np.argpartition(
+        rng.random((num_permutations, num_patients)),
+        int(is_treatment.sum()) - 1,
+        axis=1,
+    )[:, : int(is_treatment.sum())]
+    treated = np.zeros((num_permutations, num_patients))
+    np.put_along_axis(treated, order, 1.0, axis=1)
+
+    differences = np.abs(_differences(outcomes, treated))
+    return (differences >= np.abs(observed) - TOLERANCE).sum(axis=0)
+
+
+def randomization_test(
+    outcomes: pd.DataFrame,
+    is_treatment: Union[pd.Series, np.ndarray],
+    num_permutations: int = 10_000,
+    seed: int = 0,
+    block_size: int = BLOCK_SIZE,
+    jobs: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Difference-in-means randomization tests of the sharp null of no effect for
+    every outcome at once.
+
+    Arguments:
+        outcomes: A column per outcome and a row per patient. Patients missing an
+            outcome are left out of that outcome's test
+        is_treatment: Whether each patient was assigned to the NTL
+        num_permutations: How many reassignments to draw
+        seed: The seed for the reassignments. Each block of reassignments gets
+            its own stream, so the results do not depend on `jobs`
+        block_size: How many reassignments to draw at a time; memory use is
+            about `block_size` times the number of patients per process
+        jobs: How many processes to draw reassignments in. Defaults to the number
+            of CPUs; 1 draws them all in this process
+
+    Returns:
+        A row per outcome with the `estimate` (the treated mean minus the control
+        mean), the two-sided `p_value` and the `num_permutations`. The p-value is
+        (1 + the number of reassignments at least as extreme) / (1 +
+        num_permutations), so it is never 0
+
+    Raises:
+        ValueError: If no one, or everyone, was treated
+    """
+    is_treatment = np.asarray(is_treatment, dtype=bool)
+    if is_treatment.all() or not is_treatment.any():
+        raise ValueError("Need both treated and control patients")
+
+    matrices = _as_matrices(outcomes)
+    observed = _differences(matrices, is_treatment.astype(float)[np.newaxis, :])[0]
+
+    sizes = [
+        min(block_size, num_permutations - start)
+        for start in range(0, num_permutations, block_size)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if jobs == 1:
+        _init_permutations(matrices, is_treatment)
+        counts = [_count_extreme(size, observed, s) for size, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs or os.cpu_count(),
+            initializer=_init_permutations,
+            initargs=(matrices, is_treatment),
+        ) as pool:
+            counts = list(
+                pool.map(_count_extreme, sizes, [observed] * len(sizes), seeds)
+            )
+
+    num_extreme = np.sum(counts, axis=0) if counts else np.zeros(len(observed))
+    return pd.DataFrame(
+        {
+            "outcome": list(outcomes.columns),
+            "estimate": observed,
+            "p_value": (1 + num_extreme) / (1 + num_permutations),
+            "num_permutations": num_permutations,
+        }
+    )
+
+
+def randomization_tests(
+    df: pd.DataFrame,
+    outcomes: Sequence[str] = OUTCOMES,
+    treatment: str = "is_treatment",
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    Run `randomization_test` on the `outcomes` of a patient-level table (from
+    `read_outcomes`) that are present in it. Other keyword arguments are passed on
+    """
+    columns = [outcome for outcome in outcomes if outcome in df.columns]
+    return randomization_test(df[columns], df[treatment], **kwargs)
@@ -0,0 +1,159 @@
+"""
+Hash the files in the data inventory (`data/inventory.yml`) in parallel, remembering
+the sha of every file we have hashed so that unchanged files need not be reread.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Union
+
+from .utils import compute_sha
+
+INVENTORY_FILE = "inventory.yml"
+SHA_CACHE_FILE = ".sha_cache.json"
+
+
+def _stat_key(path: Path) -> List[int]:
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class ShaCache:
+    """
+    A local cache of file shas, keyed on each file's path, size, modification time
+    and inode. A file whose stat has not changed since it was hashed is assumed to
+    have the same contents. The cache is a JSON file which is not inventoried.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict[str, Union[str, List[int]]]] = {}
+        if self.path.exists():
+            try:
+                with open(self.path, "rt") as infile:
+                    self.entries = json.load(infile)
+            except ValueError:
+                # A corrupt cache just means everything gets rehashed
+                self.entries = {}
+
+    def get(self, path: Path) -> Optional[str]:
+        """ The cached sha of `path`, or None if it is not cached or has changed """
+        entry = self.entries.get(str(path.absolute()))
+        if entry is None or entry["stat"] != _stat_key(path):
+            return None
+        return str(entry["sha256"])
+
+    def set(self, path: Path, sha: str):
+        self.entries[str(path.absolute())] = {"stat": _stat_key(path), "sha256": sha}
+
+    def save(self):
+        with open(self.path, "wt") as outfile:
+            json.dump(self.entries, outfile, indent=1, sort_keys=True)
+
+
+def compute_shas(
+    paths: Iterable[Path],
+    cache: Optional[ShaCache] = None,
+    deep: bool = False,
+    jobs: Optional[int] = None,
+) -> Dict[Path, str]:
+    """
+    Compute the sha256 of many files at once.
+
+    Args:
+        paths: The files to hash
+        cache: If passed, files whose stat matches the cache are not reread, and
+            the cache is updated (but not saved) with every file that is hashed
+        deep: If True, reread every file even if it is in the cache
+        jobs: How many files to hash at once. Defaults to the number of CPUs
+
+    Returns:
+        A map from each path to its sha
+    """
+    paths = list(paths)
+    shas: Dict[Path, str] = {}
+    to_hash = []
+    for path in paths:
+        cached = cache.get(path) if cache is not None and not deep else None
+        if cached:
+            shas[path] = cached
+        else:
+            to_hash.append(path)
+
+    # Biggest files first so that one large file does not finish last on its own
+    to_hash.sort(key=lambda path: path.stat().st_size, reverse=True)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        for path, sha in zip(to_hash, pool.map(compute_sha, to_hash)):
+            shas[path] = sha
+            if cache is not None:
+                cache.set(path, sha)
+
+    return {path: shas[path] for path in paths}
+
+
+class VerifySummary(NamedTuple):
+    """
+    The result of `verify_inventory`:
+        * checked: the number of files with a sha in the inventory
+        * hashed: how many of those were read (rather than found in the cache)
+        * mismatched: files whose sha does not match the inventory
+        * missing: files in the inventory that do not exist
+    """
+
+    checked: int
+    hashed: int
+    mismatched: List[str]
+    missing: List[str]
+
+    @property
+    def ok(self) -> bool:
+        return not self.mismatched and not self.missing
+
+
+def verify_inventory(
+    data_dir: Path,
+    inventory: Dict,
+    deep: bool = False,
+    jobs: Optional[int] = None,
+) -> VerifySummary:
+    """
+    Check that every file in an inventory matches its sha.
+
+    Args:
+        data_dir: The directory the inventory's paths are relative to
+        inventory: The loaded inventory
+        deep: If True, reread every file, even those the sha cache says are
+            unchanged
+        jobs: How many files to hash at once. Defaults to the number of CPUs
+
+    Returns:
+        A summary of the files checked and those that failed
+    """
+    cache = ShaCache(data_dir / SHA_CACHE_FILE)
+    expected: Dict[Path, str] = {}
+    missing = []
+    for file_obj in inventory["files"]:
+        expected_sha = file_obj.get("sha256")
+        if not expected_sha:
+            continue
+        path = data_dir / file_obj["path"]
+        if path.is_file():
+            expected[path] = expected_sha
+        else:
+            missing.append(file_obj["path"])
+
+    num_cached = 0 if deep else sum(cache.get(path) is not None for path in expected)
+    shas = compute_shas(expected, cache=cache, deep=deep, jobs=jobs)
+    cache.save()
+
+    return VerifySummary(
+        checked=len(expected) + len(missing),
+        hashed=len(expected) - num_cached,
+        mismatched=[
+            path.relative_to(data_dir).as_posix()
+            for path, sha in shas.items()
+            if sha != expected[path]
+        ],
+        missing=missing,
+    )
@@ -0,0 +1,1110 @@
+"""
+Tools for linking records that refer to the same person
+"""
+import warnings
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz, utils
+from joblib import Parallel, delayed
+from scipy import sparse
+
+from . import store
+from .datafiles import INTERMEDIATE_DIR
+from .dates import parse_dates
+
+# The name of the stored `IdentityIndex`
+IDENTITY_INDEX = "identity_index"
+
+# Small slack so float rounding never makes a bound stricter than it should be
+_EPS = 1e-6
+
+
+def _process_query(name: str) -> str:
+    """ Process a query exactly as `process.extractBests` does """
+    return utils.full_process(utils.full_process(name), force_ascii=True)
+
+
+def _process_choice(name: str) -> str:
+    """ Process a choice exactly as `process.extractBests` does """
+    return utils.full_process(name, force_ascii=True)
+
+
+def _name_keys(processed: str) -> List[str]:
+    """
+    The blocking keys of a processed name: every character bigram inside a token
+    plus every single-character token. Keys never span a space, so they do not
+    depend on token order.
+    """
+    keys = []
+    for token in processed.split():
+        if len(token) == 1:
+            keys.append(f" {token}")
+        else:
+            keys.extend(token[i : i + 2] for i in range(len(token) - 1))
+    return keys
+
+
+def _n_keys(tokens: Iterable[str]) -> int:
+    return sum(max(len(token) - 1, 1) for token in tokens)
+
+
+def _name_stats(processed: List[str]) -> pd.DataFrame:
+    """
+    The per-name quantities that bound how many keys two names must share in order
+    for `fuzz.WRatio` to reach the threshold.
+
+        * length: length of the processed name
+        * sorted_length: length of the name with its tokens sorted
+        * set_length: length of the name with its unique tokens sorted
+        * n_keys: the number of blocking keys
+        * n_set_keys: the number of blocking keys of the unique tokens
+        * n_bigrams: the number of blocking keys that are bigrams
+    """
+    tokens = [name.split() for name in processed]
+    unique_tokens = [set(name_tokens) for name_tokens in tokens]
+    return pd.DataFrame(
+        {
+            "length": [len(name) for name in processed],
+            "sorted_length": [len(" ".join(name_tokens)) for name_tokens in tokens],
+            "set_length": [len(" ".join(name_tokens)) for name_tokens in unique_tokens],
+            "n_keys": [_n_keys(name_tokens) for name_tokens in tokens],
+            "n_set_keys": [_n_keys(name_tokens) for name_tokens in unique_tokens],
+            "n_bigrams": [
+                sum(len(token) - 1 for token in name_tokens) for name_tokens in tokens
+            ],
+        }
+    )
+
+
+def _max_indels(total_length: np.ndarray, min_ratio: float) -> np.ndarray:
+    """ Most insertions/deletions two strings can differ by and keep `min_ratio` """
+    return np.floor((1 - min_ratio) * total_length + _EPS)
+
+
+def _score_pairs(
+    queries: Sequence[str], choices: Sequence[str], pairs: np.ndarray
+) -> np.ndarray:
+    return np.array(
+        [fuzz.WRatio(queries[i], choices[j], full_process=False) for i, j in pairs],
+        dtype=np.int64,
+    )
+
+
+class FuzzyNameMatcher:
+    """
+    Find, for each name, the other names that `fuzzywuzzy.process.extractBests`
+    would return at a given `threshold`, without scoring every pair of names.
+
+    `fuzz.WRatio` can only reach 90 or more if either the plain ratio, the partial
+    ratio, the token sort ratio or the token set ratio of the two names is nearly
+    perfect. Each of those implies that the names share a minimum number of
+    blocking keys (see `_name_keys`), so we keep an inverted index of keys, count
+    the shared keys of all pairs in sparse, vectorized batches and only score the
+    pairs that could pass. Names that are too short for the bounds to say anything
+    (e.g., "A B") are scored against everything.
+
+    The returned matches are identical to calling::
+
+        process.extractBests(name, [other for other in names if other != name],
+                             score_cutoff=threshold, limit=limit)
+
+    for every name, in order.
+
+    Example::
+        matcher = FuzzyNameMatcher(names_tocheck)
+        fuzzymatch_results_df = matcher.match(n_jobs=-1)
+    """
+
+    def __init__(
+        self,
+        names: Iterable[str],
+        threshold: int = 90,
+        limit: Optional[int] = 5,
+        block_size: int = 512,
+    ):
+        """
+        Build the index of names to match against.
+
+        Args:
+            names: The names to index. These are also the default queries
+            threshold: The minimum `fuzz.WRatio` score of a match
+            limit: The maximum number of matches per name (None for all)
+            block_size: How many queries to count shared keys for at once
+        """
+        if threshold < 90:
+            raise ValueError(
+                f"The blocking bounds only hold for thresholds of at least 90: {threshold}"
+            )
+
+        self.names = list(names)
+        self.threshold = threshold
+        self.limit = limit
+        self.block_size = block_size
+
+        self._processed = [_process_choice(name) for name in self.names]
+        self._stats = _name_stats(self._processed)
+        self._vocabulary: dict = {}
+        self._index = self._key_matrix(self._processed, grow=True).T.tocsr()
+        self._unsafe = self._unsafe_names(self._stats)
+
+    def _key_matrix(
+        self, processed: List[str], grow: bool = False
+    ) -> sparse.csr_matrix:
+        """ Count the blocking keys of each processed name """
+        rows, cols = [], []
+        for row, name in enumerate(processed):
+            for key in _name_keys(name):
+                col = self._vocabulary.get(key)
+                if col is None:
+                    if not grow:
+                        continue
+                    col = self._vocabulary[key] = len(self._vocabulary)
+                rows.append(row)
+                cols.append(col)
+
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(processed), max(len(self._vocabulary), 1)),
+        )
+
+    @staticmethod
+    def _unsafe_names(stats: pd.DataFrame) -> np.ndarray:
+        """
+        Flag the names for which some route to a passing score does not require a
+        single shared key, whatever the other name is. These are always scored.
+        """
+        length = stats["length"].values
+        sorted_length = stats["sorted_length"].values
+        set_length = stats["set_length"].values
+        n_keys = stats["n_keys"].values
+        n_set_keys = stats["n_set_keys"].values
+
+        # The other name can be longer by at most the number of indels allowed
+        ratio_indels = np.floor(0.21 / 0.895 * length + _EPS)
+        sort_indels = np.floor(0.11 / 0.945 * sorted_length + _EPS)
+        set_indels = np.floor(0.11 / 0.945 * set_length + _EPS)
+        return (length > 0) & (
+            (n_keys - 2 * ratio_indels < 1)
+            | (stats["n_bigrams"].values - 2 * _max_indels(2 * length, 0.995) < 1)
+            | (n_keys - 2 * sort_indels < 1)
+            | (n_set_keys - _max_indels(2 * set_length, 0.945) < 1)
+            | (n_set_keys - 2 * set_indels < 1)
+        )
+
+    def _required_keys(
+        self, query_stats: pd.DataFrame, rows: np.ndarray, cols: np.ndarray
+    ) -> np.ndarray:
+        """
+        The minimum number of shared keys the pairs (rows, cols) need for any of the
+        routes through `fuzz.WRatio` to reach the threshold.
+        """
+
+        def pair(column):
+            return query_stats[column].values[rows], self._stats[column].values[cols]
+
+        inf = np.inf
+        q_len, c_len = pair("length")
+        q_sorted, c_sorted = pair("sorted_length")
+        q_set, c_set = pair("set_length")
+        q_keys, c_keys = pair("n_keys")
+        q_set_keys, c_set_keys = pair("n_set_keys")
+        q_bigrams, c_bigrams = pair("n_bigrams")
+
+        shorter = np.minimum(q_len, c_len)
+        len_ratio = np.maximum(q_len, c_len) / np.maximum(shorter, 1)
+        max_keys = np.maximum(q_keys, c_keys)
+
+        # Plain ratio
+        indels = _max_indels(q_len + c_len, 0.895)
+        required = np.where(np.abs(q_len - c_len) <= indels, max_keys - 2 * indels, inf)
+
+        # Partial ratio: the shorter name is (nearly) a substring of the longer one
+        short_bigrams = np.where(q_len <= c_len, q_bigrams, c_bigrams)
+        partial = short_bigrams - 2 * _max_indels(2 * shorter, 0.995)
+        required = np.where(
+            (len_ratio >= 1.5) & (len_ratio <= 8),
+            np.minimum(required, partial),
+            required,
+        )
+
+        # Token sort ratio
+        indels = _max_indels(q_sorted + c_sorted, 0.945)
+        token_sort = np.where(
+            np.abs(q_sorted - c_sorted) <= indels, max_keys - 2 * indels, inf
+        )
+
+        # Token set ratio: either one name's tokens are nearly all shared or the
+        # two sets of tokens are nearly identical
+        indels = _max_indels(q_set + c_set, 0.945)
+        token_set = np.minimum.reduce(
+            [
+                q_set_keys - _max_indels(2 * q_set, 0.945),
+                c_set_keys - _max_indels(2 * c_set, 0.945),
+                np.where(
+                    np.abs(q_set - c_set) <= indels,
+                    np.maximum(q_set_keys, c_set_keys) - 2 * indels,
+                    inf,
+                ),
+            ]
+        )
+        return np.where(
+            len_ratio < 1.5,
+            np.minimum.reduce([required, token_sort, token_set]),
+            required,
+        )
+
+    def candidates(self, queries: Optional[Iterable[str]] = None) -> np.ndarray:
+        """
+        Find every (query position, name position) pair that could score at least
+        `threshold`. Queries are never paired with identical names.
+
+        Args:
+            queries: The names to look up. Defaults to the indexed names
+
+        Returns:
+            An (n, 2) array of candidate pairs sorted by query then name
+        """
+        queries = self.names if queries is None else list(queries)
+        processed = [_process_query(name) for name in queries]
+        query_stats = _name_stats(processed)
+        query_keys = self._key_matrix(processed)
+        query_unsafe = self._unsafe_names(query_stats)
+
+        all_rows: List[np.ndarray] = []
+        all_cols: List[np.ndarray] = []
+        for start in range(0, len(queries), self.block_size):
+            stop = min(start + self.block_size, len(queries))
+            shared = (query_keys[start:stop] @ self._index).tocoo()
+            rows = shared.row.astype(np.int64) + start
+            cols = shared.col.astype(np.int64)
+            keep = shared.data >= self._required_keys(query_stats, rows, cols)
+            all_rows.append(rows[keep])
+            all_cols.append(cols[keep])
+
+        # Names the bounds say nothing about are compared with everything
+        unsafe_rows = np.flatnonzero(query_unsafe)
+        all_rows.append(np.repeat(unsafe_rows, len(self.names)))
+        all_cols.append(np.tile(np.arange(len(self.names)), len(unsafe_rows)))
+        unsafe_cols = np.flatnonzero(self._unsafe)
+        all_rows.append(np.tile(np.arange(len(queries)), len(unsafe_cols)))
+        all_cols.append(np.repeat(unsafe_cols, len(queries)))
+
+        codes = np.unique(
+            np.concatenate(all_rows) * len(self.names) + np.concatenate(all_cols)
+        )
+        pairs = np.column_stack(np.divmod(codes, max(len(self.names), 1)))
+
+        # Drop pairs that can never score (empty names) and identical names
+        all_codes = pd.factorize(pd.Series(queries + self.names, dtype=object))[0]
+        query_codes, name_codes = all_codes[: len(queries)], all_codes[len(queries) :]
+        empty_query = query_stats["length"].values == 0
+        empty_name = self._stats["length"].values == 0
+        keep = (
+            (query_codes[pairs[:, 0]] != name_codes[pairs[:, 1]])
+            & ~empty_query[pairs[:, 0]]
+            & ~empty_name[pairs[:, 1]]
+        )
+        return pairs[keep]
+
+    def match(
+        self,
+        queries: Optional[Iterable[str]] = None,
+        n_jobs: int = 1,
+        batch_size: int = 100_000,
+    ) -> pd.DataFrame:
+        """
+        Find the best fuzzy matches of each query among the indexed names.
+
+        Args:
+            queries: The names to look up. Defaults to the indexed names
+            n_jobs: The number of processes to score candidates with (-1 for all)
+            batch_size: The number of candidate pairs scored per job
+
+        Returns:
+            A DataFrame with columns `matched_name`, `score` and `original_name`,
+            ordered by the position of `original_name` in the queries and then by
+            descending score
+        """
+        queries = self.names if queries is None else list(queries)
+        pairs = self.candidates(queries)
+
+        processed_queries = [_process_query(name) for name in queries]
+        batches: List[Tuple[List[str], List[str], np.ndarray]] = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start : start + batch_size]
+            # Only ship the strings a batch needs to each worker
+            rows, row_pos = np.unique(batch[:, 0], return_inverse=True)
+            cols, col_pos = np.unique(batch[:, 1], return_inverse=True)
+            batches.append(
+                (
+                    [processed_queries[i] for i in rows],
+                    [self._processed[j] for j in cols],
+                    np.column_stack([row_pos, col_pos]),
+                )
+            )
+
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(_score_pairs)(*batch) for batch in batches
+        )
+        results = pd.DataFrame(
+            {
+                "query": pairs[:, 0],
+                "name": pairs[:, 1],
+                "score": np.concatenate(scores) if scores else np.array([], dtype=int),
+            }
+        )
+        results = results.loc[results["score"] >= self.threshold]
+
+        # extractBests keeps the first choices it saw among ties
+        results = results.sort_values(
+            by=["query", "score", "name"], ascending=[True, False, True], kind="stable"
+        )
+        if self.limit is not None:
+            results = results.loc[results.groupby("query").cumcount() < self.limit]
+
+        names = np.array(self.names, dtype=object)
+        queries_arr = np.array(queries, dtype=object)
+        return pd.DataFrame(
+            {
+                "matched_name": names[results["name"].values],
+                "score": results["score"].values,
+                "original_name": queries_arr[results["query"].values],
+            }
+        )
+
+
+def connected_components(
+    left: np.ndarray, right: np.ndarray, num_nodes: int
+) -> np.ndarray:
+    """
+    Find the connected components of an undirected graph with a vectorized
+    union-find. Each round hooks the root of one end of every edge that spans two
+    trees onto the smaller root of the other, then compresses paths by pointer
+    jumping until every node points at its root. Edges inside a tree are dropped
+    as they are found, so the work shrinks each round.
+
+    Args:
+        left: The first node of each edge, as integers in [0, num_nodes)
+        right: The second node of each edge
+        num_nodes: The number of nodes
+
+    Returns:
+        The smallest node in each node's component
+    """
+    parent = np.arange(num_nodes)
+    left = np.asarray(left, dtype=np.int64)
+    right = np.asarray(right, dtype=np.int64)
+    while len(left):
+        left_roots, right_roots = parent[left], parent[right]
+        spans = left_roots != right_roots
+        left, right = left[spans], right[spans]
+        if not len(left):
+            break
+
+        # Roots only ever point at smaller roots, so there are no cycles
+        low = np.minimum(left_roots[spans], right_roots[spans])
+        high = np.maximum(left_roots[spans], right_roots[spans])
+        np.minimum.at(parent, high, low)
+
+        grandparent = parent[parent]
+        while (grandparent != parent).any():
+            parent = grandparent
+            grandparent = parent[parent]
+    return parent
+
+
+# The nodes with a value in a column of links: each node and its value
+ColumnLinks = Tuple[np.ndarray, pd.Series]
+
+
+def _link_columns(
+    link_on: Union[str, Sequence[str]],
+    matches: Optional[pd.DataFrame],
+    match_on: Optional[str],
+) -> Tuple[List[str], Optional[str]]:
+    """ Check the columns to link on and default `match_on` to the first of them """
+    link_on = [link_on] if isinstance(link_on, str) else list(link_on)
+    if matches is None:
+        return link_on, None
+    match_on = link_on[0] if match_on is None and link_on else match_on
+    if match_on not in link_on:
+        raise ValueError(f"match_on must be one of link_on {link_on}: {match_on}")
+    return link_on, match_on
+
+
+def _component_roots(
+    num_nodes: int,
+    links: Dict[str, ColumnLinks],
+    matches: Optional[pd.DataFrame],
+    match_on: Optional[str],
+) -> np.ndarray:
+    """
+    Link nodes that share a value of any column of `links`, or have values of
+    `match_on` that `matches` pairs, and find the smallest node in the component
+    of each of the `num_nodes` nodes.
+    """
+    # The values of each column are nodes too, numbered after the given nodes
+    lefts: List[np.ndarray] = []
+    rights: List[np.ndarray] = []
+    num_all_nodes = num_nodes
+    for column, (nodes, values) in links.items():
+        value_codes, uniques = pd.factorize(values)
+        has_value = value_codes >= 0
+        lefts.append(nodes[has_value])
+        rights.append(value_codes[has_value] + num_all_nodes)
+
+        if column == match_on:
+            pairs = np.column_stack(
+                [uniques.get_indexer(matches.iloc[:, i]) for i in range(2)]
+            )
+            pairs = pairs[(pairs >= 0).all(axis=1)]
+            lefts.append(pairs[:, 0] + num_all_nodes)
+            rights.append(pairs[:, 1] + num_all_nodes)
+        num_all_nodes += len(uniques)
+
+    edges = [
+        np.concatenate(nodes) if nodes else np.array([], dtype=np.int64)
+        for nodes in (lefts, rights)
+    ]
+    return connected_components(*edges, num_nodes=num_all_nodes)[:num_nodes]
+
+
+def resolve_identities(
+    records: pd.DataFrame,
+    id_col: str = "num_1",
+    link_on: Union[str, Sequence[str]] = (),
+    matches: Optional[pd.DataFrame] = None,
+    match_on: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Group ids that refer to the same person. Two ids are the same person if they
+    share a value of any of `link_on` (e.g., a name, a phone number or a date of
+    birth) or have values of `match_on` that were matched (e.g., fuzzy matched
+    names), directly or through other ids: if A is linked to B and B to C, then A,
+    B and C are one person.
+
+    The ids, the values of `link_on` and the matches form a graph (an id is linked
+    to each of its values and matched values to each other) whose connected
+    components are the people, so the work is close to linear in the number of
+    records and matches.
+
+    Example::
+        resolve_identities(
+            df_forfuzzy_forremote,
+            link_on="name_nounderscore",
+            matches=matching_results_tomerge[["original_name", "matched_name"]],
+        )
+
+    Args:
+        records: A row per id and value(s); ids may repeat with different values
+        id_col: The column of ids
+        link_on: The column(s) whose shared values link ids. Missing values link
+            nothing
+        matches: Pairs of values of `match_on` which refer to the same person,
+            in its first two columns. Values that no record has link nothing
+        match_on: The column of `link_on` that `matches` holds values of.
+            Defaults to the first of `link_on`
+
+    Returns:
+        A row per id, with `id_col` and `constructed_id`, sorted by both. People
+        are numbered from 1 in the order of their smallest id, so the numbering
+        only depends on which ids are linked, not on the order of the inputs
+
+    Raises:
+        ValueError: If `matches` is passed and `match_on` is not one of `link_on`
+    """
+    link_on, match_on = _link_columns(link_on, matches, match_on)
+    records = records.loc[records[id_col].notnull()]
+    id_codes, ids = pd.factorize(records[id_col], sort=True)
+    links = {column: (id_codes, records[column]) for column in link_on}
+    roots = _component_roots(len(ids), links, matches, match_on)
+
+    # Roots are ids' positions, so numbering them in order numbers the people
+    # by their smallest id
+    constructed_ids = pd.factorize(roots, sort=True)[0] + 1
+    return (
+        pd.DataFrame({id_col: ids, "constructed_id": constructed_ids})
+        .sort_values(["constructed_id", id_col], kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def _as_keys(values: pd.Series) -> pd.Series:
+    """ Values as strings, as the identity index stores them, keeping missing ones """
+    return values.where(values.isnull(), values.astype(str)).astype(object)
+
+
+def _sorted_keys(keys: pd.DataFrame) -> pd.DataFrame:
+    """ The keys of an identity index in a canonical order, for comparisons """
+    return keys.sort_values(["column", "value"]).reset_index(drop=True)
+
+
+class IdentityIndex:
+    """
+    The people resolved so far, so that new calls can be added to them without
+    resolving every call again. The index keeps each person's `constructed_id`
+    with their ids and the values of the columns they were linked on (e.g.,
+    names, phone numbers and dates of birth). A new batch of records is only
+    linked to the people whose values it shares or whose names it matches, so
+    the work grows with the batch rather than the whole history, and people
+    keep their `constructed_id`.
+
+    The index is stored with `femsntl.store` as a long table of `column`,
+    `value` and `constructed_id`; ids are the rows whose column is `id_col`.
+    Every value is stored as a string, so the ids must be strings (as `num_1`
+    is, e.g., "F18031900001"): numbers would sort, and so be numbered,
+    differently from `resolve_identities`. With string ids, adding everything
+    to an empty index gives the same people and ids as `resolve_identities`.
+    If a batch links people who were resolved separately, they are merged and
+    keep the smallest of their ids.
+
+    Example::
+        try:
+            index = IdentityIndex.read()
+        except ValueError:
+            index = IdentityIndex()
+        new_calls = index.unseen(calls, "name_nounderscore")
+        matches = index.match_names(new_calls.name_nounderscore, "name_nounderscore")
+        lookup = index.add(new_calls, link_on="name_nounderscore", matches=matches)
+        index.write()
+    """
+
+    def __init__(self, keys: Optional[pd.DataFrame] = None, id_col: str = "num_1"):
+        """
+        Args:
+            keys: The stored table, or None for an empty index
+            id_col: The column of ids in records
+        """
+        if keys is None:
+            keys = pd.DataFrame(
+                {
+                    "column": pd.Series([], dtype=object),
+                    "value": pd.Series([], dtype=object),
+                    "constructed_id": pd.Series([], dtype=np.int64),
+                }
+            )
+        self.keys = keys.reset_index(drop=True)
+        self.id_col = id_col
+
+    @classmethod
+    def read(
+        cls,
+        name: str = IDENTITY_INDEX,
+        base_dir: Union[str, Path] = INTERMEDIATE_DIR,
+        id_col: str = "num_1",
+    ) -> "IdentityIndex":
+        """
+        Read the most recent version of a stored index
+
+        Raises:
+            ValueError: If there is no index called `name` in base_dir
+        """
+        return cls(store.read(name, base_dir=base_dir), id_col=id_col)
+
+    def write(
+        self, name: str = IDENTITY_INDEX, base_dir: Union[str, Path] = INTERMEDIATE_DIR
+    ) -> Path:
+        """
+        Store a new version of the index, keeping the earlier ones. If the most
+        recent version already holds the same keys, nothing is written and its
+        path is returned, so rerunning on the same inputs adds no versions.
+        """
+        try:
+            latest = store.read(name, base_dir=base_dir)
+        except ValueError:
+            latest = None
+        if latest is not None and _sorted_keys(latest).equals(_sorted_keys(self.keys)):
+            return store.path_for(name, base_dir=base_dir)
+        return store.write(name, self.keys, versioned=True, base_dir=base_dir)
+
+    def values(self, column: str) -> pd.Series:
+        """ The stored values of `column`, with the `constructed_id` of each """
+        rows = self.keys.loc[self.keys.column == column]
+        return pd.Series(rows.constructed_id.values, index=rows.value.values)
+
+    @property
+    def ids(self) -> pd.Index:
+        """ Every id in the index """
+        return self.values(self.id_col).index
+
+    @property
+    def lookup(self) -> pd.DataFrame:
+        """ A row per id, with `id_col` and `constructed_id`, sorted by both """
+        ids = self.values(self.id_col)
+        return (
+            pd.DataFrame({self.id_col: ids.index, "constructed_id": ids.values})
+            .sort_values(["constructed_id", self.id_col], kind="stable")
+            .reset_index(drop=True)
+        )
+
+    def unseen(
+        self, records: pd.DataFrame, link_on: Union[str, Sequence[str]] = ()
+    ) -> pd.DataFrame:
+        """
+        The records that would change the index: those whose id is not in it, or
+        which have a value of `link_on` their id's person does not have yet
+        (e.g., a name added later for an old id). Only these need to be matched
+        and added; the rest are already in the index as they are. Records
+        without an id are dropped, as `add` drops them.
+        """
+        link_on = [link_on] if isinstance(link_on, str) else list(link_on)
+        records = records.loc[records[self.id_col].notnull()]
+        person = records[self.id_col].map(self.values(self.id_col))
+        is_unseen = person.isnull()
+        for column in link_on:
+            values = _as_keys(records[column])
+            is_unseen |= values.notnull() & (values.map(self.values(column)) != person)
+        return records.loc[is_unseen]
+
+    def match_names(
+        self,
+        names: Iterable[str],
+        match_on: str,
+        threshold: int = 90,
+        limit: Optional[int] = 5,
+        n_jobs: int = 1,
+    ) -> pd.DataFrame:
+        """
+        Fuzzy match the names of a batch with `FuzzyNameMatcher`. Only names the
+        index does not have yet are looked up, against the names in the index and
+        in the batch, so the names in the index are never scored against each
+        other again. With an empty index, this is the same as matching all of
+        `names` against each other.
+
+        Args:
+            names: The names in the batch. Missing names are dropped
+            match_on: The column of the index the names are values of
+            threshold: The minimum `fuzz.WRatio` score of a match
+            limit: The maximum number of matches per name (None for all)
+            n_jobs: The number of processes to score candidates with (-1 for all)
+
+        Returns:
+            The matches, as `FuzzyNameMatcher.match` returns them
+        """
+        names = _as_keys(pd.Series(list(names), dtype=object)).dropna()
+        known = self.values(match_on).index.unique()
+        new_names = names.loc[~names.isin(known)].unique().tolist()
+        matcher = FuzzyNameMatcher(
+            known.tolist() + new_names, threshold=threshold, limit=limit
+        )
+        return matcher.match(new_names, n_jobs=n_jobs)
+
+    def add(
+        self,
+        records: pd.DataFrame,
+        link_on: Union[str, Sequence[str]] = (),
+        matches: Optional[pd.DataFrame] = None,
+        match_on: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """
+        Link a batch of records to the people in the index, or to new people, and
+        add them to the index. Arguments are as for `resolve_identities`; ids that
+        are already in the index stay with their person.
+
+        Returns:
+            A row per id in the batch, with `id_col` and `constructed_id`, sorted
+            by both. New people are numbered from one more than the largest id in
+            the index, in the order of their smallest id
+
+        Raises:
+            ValueError: If the ids are not strings, or `matches` is passed and
+                `match_on` is not one of `link_on`
+        """
+        link_on, match_on = _link_columns(link_on, matches, match_on)
+        if matches is not None:
+            matches = matches.iloc[:, :2].apply(_as_keys)
+        records = records.loc[records[self.id_col].notnull()]
+        if pd.api.types.infer_dtype(records[self.id_col]) not in ("string", "empty"):
+            raise ValueError(f"The ids in {self.id_col} must be strings")
+        id_codes, ids = pd.factorize(records[self.id_col].astype(object), sort=True)
+        batch = {self.id_col: pd.Series(ids)}
+        batch.update({column: _as_keys(records[column]) for column in link_on})
+
+        # Only the people sharing a value with the batch can be linked to it
+        wanted = [
+            pd.DataFrame({"column": column, "value": values.dropna().unique()})
+            for column, values in batch.items()
+        ]
+        if matches is not None:
+            matched = pd.unique(matches.values.ravel())
+            wanted.append(pd.DataFrame({"column": match_on, "value": matched}))
+        wanted = pd.concat(wanted).drop_duplicates()
+        candidates = self.keys.loc[self.keys.value.isin(wanted.value)]
+        touched = candidates.merge(wanted, on=["column", "value"])
+
+        # Nodes are the batch's ids, in sorted order, and then the people touched
+        person_codes, people = pd.factorize(touched.constructed_id, sort=True)
+        person_nodes = person_codes + len(ids)
+        links = {}
+        for column, values in batch.items():
+            nodes = np.arange(len(ids)) if column == self.id_col else id_codes
+            is_column = (touched.column == column).values
+            links[column] = (
+                np.concatenate([nodes, person_nodes[is_column]]),
+                pd.concat([values, touched.value[is_column]], ignore_index=True),
+            )
+        roots = _component_roots(len(ids) + len(people), links, matches, match_on)
+
+        # Components with people in them take the smallest of their ids, and the
+        # rest are numbered after every existing id, by their smallest batch id
+        existing = (
+            pd.Series(people.values, dtype=np.int64).groupby(roots[len(ids) :]).min()
+        )
+        next_id = int(self.keys.constructed_id.max()) + 1 if len(self.keys) else 1
+        new_roots = np.setdiff1d(roots[: len(ids)], existing.index)
+        constructed_ids = pd.concat(
+            [
+                existing,
+                pd.Series(np.arange(len(new_roots)) + next_id, index=new_roots),
+            ]
+        )
+
+        merged = pd.Series(constructed_ids.loc[roots[len(ids) :]].values, index=people)
+        merged = merged.loc[merged.index != merged.values]
+        keys = self.keys
+        if len(merged):
+            is_merged = keys.constructed_id.isin(merged.index)
+            keys = keys.assign(
+                constructed_id=keys.constructed_id.mask(
+                    is_merged, keys.constructed_id[is_merged].map(merged)
+                )
+            )
+
+        lookup = pd.DataFrame(
+            {
+                self.id_col: ids,
+                "constructed_id": constructed_ids.loc[roots[: len(ids)]].values,
+            }
+        )
+        new_keys = [
+            pd.DataFrame(
+                {
+                    "column": column,
+                    "value": values.values,
+                    "constructed_id": lookup.constructed_id.values[
+                        np.arange(len(ids)) if column == self.id_col else id_codes
+                    ],
+                }
+            ).dropna(subset=["value"])
+            for column, values in batch.items()
+        ]
+        # Values the index already has are all among those touched
+        new_keys = (
+            pd.concat(new_keys, ignore_index=True)
+            .drop_duplicates(subset=["column", "value"])
+            .merge(touched[["column", "value"]], how="left", indicator=True)
+        )
+        new_keys = new_keys.loc[new_keys._merge == "left_only"].drop(columns="_merge")
+        self.keys = pd.concat([keys, new_keys], ignore_index=True)
+        return lookup.sort_values(
+            ["constructed_id", self.id_col], kind="stable"
+        ).reset_index(drop=True)
+
+
+class LinkFields(NamedTuple):
+    """
+    The columns of a table that identify a person for record linkage:
+        * first_name, last_name: the person's names
+        * dob: their date of birth
+        * dob_format: the strptime format of the DOBs, e.g., "%d%b%Y:%H:%M:%S"
+          for the SAS dates of the claims extracts. If None, DOBs which are
+          not already datetimes are read with `dates.parse_dates`
+    """
+
+    first_name: str
+    last_name: str
+    dob: str
+    dob_format: Optional[str] = None
+
+
+# The names and DOB of `identifiers_fordhcr.csv` (both names of each NTL id) and
+# of the DHCF Medicaid member list
+NTL_FIELDS = (
+    LinkFields("firstname_name1", "lastname_name1", "date_of_birth"),
+    LinkFields("firstname_name2", "lastname_name2", "date_of_birth"),
+)
+MEDICAID_FIELDS = LinkFields("MemberFirstName", "MemberLastName", "MemberDateofBirth")
+
+
+class LinkThresholds(NamedTuple):
+    """
+    The scores (out of 3, one per name and one for the DOB) that decide pairs:
+        * match: pairs scoring at least this are matches
+        * review: pairs scoring at least this, but less than `match`, are
+          reviewed by hand
+    """
+
+    match: float = 2.7
+    review: float = 2.0
+
+
+LINK_STATUSES = ["match", "review", "non-match"]
+
+
+def _normalize_names(names: pd.Series) -> pd.Series:
+    """ Uppercase names and drop everything but letters: "O'Neil Jr." -> "ONEILJR" """
+    names = names.astype(object).where(names.notnull())
+    names = names.str.upper().str.replace(r"[^A-Z]", "", regex=True)
+    return names.where(names.str.len() > 0)
+
+
+# Warn when more than this share of the DOBs present cannot be parsed, since every
+# unparsed DOB scores 0 and is never blocked on
+MAX_UNPARSED_DOB_SHARE = 0.05
+
+
+def _parse_dobs(dobs: pd.Series, dob_format: Optional[str] = None) -> pd.Series:
+    """
+    Parse DOBs with `dob_format`, or `parse_dates` if it is None, warning if many
+    cannot be parsed
+    """
+    if dob_format is not None:
+        parsed = pd.to_datetime(dobs, format=dob_format, errors="coerce")
+    elif pd.api.types.is_datetime64_any_dtype(dobs):
+        parsed = dobs
+    else:
+        parsed = parse_dates(dobs).dates
+
+    num_present = int(dobs.notnull().sum())
+    num_unparsed = int((dobs.notnull() & parsed.isnull()).sum())
+    if num_unparsed > MAX_UNPARSED_DOB_SHARE * num_present:
+        warnings.warn(
+            f"{num_unparsed} of {num_present} DOBs in {dobs.name} could not be "
+            "parsed; pass their dob_format in LinkFields",
+            stacklevel=4,
+        )
+    return parsed
+
+
+def _link_keys(df: pd.DataFrame, fields: LinkFields) -> pd.DataFrame:
+    """
+    The normalized names and DOB of each row, and the keys to index them by:
+        * dob_key: the DOB
+        * name_key: the first four letters of the last name and the first
+          initial, which survives typos later in the names and a changed DOB
+        * sort_key: the last name then the first name, for sorted neighbourhood
+    """
+    first_name = _normalize_names(df[fields.first_name])
+    last_name = _normalize_names(df[fields.last_name])
+    dob = _parse_dobs(df[fields.dob], fields.dob_format)
+    return pd.DataFrame(
+        {
+            "first_name": first_name.values,
+            "last_name": last_name.values,
+            "dob": dob.values,
+            "dob_key": dob.dt.strftime("%Y-%m-%d").values,
+            "name_key": (last_name.str[:4] + "_" + first_name.str[:1]).values,
+            "sort_key": (last_name + " " + first_name).values,
+        }
+    )
+
+
+def _block_pairs(left: pd.Series, right: pd.Series) -> np.ndarray:
+    """ Every (left position, right position) pair with the same, non-missing key """
+    codes = pd.factorize(pd.concat([left, right], ignore_index=True))[0]
+    left_codes = pd.DataFrame(
+        {"code": codes[: len(left)], "left": np.arange(len(left))}
+    )
+    right_codes = pd.DataFrame(
+        {"code": codes[len(left) :], "right": np.arange(len(right))}
+    )
+    pairs = left_codes.loc[left_codes.code >= 0].merge(right_codes, on="code")
+    return pairs[["left", "right"]].values.astype(np.int64).reshape(-1, 2)
+
+
+def _sorted_neighbourhood_pairs(
+    left: pd.Series, right: pd.Series, window: int
+) -> np.ndarray:
+    """
+    Sort the keys of both tables together and pair every left row with the right
+    rows fewer than `window` places away from it
+    """
+    keys = pd.concat([left, right], ignore_index=True)
+    has_key = keys.notnull().values
+    order = np.flatnonzero(has_key)[np.argsort(keys[has_key].values, kind="stable")]
+    is_left = order < len(left)
+
+    pairs = []
+    for offset in range(1, window):
+        first, second = order[:-offset], order[offset:]
+        first_left, second_left = is_left[:-offset], is_left[offset:]
+        pairs.append(
+            np.column_stack([first, second - len(left)])[first_left & ~second_left]
+        )
+        pairs.append(
+            np.column_stack([second, first - len(left)])[~first_left & second_left]
+        )
+    return np.concatenate(pairs or [np.empty((0, 2), dtype=np.int64)]).astype(np.int64)
+
+
+def candidate_pairs(
+    left: pd.DataFrame, right: pd.DataFrame, window: int = 5
+) -> np.ndarray:
+    """
+    Find the pairs of rows worth comparing, from the keys `_link_keys` makes: rows
+    with the same DOB, rows with the same name key, and rows that are close by
+    name in sorted neighbourhood.
+
+    Args:
+        left, right: The keys of each table
+        window: The size of the sorted neighbourhood window
+
+    Returns:
+        An (n, 2) array of unique (left position, right position) pairs, sorted
+    """
+    pairs = np.concatenate(
+        [
+            _block_pairs(left.dob_key, right.dob_key),
+            _block_pairs(left.name_key, right.name_key),
+            _sorted_neighbourhood_pairs(left.sort_key, right.sort_key, window),
+        ]
+    )
+    codes = np.unique(pairs[:, 0] * max(len(right), 1) + pairs[:, 1])
+    return np.column_stack(np.divmod(codes, max(len(right), 1)))
+
+
+def _name_similarities(pairs: List[Tuple[str, str]]) -> np.ndarray:
+    return np.array([fuzz.ratio(first, second) for first, second in pairs]) / 100
+
+
+def _compare_names(
+    left: pd.Series, right: pd.Series, n_jobs: int, chunk_size: int
+) -> np.ndarray:
+    """
+    The similarity of each pair of names, from 0 to 1. Identical names are 1 and
+    missing names 0; each other distinct pair of names is scored once, in chunks
+    across `n_jobs` processes.
+    """
+    both = left.notnull().values & right.notnull().values
+    is_same = both & (left.values == right.values)
+    similarity = np.where(is_same, 1.0, 0.0)
+    to_score = both & ~is_same
+    num_scored = to_score.sum()
+    name_codes, names = pd.factorize(
+        np.concatenate([left.values[to_score], right.values[to_score]])
+    )
+    pair_codes, unique_pairs = pd.factorize(
+        name_codes[:num_scored] * len(names) + name_codes[num_scored:]
+    )
+    unique_pairs = [
+        (names[pair // len(names)], names[pair % len(names)]) for pair in unique_pairs
+    ]
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(_name_similarities)(unique_pairs[start : start + chunk_size])
+        for start in range(0, len(unique_pairs), chunk_size)
+    )
+    if scores:
+        similarity[to_score] = np.concatenate(scores)[pair_codes]
+    return similarity
+
+
+def _compare_dobs(left: pd.Series, right: pd.Series) -> np.ndarray:
+    """
+    1 if the DOBs are the same, 0.5 if they differ in only one of the year, month
+    and day or have the month and day swapped, and 0 otherwise
+    """
+    left_parts = [getattr(left.dt, part).values for part in ("year", "month", "day")]
+    right_parts = [getattr(right.dt, part).values for part in ("year", "month", "day")]
+    num_same = sum(l == r for l, r in zip(left_parts, right_parts))
+    swapped = (
+        (left_parts[0] == right_parts[0])
+        & (left_parts[1] == right_parts[2])
+        & (left_parts[2] == right_parts[1])
+    )
+    return np.select([num_same == 3, (num_same == 2) | swapped], [1.0, 0.5], 0.0)
+
+
+def link_records(
+    left: pd.DataFrame,
+    right: pd.DataFrame,
+    left_fields: Union[LinkFields, Sequence[LinkFields]] = NTL_FIELDS,
+    right_fields: LinkFields = MEDICAID_FIELDS,
+    thresholds: LinkThresholds = LinkThresholds(),
+    window: int = 5,
+    n_jobs: int = 1,
+    chunk_size: int = 100_000,
+) -> pd.DataFrame:
+    """
+    Link people in one table (e.g., NTL callers) to another (e.g., the Medicaid
+    member list) by their names and date of birth.
+
+    Only pairs of rows that share a DOB, share a name key (the start of the last
+    name and the first initial) or sort near each other by name are compared, so
+    the work grows with the number of plausible pairs rather than with the product
+    of the two tables. Each pair scores up to 1 for each of the first and last
+    names (their `fuzz.ratio`, or that of the swapped names if higher) and up to 1
+    for the DOB (see `_compare_dobs`).
+
+    Args:
+        left: The people to link
+        right: The people to link them to
+        left_fields: The name and DOB columns of `left`. If there are several
+            (e.g., name1 and name2 in the NTL data), each is compared and the best
+            score kept
+        right_fields: The name and DOB columns of `right`
+        thresholds: The scores for a match and for review by hand
+        window: The size of the sorted neighbourhood window
+        n_jobs: The number of processes to compare names with (-1 for all)
+        chunk_size: The number of pairs of names compared per job
+
+    Returns:
+        A row per candidate pair, sorted by descending score, with the index labels
+        of the rows in `left` and `right`, the `first_name`, `last_name` and `dob`
+        similarities and `score` of the best of `left_fields`, which of them that
+        was (`fields`, from 0) and the pair's `status`: "match", "review" or
+        "non-match"
+    """
+    if isinstance(left_fields, LinkFields):
+        left_fields = [left_fields]
+    right_keys = _link_keys(right, right_fields)
+
+    scored = []
+    for position, fields in enumerate(left_fields):
+        left_keys = _link_keys(left, fields)
+        pairs = candidate_pairs(left_keys, right_keys, window)
+        first, second = left_keys.iloc[pairs[:, 0]], right_keys.iloc[pairs[:, 1]]
+        similarity = {
+            name: _compare_names(first[name], second[name], n_jobs, chunk_size)
+            for name in ("first_name", "last_name")
+        }
+        swapped = _compare_names(
+            first.first_name, second.last_name, n_jobs, chunk_size
+        ) + _compare_names(first.last_name, second.first_name, n_jobs, chunk_size)
+        use_swapped = swapped > similarity["first_name"] + similarity["last_name"]
+        dob = _compare_dobs(first.dob, second.dob)
+        scored.append(
+            pd.DataFrame(
+                {
+                    "left": pairs[:, 0],
+                    "right": pairs[:, 1],
+                    "first_name": np.where(
+                        use_swapped, swapped / 2, similarity["first_name"]
+                    ),
+                    "last_name": np.where(
+                        use_swapped, swapped / 2, similarity["last_name"]
+                    ),
+                    "dob": dob,
+                    "fields": position,
+                }
+            )
+        )
+
+    scores = pd.concat(scored, ignore_index=True)
+    scores["score"] = scores.first_name + scores.last_name + scores.dob
+    scores = scores.sort_values(
+        ["score", "fields"], ascending=[False, True], kind="stable"
+    ).drop_duplicates(["left", "right"])
+    scores["status"] = pd.Categorical.from_codes(
+        np.select(
+            [scores.score >= thresholds.match, scores.score >= thresholds.review],
+            [0, 1],
+            2,
+        ),
+        categories=LINK_STATUSES,
+    )
+    scores["left"] = left.index.values[scores.left.values]
+    scores["right"] = right.index.values[scores.right.values]
+    return scores.reset_index(drop=True)
@@ -0,0 +1,345 @@
+"""
+Power and minimum detectable effect (MDE) calculations for two-arm trials, as in our
+pre-analysis plan (`100_preanalysis/200_power_calculations.ipynb`).
+
+Everything here broadcasts like numpy, so whole grids of design scenarios (base
+rates, sample sizes, alphas, numbers of hypotheses and powers) are computed at
+once. The analytic results match statsmodels' `NormalIndPower` (binary outcomes,
+effects in Cohen's h) and `TTestIndPower` (continuous outcomes, effects in Cohen's
+d). `simulate_binary_power` checks the normal approximation by simulating trials.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+NEWTON_STEPS = 8
+
+
+def cohens_h(p1, p2):
+    """ Cohen's h between two proportions """
+    return 2 * np.arcsin(np.sqrt(p2)) - 2 * np.arcsin(np.sqrt(p1))
+
+
+def inverse_cohens_h(h, p):
+    """
+    The proportions a Cohen's h of `h` away from `p`, i.e., the range of rates
+    whose difference from `p` we could not detect
+
+    Returns:
+        The lower and upper proportions
+    """
+    phi = 2 * np.arcsin(np.sqrt(p))
+    p1 = np.sin((phi - h) / 2) ** 2
+    p2 = np.sin((phi + h) / 2) ** 2
+    return np.minimum(p1, p2), np.maximum(p1, p2)
+
+
+def inverse_cohens_d(d, mu, sd):
+    """ The means a Cohen's d of `d` away from `mu`: the lower and upper means """
+    return mu - d * sd, mu + d * sd
+
+
+def _effective_nobs(sample_size, treated_share):
+    """ The harmonic sample size n1 * n2 / (n1 + n2) for a total sample size """
+    return np.asarray(sample_size, dtype=float) * treated_share * (1 - treated_share)
+
+
+def _critical_value(alpha, num_hypotheses, df=None):
+    """ The two-sided critical value with a Bonferroni correction """
+    level = np.asarray(alpha, dtype=float) / (2 * np.asarray(num_hypotheses))
+    if df is None:
+        return stats.norm.isf(level)
+    return stats.t.isf(level, df)
+
+
+def power(
+    effect_size,
+    sample_size,
+    alpha=0.05,
+    num_hypotheses=1,
+    treated_share=0.5,
+    test: str = "normal",
+):
+    """
+    The power of a two-sided test of a difference between two arms.
+
+    Arguments:
+        effect_size: The standardized effect: Cohen's h for proportions (the
+            "normal" test) or Cohen's d for means (the "t" test)
+        sample_size: The total sample size across both arms
+        alpha: The study-wide false positive rate
+        num_hypotheses: The number of hypotheses tested; alpha is divided by this
+            (a Bonferroni correction)
+        treated_share: The share of the sample that is treated
+        test: Either "normal" or "t"
+
+    Returns:
+        The power of each scenario, broadcast across the arguments
+    """
+    nobs = _effective_nobs(sample_size, treated_share)
+    noncentrality = np.asarray(effect_size, dtype=float) * np.sqrt(nobs)
+    if test == "normal":
+        crit = _critical_value(alpha, num_hypotheses)
+        return stats.norm.sf(crit - noncentrality) + stats.norm.cdf(
+            -crit - noncentrality
+        )
+    if test == "t":
+        df = np.asarray(sample_size, dtype=float) - 2
+        crit = _critical_value(alpha, num_hypotheses, df)
+        return stats.nct.sf(crit, df, noncentrality) + stats.nct.cdf(
+            -crit, df, noncentrality
+        )
+    raise ValueError(f"Unknown test {test}")
+
+
+def mde(
+    sample_size,
+    alpha=0.05,
+    power=0.8,
+    num_hypotheses=1,
+    treated_share=0.5,
+    test: str = "normal",
+):
+    """
+    The minimum detectable effect: the smallest standardized effect (Cohen's h for
+    the "normal" test, Cohen's d for the "t" test) detected with the given power.
+
+    This is the closed form `(z_{1 - alpha / 2m} + z_power) / sqrt(n)`, refined
+    with a few vectorized Newton steps to account for the (tiny) chance of
+    rejecting in the wrong direction and, for the t test, its fatter tails.
+
+    Arguments:
+        See `power`
+
+    Returns:
+        The MDE of each scenario, broadcast across the arguments
+    """
+    nobs = _effective_nobs(sample_size, treated_share)
+    target = np.asarray(power, dtype=float)
+    if test == "normal":
+        crit = _critical_value(alpha, num_hypotheses)
+        effect = (crit + stats.norm.ppf(target)) / np.sqrt(nobs)
+        for _ in range(NEWTON_STEPS):
+            noncentrality = effect * np.sqrt(nobs)
+            value = stats.norm.sf(crit - noncentrality) + stats.norm.cdf(
+                -crit - noncentrality
+            )
+            slope = np.sqrt(nobs) * (
+                stats.norm.pdf(crit - noncentrality)
+                - stats.norm.pdf(crit + noncentrality)
+            )
+            effect = effect - (value - target) / slope
+        return effect
+
+    if test == "t":
+        df = np.asarray(sample_size, dtype=float) - 2
+        crit = _critical_value(alpha, num_hypotheses, df)
+        effect = (crit + stats.t.ppf(target, df)) / np.sqrt(nobs)
+        step = 1e-6
+        for _ in range(NEWTON_STEPS):
+            value = _t_power(effect, nobs, crit, df)
+            slope = (
+                _t_power(effect + step, nobs, crit, df)
+                - _t_power(effect - step, nobs, crit, df)
+            ) / (2 * step)
+            effect = effect - (value - target) / slope
+        return effect
+
+    raise ValueError(f"Unknown test {test}")
+
+
+def _t_power(effect, nobs, crit, df):
+    noncentrality = effect * np.sqrt(nobs)
+    return stats.nct.sf(crit, df, noncentrality) + stats.nct.cdf(
+        -crit, df, noncentrality
+    )
+
+
+def scenario_grid(**axes: Iterable) -> pd.DataFrame:
+    """
+    Every combination of the values passed, one scenario per row, e.g.,
+    `scenario_grid(base_rate=np.linspace(0.07, 0.12, 30), sample_size=[2400, 16665])`
+    """
+    return pd.MultiIndex.from_product(
+        [list(values) for values in axes.values()], names=list(axes)
+    ).to_frame(index=False)
+
+
+def binary_mde_grid(
+    base_rate: Iterable[float],
+    sample_size: Iterable[float],
+    alpha: Iterable[float] = (0.05,),
+    power: Iterable[float] = (0.8,),
+    num_hypotheses: Iterable[int] = (1,),
+    treated_share: float = 0.5,
+) -> pd.DataFrame:
+    """
+    The MDE for a binary outcome in every combination of the scenarios passed.
+
+    Returns:
+        A row per scenario with the `effect_size` (Cohen's h) and the `lower` and
+        `upper` rates we could not tell apart from the `base_rate`
+    """
+    grid = scenario_grid(
+        base_rate=base_rate,
+        sample_size=sample_size,
+        alpha=alpha,
+        power=power,
+        num_hypotheses=num_hypotheses,
+    )
+    grid["effect_size"] = mde(
+        grid.sample_size.values,
+        alpha=grid.alpha.values,
+        power=grid.power.values,
+        num_hypotheses=grid.num_hypotheses.values,
+        treated_share=treated_share,
+    )
+    grid["lower"], grid["upper"] = inverse_cohens_h(
+        grid.effect_size.values, grid.base_rate.values
+    )
+    return grid
+
+
+def continuous_mde_grid(
+    base_mean: Iterable[float],
+    sd: Iterable[float],
+    sample_size: Iterable[float],
+    alpha: Iterable[float] = (0.05,),
+    power: Iterable[float] = (0.8,),
+    num_hypotheses: Iterable[int] = (1,),
+    treated_share: float = 0.5,
+) -> pd.DataFrame:
+    """
+    The MDE for a continuous outcome in every combination of the scenarios passed.
+
+    Returns:
+        A row per scenario with the `effect_size` (Cohen's d) and the `lower` and
+        `upper` means we could not tell apart from the `base_mean`
+    """
+    grid = scenario_grid(
+        base_mean=base_mean,
+        sd=sd,
+        sample_size=sample_size,
+        alpha=alpha,
+        power=power,
+        num_hypotheses=num_hypotheses,
+    )
+    grid["effect_size"] = mde(
+        grid.sample_size.values,
+        alpha=grid.alpha.values,
+        power=grid.power.values,
+        num_hypotheses=grid.num_hypotheses.values,
+        treated_share=treated_share,
+        test="t",
+    )
+    grid["lower"], grid["upper"] = inverse_cohens_d(
+        grid.effect_size.values, grid.base_mean.values, grid.sd.values
+    )
+    return grid
+
+
+def _column(values: np.ndarray) -> np.ndarray:
+    return values[:, np.newaxis]
+
+
+def _simulate_rejections(
+    base_rate: np.ndarray,
+    treated_rate: np.ndarray,
+    num_treated: np.ndarray,
+    num_control: np.ndarray,
+    crit: np.ndarray,
+    num_simulations: int,
+    batch_size: int,
+    seed: np.random.SeedSequence,
+) -> np.ndarray:
+    """
+    Simulate trials of a chunk of scenarios, `batch_size` trials of every scenario
+    at a time, and count how often a two-proportion z-test (with a pooled
+    variance) rejects
+    """
+    rng = np.random.default_rng(seed)
+    rejections = np.zeros(len(base_rate), dtype=np.int64)
+    for start in range(0, num_simulations, batch_size):
+        size = (len(base_rate), min(batch_size, num_simulations - start))
+        treated = rng.binomial(_column(num_treated), _column(treated_rate), size=size)
+        control = rng.binomial(_column(num_control), _column(base_rate), size=size)
+
+        pooled = (treated + control) / _column(num_treated + num_control)
+        se = np.sqrt(pooled * (1 - pooled) * _column(1 / num_treated + 1 / num_control))
+        diff = treated / _column(num_treated) - control / _column(num_control)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.where(se > 0, diff / se, 0.0)
+        rejections += (np.abs(z) > _column(crit)).sum(axis=1)
+    return rejections
+
+
+def simulate_binary_power(
+    scenarios: pd.DataFrame,
+    num_simulations: int = 10_000,
+    treated_share: float = 0.5,
+    seed: int = 0,
+    jobs: Optional[int] = None,
+    batch_size: int = 1_000,
+    chunk_size: int = 64,
+) -> np.ndarray:
+    """
+    Estimate the power of a two-proportion z-test by simulating trials.
+
+    Arguments:
+        scenarios: A row per scenario with `base_rate`, `treated_rate` and
+            `sample_size` columns, and optionally `alpha` (default 0.05) and
+            `num_hypotheses` (default 1), e.g., from `scenario_grid`
+        num_simulations: How many trials to simulate per scenario
+        treated_share: The share of each sample that is treated
+        seed: The seed for the simulations. Each chunk of scenarios gets its own
+            stream, so the results do not depend on `jobs`
+        jobs: How many processes to simulate in. Defaults to the number of CPUs;
+            1 simulates in this process
+        batch_size: How many trials of each scenario to draw at a time; bounds
+            memory use at about `chunk_size * batch_size` draws per process
+        chunk_size: How many scenarios each process simulates at a time
+
+    Returns:
+        The share of simulated trials in each scenario that rejected the null
+    """
+    num_treated = np.round(scenarios.sample_size.values * treated_share).astype(
+        np.int64
+    )
+    num_control = np.round(scenarios.sample_size.values).astype(np.int64) - num_treated
+    alpha = scenarios["alpha"].values if "alpha" in scenarios else 0.05
+    num_hypotheses = (
+        scenarios["num_hypotheses"].values if "num_hypotheses" in scenarios else 1
+    )
+    crit = np.broadcast_to(_critical_value(alpha, num_hypotheses), len(scenarios))
+
+    starts = range(0, len(scenarios), chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks: List[tuple] = [
+        (
+            scenarios.base_rate.values[start : start + chunk_size],
+            scenarios.treated_rate.values[start : start + chunk_size],
+            num_treated[start : start + chunk_size],
+            num_control[start : start + chunk_size],
+            crit[start : start + chunk_size],
+            num_simulations,
+            batch_size,
+            chunk_seed,
+        )
+        for start, chunk_seed in zip(starts, seeds)
+    ]
+
+    if jobs == 1:
+        rejections = [_simulate_rejections(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            rejections = list(
+                pool.map(_simulate_rejections, *zip(*tasks)) if tasks else []
+            )
+
+    if not rejections:
+        return np.zeros(0)
+    return np.concatenate(rejections) / num_simulations
@@ -0,0 +1,268 @@
+"""
+Profiles of `ntl run-all --profile`: the wall time, CPU time and peak memory of each
+stage, the time papermill recorded for each cell of the notebooks, and comparisons
+of two such reports to catch the stages and cells that got slower.
+
+Each profiled stage runs in a process forked for it alone. The kernel or R session
+the stage starts is a child of that process, so the usage `wait4` reports for it
+covers the stage and nothing else. This matters for the peak resident set size,
+which only ever grows within a process.
+"""
+import itertools
+import json
+import os
+import pickle
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import pandas as pd
+
+from .datafiles import OUTPUT_DIR
+from .store import TIMESTAMP_FORMAT
+
+PROFILE_DIR = OUTPUT_DIR / "profiles"
+REPORT_PREFIX = "run_all"
+
+# What is measured for every stage; cells only have a wall time
+METRICS = ("wall_seconds", "cpu_seconds", "max_rss_mb")
+TIME_METRICS = ("wall_seconds", "cpu_seconds")
+
+
+class Usage(NamedTuple):
+    """
+    The resources a call used:
+        * wall_seconds: how long it took
+        * cpu_seconds: the user and system time of its process and the processes
+          that process started
+        * max_rss_mb: the peak resident set size of the largest of those
+          processes, in MB
+    """
+
+    wall_seconds: float
+    cpu_seconds: float
+    max_rss_mb: float
+
+
+class StageProfile(NamedTuple):
+    """
+    The profile of one stage:
+        * stage: the stage's path, relative to the repo
+        * wall_seconds, cpu_seconds, max_rss_mb: as in `Usage`
+        * cells: for notebooks, a dict per code cell with its `cell` index, the
+          `first_line` of its source and the `wall_seconds` papermill recorded
+    """
+
+    stage: str
+    wall_seconds: float
+    cpu_seconds: float
+    max_rss_mb: float
+    cells: Tuple[Dict[str, Any], ...] = ()
+
+
+def _max_rss_mb(max_rss: int) -> float:
+    # Linux reports kilobytes and macOS bytes
+    return max_rss / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def run_profiled(func: Callable, *args, **kwargs) -> Usage:
+    """
+    Call `func(*args, **kwargs)` in a forked process and measure what it used.
+
+    Raises:
+        Whatever `func` raised. Exceptions which cannot be pickled become a
+        RuntimeError with their repr, and a process that dies without reporting
+        back raises a ChildProcessError
+    """
+    read_fd, write_fd = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            func(*args, **kwargs)
+            payload = pickle.dumps(None)
+        except BaseException as error:
+            try:
+                payload = pickle.dumps(error)
+            except Exception:
+                payload = pickle.dumps(RuntimeError(repr(error)))
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        with os.fdopen(write_fd, "wb") as outfile:
+            outfile.write(payload)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as infile:
+        payload = infile.read()
+    _, status, usage = os.wait4(pid, 0)
+    wall_seconds = time.perf_counter() - start
+
+    if not payload:
+        raise ChildProcessError(f"The profiled process exited with status {status}")
+    try:
+        error = pickle.loads(payload)
+    except Exception as unpickle_error:
+        error = RuntimeError(f"The profiled call failed ({unpickle_error})")
+    if error is not None:
+        raise error
+
+    return Usage(
+        wall_seconds,
+        usage.ru_utime + usage.ru_stime,
+        _max_rss_mb(usage.ru_maxrss),
+    )
+
+
+def cell_durations(notebook_path: Path) -> List[Dict[str, Any]]:
+    """
+    The time papermill recorded for each code cell of an executed notebook. Cells
+    that did not run (e.g., after a failing cell) have a `wall_seconds` of None.
+    """
+    with open(notebook_path, "rt") as infile:
+        notebook = json.load(infile)
+
+    cells = []
+    for index, cell in enumerate(notebook.get("cells", [])):
+        if cell["cell_type"] != "code":
+            continue
+        source = cell["source"]
+        source = source if isinstance(source, str) else "".join(source)
+        lines = source.strip().splitlines()
+        cells.append(
+            {
+                "cell": index,
+                "first_line": lines[0] if lines else "",
+                "wall_seconds": cell.get("metadata", {})
+                .get("papermill", {})
+                .get("duration"),
+            }
+        )
+    return cells
+
+
+def write_report(
+    profiles: Sequence[StageProfile],
+    profile_dir: Path = PROFILE_DIR,
+    **metadata: Any,
+) -> Path:
+    """
+    Write a report of a run as JSON, with a CSV of `report_frame` alongside it.
+
+    Arguments:
+        profiles: The profile of each stage that ran, in the order they finished
+        profile_dir: Where to write the report. Its name includes the time, so
+            earlier reports are kept
+        metadata: Anything else worth recording about the run, e.g., its `jobs`
+
+    Returns:
+        The path to the JSON report
+    """
+    profile_dir = Path(profile_dir)
+    profile_dir.mkdir(exist_ok=True, parents=True)
+    now = datetime.now()
+    name = f"{REPORT_PREFIX}_{now.strftime(TIMESTAMP_FORMAT)}"
+    path = profile_dir / f"{name}.json"
+    # Runs which finish within the same second get a suffix rather than clobbering
+    for suffix in itertools.count(1):
+        if not path.exists():
+            break
+        path = profile_dir / f"{name}_{suffix}.json"
+
+    report = {
+        "created": now.isoformat(timespec="seconds"),
+        **metadata,
+        "stages": [
+            {**profile._asdict(), "cells": list(profile.cells)} for profile in profiles
+        ],
+    }
+    with open(path, "wt") as outfile:
+        json.dump(report, outfile, indent=2)
+    report_frame(report).to_csv(path.with_suffix(".csv"), index=False)
+    return path
+
+
+def read_report(path: Path) -> Dict[str, Any]:
+    """ Read a report written by `write_report` """
+    with open(path, "rt") as infile:
+        return json.load(infile)
+
+
+def find_reports(profile_dir: Path = PROFILE_DIR) -> List[Path]:
+    """ Every report in `profile_dir`, oldest first """
+    return sorted(Path(profile_dir).glob(f"{REPORT_PREFIX}_*.json"))
+
+
+def report_frame(report: Dict[str, Any]) -> pd.DataFrame:
+    """
+    A report as a table, with a row per stage (whose `cell` is missing) followed
+    by a row per cell of that stage.
+    """
+    columns = ["stage", "cell", "first_line", *METRICS]
+    rows = []
+    for stage in report["stages"]:
+        rows.append({metric: stage[metric] for metric in ("stage", *METRICS)})
+        rows.extend({"stage": stage["stage"], **cell} for cell in stage["cells"])
+    df = pd.DataFrame(rows, columns=columns)
+    df["cell"] = df.cell.astype(float)
+    return df
+
+
+def compare_reports(
+    old: Dict[str, Any],
+    new: Dict[str, Any],
+    threshold: float = 0.25,
+    min_seconds: float = 1.0,
+) -> pd.DataFrame:
+    """
+    Compare every stage's metrics and every cell's wall time between two reports.
+
+    Arguments:
+        old: The report to compare against
+        new: The report to check
+        threshold: How much larger a metric must get to be a regression, as a
+            fraction of its old value, e.g., 0.25 for 25%
+        min_seconds: How many seconds a time must grow by to be a regression, so
+            that cells which take a moment are not flagged for noise
+
+    Returns:
+        A row per stage or cell and metric, with the `old` and `new` values, their
+        `change` as a fraction of the old value and whether it `is_regression`.
+        Stages and cells in only one report have a missing value in the other, and
+        are never regressions. Cells are matched by their index within the stage
+    """
+    key = ["stage", "cell"]
+
+    def _long(report: Dict[str, Any]) -> pd.DataFrame:
+        df = report_frame(report)
+        # Cells only have a wall time
+        return df.melt(id_vars=key, value_vars=list(METRICS), var_name="metric").dropna(
+            subset=["value"]
+        )
+
+    # Stage totals have no cell; -1 stands in for it while merging
+    old_df, new_df = (_long(report).fillna({"cell": -1}) for report in (old, new))
+    df = old_df.merge(
+        new_df, on=key + ["metric"], how="outer", suffixes=("_old", "_new"), sort=False
+    ).rename(columns={"value_old": "old", "value_new": "new"})
+    df["cell"] = df.cell.where(df.cell >= 0)
+
+    df["change"] = df.new / df.old - 1
+    is_time = df.metric.isin(TIME_METRICS)
+    df["is_regression"] = (df.change > threshold) & (
+        ~is_time | (df.new - df.old >= min_seconds)
+    )
+    return df[key + ["metric", "old", "new", "change", "is_regression"]]
+
+
+def format_comparison(comparison: pd.DataFrame) -> str:
+    """ Rows of `compare_reports` as a table to print """
+    cells = comparison.cell.fillna(-1).astype(int).astype(str)
+    return comparison.assign(
+        cell=cells.replace("-1", ""),
+        change=comparison.change.map("{:+.0%}".format),
+    ).to_string(index=False, float_format="{:.1f}".format)
@@ -1,27 +1,181 @@
+import hashlib
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import pandas as pd
+import pyarrow as pa
+
+from . import store
+from .datafiles import CACHE_DIR, DATA_DIR
+from .inventory import SHA_CACHE_FILE, ShaCache, compute_shas
+
+EXCEL_CACHE_DIR = CACHE_DIR / "excel"
+SHA_CACHE_PATH = DATA_DIR / SHA_CACHE_FILE
+
+StrColumns = Union[Tuple[str, ...], List[str]]
+
+
+class Schema(NamedTuple):
+    """
+    What we know about a file's columns before reading it:
+        * dtype: a map from column names to the dtypes to read them as
+        * parse_dates: columns to parse as datetimes
+        * usecols: if passed, only read these columns
+    """
+
+    dtype: Optional[Dict[str, Any]] = None
+    parse_dates: Sequence[str] = ()
+    usecols: Optional[Sequence[str]] = None
+
+
+def as_str(values: pd.Series) -> pd.Series:
+    """ Convert a column to strings, leaving missing values missing """
+    return values.astype(str).mask(values.isna())
+
+
+def _convert_str_columns(df: pd.DataFrame, str_columns: StrColumns) -> pd.DataFrame:
+    for col in str_columns:
+        if col in df.columns:
+            df[col] = as_str(df[col])
+    return df
+
+
+def source_sha(filename: Path) -> str:
+    """
+    The sha256 of a source file. Files which have not changed since the inventory
+    was last created or verified are not reread.
+    """
+    sha_cache = ShaCache(SHA_CACHE_PATH)
+    sha = compute_shas([filename], cache=sha_cache)[filename]
+    if SHA_CACHE_PATH.parent.exists():
+        sha_cache.save()
+    return sha
+
+
+def _read_excel(
+    filename: Path,
+    dtype: Optional[Dict[str, Any]] = None,
+    columns: Optional[Sequence[str]] = None,
+    cache_dir: Optional[Path] = EXCEL_CACHE_DIR,
+) -> pd.DataFrame:
+    """
+    Read the first sheet of an Excel file. If `cache_dir` is passed, the sheet is
+    converted to Parquet there the first time it is read, named for the file's
+    sha256 (and the dtypes it was read with), and later reads of any of its columns
+    come from the Parquet file. Sheets with columns Arrow cannot store, e.g., a mix
+    of numbers and text, are pickled instead.
+    """
+    columns = list(columns) if columns is not None else None
+    if cache_dir is None:
+        df = pd.read_excel(filename, dtype=dtype)
+        return df[columns].copy() if columns is not None else df
+
+    key = source_sha(filename)
+    if dtype:
+        dtype_sha = hashlib.sha256(repr(sorted(dtype.items())).encode()).hexdigest()
+        key = f"{key}-{dtype_sha[:12]}"
+    pickle_path = Path(cache_dir) / f"{key}.pkl"
+    try:
+        return store.read(key, columns=columns, base_dir=cache_dir)
+    except ValueError:
+        pass
+
+    if pickle_path.exists():
+        df = pd.read_pickle(pickle_path)
+    else:
+        df = pd.read_excel(filename, dtype=dtype)
+        try:
+            store.write(key, df, base_dir=cache_dir)
+        except (pa.ArrowException, TypeError, ValueError):
+            df.to_pickle(pickle_path)
+    return df[columns].copy() if columns is not None else df
 
 
 def read_file(
     filename: Union[str, Path],
-    str_columns: Union[Tuple[str, ...], List[str]] = ("MedicaidSystemID",),
+    str_columns: StrColumns = ("MedicaidSystemID",),
+    schema: Optional[Schema] = None,
+    cache_dir: Optional[Path] = EXCEL_CACHE_DIR,
 ) -> pd.DataFrame:
     """
     Read a file into pandas if it is either a CSV or Excel file. If any of the
-    names in str_columns are present, convert those columns into string types.
+    names in str_columns are present, convert those columns into string types
+    (missing values stay missing).
+
+    Arguments:
+        filename: The CSV or Excel file to read
+        str_columns: Columns to convert to strings if present
+        schema: The dtypes, date columns and columns to read, if known. For CSVs
+            these are passed straight to `pd.read_csv`
+        cache_dir: Where to cache Excel files in a columnar format so that they
+            are only parsed once. Pass None to always parse them
+
+    Returns:
+        The file's contents
+
+    Raises:
+        ValueError: If the file is neither a CSV nor an Excel file
     """
     filename = Path(filename)
+    schema = schema or Schema()
     str_columns = str_columns or []
 
     if filename.suffix == ".csv":
-        df = pd.read_csv(filename)
+        df = pd.read_csv(
+            filename,
+            dtype=schema.dtype,
+            parse_dates=list(schema.parse_dates) or False,
+            usecols=schema.usecols,
+        )
     elif filename.suffix[:4] == ".xls":
-        df = pd.read_excel(filename)
+        df = _read_excel(
+            filename, dtype=schema.dtype, columns=schema.usecols, cache_dir=cache_dir
+        )
+        for col in schema.parse_dates:
+            df[col] = pd.to_datetime(df[col])
+    else:
+        raise ValueError(f"Unsupported file type for {filename}")
 
-    for col in str_columns:
-        if col in df.columns:
-            df[col] = df[col].astype(str)
+    return _convert_str_columns(df, str_columns)
 
-    return df
+
+def iter_file(
+    filename: Union[str, Path],
+    chunksize: int,
+    str_columns: StrColumns = ("MedicaidSystemID",),
+    schema: Optional[Schema] = None,
+    cache_dir: Optional[Path] = EXCEL_CACHE_DIR,
+) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV or Excel file `chunksize` rows at a time, as `read_file` would.
+    CSVs are streamed, so only one chunk is ever in memory. Excel files are read
+    whole (from the cache if possible) and then split up.
+    """
+    filename = Path(filename)
+    schema = schema or Schema()
+    str_columns = str_columns or []
+
+    if filename.suffix == ".csv":
+        chunks = pd.read_csv(
+            filename,
+            dtype=schema.dtype,
+            parse_dates=list(schema.parse_dates) or False,
+            usecols=schema.usecols,
+            chunksize=chunksize,
+        )
+        for chunk in chunks:
+            yield _convert_str_columns(chunk, str_columns)
+    else:
+        df = read_file(filename, str_columns, schema=schema, cache_dir=cache_dir)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start : start + chunksize]
@@ -0,0 +1,590 @@
+"""
+A client for the SafetyPAD API, which FEMS uses to track the outcomes of the patients
+they serve, a resumable, rate-limited puller for patient care records (PCRs), and an
+extractor that turns a pull into a table.
+
+Every PCR pulled (or that failed to pull) is appended to a JSON lines manifest as
+soon as it comes back, so an interrupted pull picks up exactly where it stopped.
+"""
+import copy
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+
+BASE_URL = r"https://dcfems.safetypad.com/api/"
+
+# HTTP statuses worth trying again after a pause
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+COLUMNS = (
+    [
+        "eCase.01m",  # PCR ID
+        "eResponse.01",  # Agency Number
+        "eResponse.02",  # Agency Name
+        "eResponse.03",  # Incident Number
+        "eResponse.05",  # Type of servicee requested
+        "eResponse.07",  # Primary role of unit
+        "eResponse.14",  # EMS Unit Call Sign
+        "eResponse.14s",  # Shift
+        "eResponse.15",  # Level of care of unit
+        "eDispatch.01",  # Complaint reported by dispatch
+        "eTimes.01",  # PSAP Call Date/Time
+        "eTimes.02",  # Dispatch Notified Date/Time
+        "eTimes.03",  # Unit Notified by Dispatch Date/Time
+        "eDisposition.01",  # Destination/Transferred To, Name
+        "eDisposition.12",  # Incident/Patient Disposition
+        "eScene.15",  # Incident Street Address
+        "eScene.17",  # Incident City
+        "eScene.18",  # Incident State
+        "eScene.19",  # Incident ZIP Code
+        "ePayment.01",  # Primary Method of Payment
+        "ePayment.10",  # Insurance Company Name
+        "ePayment.17",  # Insurance Group ID
+        "ePayment.18",  # Insurance Policy ID Number
+        "eNarrative.01",  # Narrative data about the incident
+        "eCrew.01",  # Crew id
+        "ePatient.18s",  # Patient phone number type
+    ]
+    + [
+        "ePatient.{:02d}".format(i)
+        for i in range(2, 22)  # Patient detail; 01 causes issues
+    ]
+    + ["ePatient.{:02d}s".format(i) for i in range(23, 25)]  # Signature information
+    + ["ePatient.{:02d}c".format(i) for i in range(25, 28)]  # Hospital information
+    + ["eOutcome.{:02d}".format(i) for i in range(1, 18)]  # Outcome information
+)
+
+
+class SafetyPadError(Exception):
+    """ The API answered, but not with a successful response """
+
+
+def is_success(tree) -> bool:
+    elts = tree.xpath("//safetypadapiresponse/status")
+    if not elts:
+        return False
+    return elts[0].text == "SUCCESS"
+
+
+def to_dict(pcr) -> Dict[str, str]:
+    return {elt.tag: elt.text for elt in pcr.getchildren()}
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: `acquire` hands out at most `rate` tokens per
+    second on average, and at most `capacity` at once after a quiet spell.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Any] = time.sleep,
+    ):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be positive and capacity at least 1")
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Take a token, waiting for one if there are none left """
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            self._sleep(wait_for)
+
+
+class SafetyPadClient:
+    """
+    A client for the SafetyPAD API. Requests share a pool of connections, are rate
+    limited across all threads using the client, and are retried with exponential
+    backoff (plus jitter) on connection errors and 429/5xx responses.
+
+    Arguments:
+        api_key: The SafetyPAD API key
+        base_url: Where the API lives
+        rate: The most requests to make per second
+        burst: How many requests may be made at once after a quiet spell
+        max_retries: How many times to retry a failed request
+        backoff: The wait before the first retry, in seconds; it doubles each time
+        timeout: How long to wait for a response, in seconds
+        pool_size: The number of connections to keep open
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = BASE_URL,
+        rate: float = 1.0,
+        burst: float = 1.0,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        timeout: float = 60.0,
+        pool_size: int = 10,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.columns = ",".join(COLUMNS)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, capacity=burst)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _get(self, params: Dict[str, Any]) -> bytes:
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                resp = self.session.get(
+                    self.base_url, params=params, timeout=self.timeout
+                )
+                if resp.status_code not in RETRY_STATUSES:
+                    resp.raise_for_status()
+                    return resp.content
+                error: Exception = requests.HTTPError(
+                    f"{resp.status_code} from SafetyPAD", response=resp
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+
+            if attempt >= self.max_retries:
+                raise error
+            time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+            attempt += 1
+
+    def _action(self, action: str, attrs: Dict[str, Any]):
+        attrs = copy.copy(attrs)
+        attrs["action"] = action
+        attrs["api_key"] = self.api_key
+        return etree.fromstring(self._get(attrs))
+
+    def search_pcrs(self, max_num: int = 10) -> pd.DataFrame:
+        tree = self._action("search_pcrs", {"max": max_num})
+        if not is_success(tree):
+            raise SafetyPadError("Something went wrong retrieving tree")
+        data = [
+            to_dict(pcr)
+            for pcr in tree.xpath("//safetypadapiresponse/message/pcrs/pcr")
+        ]
+        return pd.DataFrame(data)
+
+    def view_pcr(self, pcr_id: Union[int, str]) -> Dict[str, Any]:
+        """
+        Pull a single PCR, in the format `010_pull_data_from_safetypad` saved them:
+        the raw XML and a list of the tag, attributes and text of each field
+
+        Raises:
+            SafetyPadError: If the API does not report success
+        """
+        tree = self._action(
+            "search_pcrs",
+            {"e1": 676, "o1": "equals", "v1": str(pcr_id), "columns": self.columns},
+        )
+        if not is_success(tree):
+            raise SafetyPadError(f"Retrieving PCR {pcr_id} did not succeed")
+
+        return {
+            "raw": etree.tostring(tree).decode("utf8"),
+            "parsed": [
+                {
+                    "tag": str(node.tag),
+                    "attributes": dict(node.attrib),
+                    "text": str(node.text),
+                }
+                for node in tree.xpath("//pcr/*")
+            ],
+        }
+
+
+def read_pcr_ids(filename: Union[str, Path]) -> List[int]:
+    """
+    Read the PCR IDs to pull from either a pickled pandas object (as used for the
+    original pull) or a text or CSV file with one ID per line. Anything that is not
+    a number, e.g., a header, is skipped.
+    """
+    filename = Path(filename)
+    if filename.suffix == ".pkl":
+        values = pd.Series(pd.read_pickle(filename)).tolist()
+    else:
+        with open(filename, "rt") as infile:
+            values = [line.split(",")[0].strip() for line in infile]
+
+    pcr_ids = set()
+    for value in values:
+        try:
+            pcr_ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return sorted(pcr_ids)
+
+
+def read_manifest(manifest_path: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the entries of a pull manifest. A last line cut off by an
+    interrupted run is ignored; `pull_pcrs` drops it and pulls that PCR again.
+    """
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return
+    with open(manifest_path, "rt") as infile:
+        for line in infile:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _drop_partial_line(manifest_path: Path, block_size: int = 1 << 16):
+    """ Cut off a last line left unfinished by an interrupted run """
+    with open(manifest_path, "rb+") as manifest:
+        end = manifest.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            manifest.seek(position)
+            last_newline = manifest.read(step).rfind(b"\n")
+            if last_newline != -1:
+                manifest.truncate(position + last_newline + 1)
+                return
+        manifest.truncate(0)
+
+
+def pulled_pcr_ids(manifest_path: Union[str, Path]) -> Set[int]:
+    """ The PCRs that have already been pulled successfully """
+    return {
+        entry["pcr_id"]
+        for entry in read_manifest(manifest_path)
+        if entry["status"] == "ok"
+    }
+
+
+class PullSummary(NamedTuple):
+    """
+    The result of `pull_pcrs`:
+        * skipped: PCRs already in the manifest from an earlier run
+        * pulled: PCRs pulled in this run
+        * failed: PCRs that could not be pulled in this run
+    """
+
+    skipped: int
+    pulled: int
+    failed: List[int]
+
+
+def pull_pcrs(
+    client: SafetyPadClient,
+    pcr_ids: Iterable[int],
+    manifest_path: Union[str, Path],
+    jobs: int = 4,
+    progress: Optional[Callable[[int, int], Any]] = None,
+) -> PullSummary:
+    """
+    Pull PCRs, appending each one to `manifest_path` (one JSON object per line) as
+    soon as it arrives. PCRs already pulled successfully according to the manifest
+    are skipped, so rerunning after an interruption (or to retry failures) resumes
+    where the last run stopped.
+
+    Arguments:
+        client: The client to pull with
+        pcr_ids: The PCRs to pull
+        manifest_path: The JSON lines file to record the results in
+        jobs: How many requests to have in flight at once. The client's rate
+            limit applies across all of them
+        progress: If passed, called with the number of PCRs done and to do
+
+    Returns:
+        How many PCRs were skipped and pulled, and which failed
+    """
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(exist_ok=True, parents=True)
+    if manifest_path.exists():
+        _drop_partial_line(manifest_path)
+    done = pulled_pcr_ids(manifest_path)
+    all_ids = sorted(set(pcr_ids))
+    to_pull = [pcr_id for pcr_id in all_ids if pcr_id not in done]
+
+    pulled = 0
+    failed: List[int] = []
+    with open(manifest_path, "at") as manifest, ThreadPoolExecutor(jobs) as pool:
+
+        def _record(future: "Future[Dict[str, Any]]", pcr_id: int):
+            nonlocal pulled
+            try:
+                entry = {"pcr_id": pcr_id, "status": "ok", **future.result()}
+                pulled += 1
+            except (requests.RequestException, SafetyPadError, etree.Error) as exc:
+                entry = {"pcr_id": pcr_id, "status": "failed", "error": repr(exc)}
+                failed.append(pcr_id)
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            if progress:
+                progress(pulled + len(failed), len(to_pull))
+
+        # Only keep a few requests queued up at a time so that an interrupted run
+        # has not already fetched (and lost) a large backlog
+        in_flight: Dict["Future[Dict[str, Any]]", int] = {}
+        for pcr_id in to_pull:
+            if len(in_flight) >= 2 * jobs:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    _record(future, in_flight.pop(future))
+            in_flight[pool.submit(client.view_pcr, pcr_id)] = pcr_id
+
+        for future in list(in_flight):
+            _record(future, in_flight.pop(future))
+
+    return PullSummary(
+        skipped=len(all_ids) - len(to_pull), pulled=pulled, failed=failed
+    )
+
+
+class TagGroup(NamedTuple):
+    """
+    A set of PCR fields to extract: the NEMSIS tags and the column each becomes
+    """
+
+    tags: Tuple[str, ...]
+    columns: Tuple[str, ...]
+
+
+IDENTIFIER_FIELDS = TagGroup(
+    tags=("eCase.01m", "eResponse.03"), columns=("pcr_id", "fems_id")
+)
+PATIENT_FIELDS = TagGroup(
+    tags=tuple("ePatient.{:02d}".format(i) for i in range(2, 22)),
+    columns=(
+        "last_name",
+        "first_name",
+        "middle_name",
+        "home_address",
+        "home_city",
+        "home_county",
+        "home_state",
+        "home_zip",
+        "home_country",
+        "home_tract",
+        "ssn",
+        "gender",
+        "race",
+        "age",
+        "age_units",
+        "date_of_birth",
+        "phone_number",
+        "email_address",
+        "drivers_license_state",
+        "drivers_license_number",
+    ),
+)
+PAYMENT_FIELDS = TagGroup(
+    tags=("ePayment.01", "ePayment.10", "ePayment.17", "ePayment.18"),
+    columns=(
+        "method_of_payment",
+        "insurance_company_name",
+        "insurance_group_number",
+        "insurance_policy_number",
+    ),
+)
+TIMES_FIELDS = TagGroup(
+    tags=("eTimes.01", "eTimes.02", "eTimes.03"),
+    columns=("psap_call_time", "dispatch_notified_time", "unit_notified_time"),
+)
+DISPOSITION_FIELDS = TagGroup(
+    tags=("eDisposition.01", "eDisposition.12"),
+    columns=("destination_name", "incident_disposition"),
+)
+
+# The fields in `demographic_data.csv`
+DEMOGRAPHIC_GROUPS = (IDENTIFIER_FIELDS, PATIENT_FIELDS, PAYMENT_FIELDS)
+
+
+def _parsed_to_dict(parsed: List[Dict[str, Any]]) -> Dict[str, Optional[str]]:
+    # Pulls saved missing fields as the string "None"
+    return {
+        field["tag"]: None if field["text"] == "None" else field["text"]
+        for field in parsed
+    }
+
+
+def _iter_json_array(infile: TextIO, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """
+    Iterate over the elements of a JSON array in a file without loading the whole
+    file, holding at most one element (plus a chunk of text) in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    at_eof = False
+    while True:
+        # Skip whitespace, the opening bracket and the commas between elements
+        while position < len(buffer) and (
+            buffer[position].isspace() or (started and buffer[position] == ",")
+        ):
+            position += 1
+        if position < len(buffer) and not started:
+            if buffer[position] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            position += 1
+            continue
+
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        if position < len(buffer):
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # Most likely the element runs past the end of the buffer
+                if at_eof:
+                    raise
+            else:
+                # A number at the very end of the buffer may yet have more digits
+                if end < len(buffer) or at_eof:
+                    position = end
+                    yield element
+                    continue
+
+        if at_eof:
+            raise ValueError("Unexpected end of JSON array")
+        chunk = infile.read(chunk_size)
+        at_eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_pulled_pcrs(filename: Union[str, Path]) -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Stream the PCRs in a pull, one dict from tag to text per PCR, without loading
+    the whole pull into memory. Reads any of:
+        * the JSON lines manifest written by `pull_pcrs` (failed pulls are skipped)
+        * a JSON array of pulled PCRs, e.g., `final.json` from the original pull
+        * XML with `pcr` elements, e.g., a saved SafetyPAD API response
+    """
+    filename = Path(filename)
+    if filename.suffix == ".jsonl":
+        for entry in read_manifest(filename):
+            if entry["status"] == "ok":
+                yield _parsed_to_dict(entry["parsed"])
+    elif filename.suffix == ".json":
+        with open(filename, "rt") as infile:
+            for datum in _iter_json_array(infile):
+                yield _parsed_to_dict(datum["parsed"])
+    elif filename.suffix == ".xml":
+        for _, pcr in etree.iterparse(str(filename), tag="pcr"):
+            yield {elt.tag: elt.text for elt in pcr}
+            # Free the PCRs we have already seen
+            pcr.clear()
+            while pcr.getprevious() is not None:
+                del pcr.getparent()[0]
+    else:
+        raise ValueError(f"Unsupported file type for {filename}")
+
+
+def extract_pcrs(
+    source: Union[str, Path],
+    output: Union[str, Path],
+    groups: Sequence[TagGroup] = DEMOGRAPHIC_GROUPS,
+    batch_size: int = 10_000,
+) -> int:
+    """
+    Extract fields from a pull of PCRs into a table, one row per PCR, writing
+    `batch_size` rows at a time so that neither the pull nor the table is ever
+    held in memory whole.
+
+    Arguments:
+        source: The pull; see `iter_pulled_pcrs` for the formats supported
+        output: Where to write the table; a .parquet or .csv file
+        groups: The fields to extract. Every column is a string, and fields
+            missing from a PCR are missing
+        batch_size: How many rows to write at a time
+
+    Returns:
+        The number of rows written
+    """
+    output = Path(output)
+    if output.suffix not in (".parquet", ".csv"):
+        raise ValueError(f"Unsupported output type for {output}")
+    tags = [tag for group in groups for tag in group.tags]
+    columns = [column for group in groups for column in group.columns]
+    if len(tags) != len(columns):
+        raise ValueError("Every tag group needs exactly one column per tag")
+    schema = pa.schema([(column, pa.string()) for column in columns])
+
+    num_rows = 0
+    with ExitStack() as stack:
+        writer = None
+        if output.suffix == ".parquet":
+            writer = stack.enter_context(pq.ParquetWriter(output, schema))
+        else:
+            # Write the header even if there are no PCRs
+            pd.DataFrame(columns=columns).to_csv(output, index=False)
+
+        batch: List[List[Optional[str]]] = []
+
+        def _flush():
+            df = pd.DataFrame.from_records(batch, columns=columns)
+            if writer is not None:
+                writer.write_table(
+                    pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                )
+            else:
+                df.to_csv(output, mode="a", header=False, index=False)
+            batch.clear()
+
+        for pcr in iter_pulled_pcrs(source):
+            batch.append([pcr.get(tag) for tag in tags])
+            num_rows += 1
+            if len(batch) >= batch_size:
+                _flush()
+        if batch:
+            _flush()
+
+    return num_rows
@@ -0,0 +1,339 @@
+"""
+Simulate the nurse triage line as a loss system: calls arrive at the times they were
+made, each of `num_slots` nurses takes one call at a time, and a call that arrives
+when every nurse is busy is dropped (i.e., sent to BLS as it would have been before
+the NTL).
+
+Each call is assigned a *slot*: the number of calls already in progress when it
+arrived. Slots `0, ..., num_slots - 1` were answered and slot `num_slots` means the
+call was dropped. This matches `dropped_timestamps` in
+`100_preanalysis/100_dropped_calls.ipynb`, so, e.g., the share of calls answered by
+the first `num_local` nurses is the share with slot < num_local.
+"""
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+NANOSECONDS_PER_MINUTE = 60 * 10 ** 9
+
+Durations = Union[float, np.ndarray]
+
+
+def _to_nanoseconds(minutes: Durations) -> Union[int, np.ndarray]:
+    if np.ndim(minutes) == 0:
+        return int(round(float(minutes) * NANOSECONDS_PER_MINUTE))
+    return np.round(np.asarray(minutes, dtype=float) * NANOSECONDS_PER_MINUTE).astype(
+        np.int64
+    )
+
+
+def draw_durations(
+    num_calls: int, mean_minutes: float, rng: np.random.Generator
+) -> np.ndarray:
+    """ Exponentially distributed call durations, in minutes, with the given mean """
+    return rng.exponential(mean_minutes, size=num_calls)
+
+
+class _Occupancy(NamedTuple):
+    """
+    What we can say about a sorted set of calls before choosing the number of slots:
+        * ends: when each call would end if answered
+        * in_progress: how many earlier calls would still be in progress when each
+          call arrives if none were dropped
+        * starts: the index of the first call of each busy period, i.e., the calls
+          that arrive to an empty line whatever happened before them
+        * peaks: the maximum of `in_progress` in each busy period
+    """
+
+    ends: np.ndarray
+    in_progress: np.ndarray
+    starts: np.ndarray
+    peaks: np.ndarray
+
+
+def _occupancy(times: np.ndarray, durations: Union[int, np.ndarray]) -> _Occupancy:
+    ends = times + durations
+    sorted_ends = ends if np.ndim(durations) == 0 else np.sort(ends)
+    # Every call that ended before call i arrived also started before it did
+    in_progress = np.arange(len(times)) - np.searchsorted(
+        sorted_ends, times, side="left"
+    )
+    latest_end = np.maximum.accumulate(ends)
+    starts = np.flatnonzero(np.r_[True, times[1:] > latest_end[:-1]])
+    peaks = (
+        np.maximum.reduceat(in_progress, starts)
+        if len(times)
+        else np.zeros(0, dtype=in_progress.dtype)
+    )
+    return _Occupancy(ends, in_progress, starts, peaks)
+
+
+def _simulate_calls(
+    times: List[int],
+    ends: List[int],
+    on_call: List[int],
+    num_slots: int,
+    slots: np.ndarray,
+    offset: int,
+):
+    """
+    Run the queue one call at a time, starting with the calls in the heap `on_call`
+    in progress, and write each call's slot into `slots` from `offset` on
+    """
+    for i, (next_call, end) in enumerate(zip(times, ends)):
+        # Remove calls which are now over
+        while on_call and on_call[0] < next_call:
+            heapq.heappop(on_call)
+
+        if len(on_call) < num_slots:
+            slots[offset + i] = len(on_call)
+            heapq.heappush(on_call, end)
+        else:
+            slots[offset + i] = num_slots
+
+
+def _assign_sorted(
+    times: np.ndarray, occupancy: _Occupancy, num_slots: int
+) -> np.ndarray:
+    """
+    Assign slots to sorted calls. In a busy period where the line never fills, no
+    call is dropped and each call's slot is just the number of calls in progress,
+    so only the busy periods that fill up are simulated call by call.
+    """
+    slots = occupancy.in_progress.copy()
+    stops = np.r_[occupancy.starts[1:], len(times)]
+    full = occupancy.peaks >= num_slots
+    for start, stop in zip(occupancy.starts[full], stops[full]):
+        # Every call before the line first fills is answered
+        first_full = start + int(
+            np.argmax(occupancy.in_progress[start:stop] >= num_slots)
+        )
+        on_call = occupancy.ends[start:first_full]
+        on_call = on_call[on_call >= times[first_full]].tolist()
+        heapq.heapify(on_call)
+        _simulate_calls(
+            times[first_full:stop].tolist(),
+            occupancy.ends[first_full:stop].tolist(),
+            on_call,
+            num_slots,
+            slots,
+            first_full,
+        )
+    return slots
+
+
+def _as_nanoseconds(timestamps) -> np.ndarray:
+    return (
+        pd.to_datetime(pd.Series(timestamps))
+        .values.astype("datetime64[ns]")
+        .view(np.int64)
+    )
+
+
+def assign_slots(timestamps, duration_minutes: Durations, num_slots: int) -> np.ndarray:
+    """
+    Determine which calls would end up dropped if there are a fixed number of slots
+    available.
+
+    Arguments:
+        timestamps: The call times, in any order
+        duration_minutes: How long each call takes, in minutes; either one length
+            for every call or an array with one per call
+        num_slots: The number of slots available for calls
+
+    Returns:
+        The slot that answered each call, in the order of `timestamps`. If the
+        slot == num_slots, the call was dropped
+    """
+    times = _as_nanoseconds(timestamps)
+    durations = _to_nanoseconds(duration_minutes)
+    order = np.argsort(times, kind="stable")
+    sorted_times = times[order]
+    if np.ndim(durations):
+        durations = durations[order]
+
+    slots = np.empty_like(order)
+    slots[order] = _assign_sorted(
+        sorted_times, _occupancy(sorted_times, durations), num_slots
+    )
+    return slots
+
+
+class SweepResult(NamedTuple):
+    """
+    The result of `sweep`; each is a tidy DataFrame with a row per scenario (the
+    `duration_minutes`, `num_slots` and `draw` of random durations) and:
+        * by_hour: `hour` of the day, `num_calls`, `num_dropped` and `drop_rate`
+        * by_week: `week` (the Sunday it ends), `num_calls`, `num_dropped` and
+          `drop_rate`
+        * by_slot: `slot` and the `num_calls` it answered
+    """
+
+    by_hour: pd.DataFrame
+    by_week: pd.DataFrame
+    by_slot: pd.DataFrame
+
+
+class _Counts(NamedTuple):
+    """ The calls and drops in one scenario, per hour, per week and per slot """
+
+    num_slots: int
+    hour_calls: np.ndarray
+    hour_drops: np.ndarray
+    week_calls: np.ndarray
+    week_drops: np.ndarray
+    slot_calls: np.ndarray
+
+
+# Set in each worker process so that the calls are only sent to it once
+_SWEEP_CALLS: Dict[str, np.ndarray] = {}
+
+
+def _init_sweep(times: np.ndarray, hours: np.ndarray, weeks: np.ndarray):
+    _SWEEP_CALLS.update(times=times, hours=hours, weeks=weeks)
+
+
+def _run_scenarios(
+    duration_minutes: float,
+    num_slots: Sequence[int],
+    seed: Optional[np.random.SeedSequence],
+    num_weeks: int,
+) -> List[_Counts]:
+    """ Simulate one set of call durations with every number of slots """
+    times, hours, weeks = (_SWEEP_CALLS[key] for key in ("times", "hours", "weeks"))
+    if seed is None:
+        durations = _to_nanoseconds(duration_minutes)
+    else:
+        rng = np.random.default_rng(seed)
+        durations = _to_nanoseconds(draw_durations(len(times), duration_minutes, rng))
+
+    occupancy = _occupancy(times, durations)
+    hour_calls = np.bincount(hours, minlength=24)
+    week_calls = np.bincount(weeks, minlength=num_weeks)
+    results = []
+    for slots_available in num_slots:
+        slots = _assign_sorted(times, occupancy, slots_available)
+        dropped = slots >= slots_available
+        results.append(
+            _Counts(
+                num_slots=slots_available,
+                hour_calls=hour_calls,
+                hour_drops=np.bincount(hours[dropped], minlength=24),
+                week_calls=week_calls,
+                week_drops=np.bincount(weeks[dropped], minlength=num_weeks),
+                slot_calls=np.bincount(slots, minlength=slots_available + 1),
+            )
+        )
+    return results
+
+
+def sweep(
+    timestamps,
+    duration_minutes: Sequence[float],
+    num_slots: Sequence[int],
+    random_durations: bool = False,
+    num_draws: int = 1,
+    seed: int = 0,
+    jobs: Optional[int] = None,
+) -> SweepResult:
+    """
+    Simulate the line under every combination of call length and number of slots.
+
+    Arguments:
+        timestamps: The call times, e.g., the eligible calls in `2016_EMS_Events`
+        duration_minutes: The call lengths to try, in minutes. With
+            `random_durations`, these are the mean lengths
+        num_slots: The numbers of slots to try
+        random_durations: If True, draw each call's length from an exponential
+            distribution rather than giving every call the same length
+        num_draws: How many sets of random lengths to draw for each call length
+        seed: The seed for the random lengths. Every number of slots sees the
+            same draws, and the results do not depend on `jobs`
+        jobs: How many processes to run scenarios in. Defaults to the number of
+            CPUs; 1 runs everything in this process
+
+    Returns:
+        Drop rates by hour and by week, and the calls each slot answered
+    """
+    calls = pd.to_datetime(pd.Series(timestamps)).sort_values(kind="mergesort")
+    times = calls.values.astype("datetime64[ns]").view(np.int64)
+    hours = calls.dt.hour.values.astype(np.int64)
+    week_labels = calls.dt.to_period("W").dt.start_time + pd.Timedelta(days=6)
+    week_codes, weeks = pd.factorize(week_labels, sort=True)
+
+    num_slots = sorted(set(num_slots))
+    draws = range(num_draws) if random_durations else [0]
+    seeds = np.random.SeedSequence(seed).spawn(len(duration_minutes) * len(draws))
+    tasks = [
+        (minutes, draw, seeds[i * len(draws) + draw] if random_durations else None)
+        for i, minutes in enumerate(duration_minutes)
+        for draw in draws
+    ]
+
+    initargs = (times, hours, week_codes.astype(np.int64))
+    if jobs == 1:
+        _init_sweep(*initargs)
+        results = [
+            _run_scenarios(minutes, num_slots, task_seed, len(weeks))
+            for minutes, _, task_seed in tasks
+        ]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs or os.cpu_count(),
+            initializer=_init_sweep,
+            initargs=initargs,
+        ) as pool:
+            futures = [
+                pool.submit(_run_scenarios, minutes, num_slots, task_seed, len(weeks))
+                for minutes, _, task_seed in tasks
+            ]
+            results = [future.result() for future in futures]
+
+    by_hour, by_week, by_slot = [], [], []
+    for (minutes, draw, _), scenarios in zip(tasks, results):
+        for counts in scenarios:
+            scenario = {
+                "duration_minutes": minutes,
+                "num_slots": counts.num_slots,
+                "draw": draw,
+            }
+            by_hour.append(
+                pd.DataFrame(
+                    {
+                        **scenario,
+                        "hour": np.arange(24),
+                        "num_calls": counts.hour_calls,
+                        "num_dropped": counts.hour_drops,
+                    }
+                )
+            )
+            by_week.append(
+                pd.DataFrame(
+                    {
+                        **scenario,
+                        "week": weeks,
+                        "num_calls": counts.week_calls,
+                        "num_dropped": counts.week_drops,
+                    }
+                )
+            )
+            by_slot.append(
+                pd.DataFrame(
+                    {
+                        **scenario,
+                        "slot": np.arange(len(counts.slot_calls)),
+                        "num_calls": counts.slot_calls,
+                    }
+                )
+            )
+
+    by_hour_df, by_week_df = (
+        pd.concat(frames, ignore_index=True) for frames in (by_hour, by_week)
+    )
+    for df in (by_hour_df, by_week_df):
+        df["drop_rate"] = df.num_dropped / df.num_calls.where(df.num_calls > 0)
+    return SweepResult(by_hour_df, by_week_df, pd.concat(by_slot, ignore_index=True))
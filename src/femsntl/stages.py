@@ -0,0 +1,452 @@
+"""
+A manifest of the stages `ntl run-all` executes, what each one reads and writes, and
+a ledger of the last successful run of each so that unchanged stages can be skipped.
+
+A stage is "unchanged" when its fingerprint -- a sha256 over its own source, the
+helper code it depends on and the contents of every input it reads -- matches the
+one recorded in the ledger the last time it ran successfully and all of its declared
+outputs still exist.
+"""
+import fnmatch
+import hashlib
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import yaml
+
+from .datafiles import (
+    BASE_DIR,
+    EMS_EVENTS_2016,
+    EXTERNAL_DIR,
+    INTERMEDIATE_DIR,
+    NOTEBOOK_DIR,
+    NYU_ED_FILE,
+    OUTPUT_DIR,
+    PKL_FILE,
+    PRIVATE_DATA_DIR,
+    SAFETYPAD_DIR,
+    SQL_DUMP_FILE,
+    SRC_DIR,
+)
+from .utils import compute_sha, get_mostrec
+
+LEDGER_FILE = OUTPUT_DIR / "run_ledger.yml"
+EXECUTED_NOTEBOOK_DIR = OUTPUT_DIR / "notebooks"
+
+PACKAGE_DIR = Path(__file__).parent
+R_DIR = SRC_DIR / "R"
+R_ANALYSIS_DIR = R_DIR / "400_analysis"
+R_HELPERS = (R_DIR / "000_constants.R", R_DIR / "001_viz_utils.R")
+FIGURE_DIR = OUTPUT_DIR / "figures"
+TABLES_DIR = OUTPUT_DIR / "tables"
+
+
+class MostRecent(NamedTuple):
+    """
+    A versioned file, e.g., `ntl_withmedicaidIDS_<timestamp>.csv`, which is read
+    with `get_mostrec(prefix)` (in Python or R) and written with a fresh timestamp
+    """
+
+    prefix: str
+    base_dir: Path = INTERMEDIATE_DIR
+
+    @property
+    def pattern(self) -> str:
+        return str(self.base_dir / f"{self.prefix}*")
+
+
+# An input or output: a file, a glob of files, or the most recent of a versioned file
+FileSpec = Union[Path, MostRecent]
+
+
+class Stage(NamedTuple):
+    """
+    A single notebook or script run by `ntl run-all`:
+        * path: the notebook, R script or R markdown file to execute
+        * step: the `--step` it belongs to
+        * inputs: the data files it reads
+        * outputs: the data files, figures and tables it writes
+        * code: other source files it runs, e.g., sourced R files or femsntl modules
+    """
+
+    path: Path
+    step: str
+    inputs: Tuple[FileSpec, ...] = ()
+    outputs: Tuple[FileSpec, ...] = ()
+    code: Tuple[Path, ...] = ()
+
+    @property
+    def name(self) -> str:
+        return relative_path(self.path)
+
+    @property
+    def executed_path(self) -> Optional[Path]:
+        """ Where the executed notebook or rendered html ends up, if anywhere """
+        output_dir = EXECUTED_NOTEBOOK_DIR / self.path.parent.name
+        if self.path.suffix == ".ipynb":
+            return output_dir / self.path.name
+        if self.path.suffix == ".Rmd":
+            return output_dir / self.path.with_suffix(".html").name
+        return None
+
+
+def _module(name: str) -> Path:
+    return PACKAGE_DIR / f"{name}.py"
+
+
+STAGES: Tuple[Stage, ...] = (
+    Stage(
+        NOTEBOOK_DIR / "100_preanalysis" / "100_dropped_calls.ipynb",
+        step="1",
+        inputs=(EMS_EVENTS_2016,),
+        code=(_module("datafiles"), _module("simulation")),
+    ),
+    Stage(
+        NOTEBOOK_DIR / "100_preanalysis" / "200_power_calculations.ipynb",
+        step="1",
+        code=(_module("power"),),
+    ),
+    Stage(
+        NOTEBOOK_DIR / "300_merge_and_clean" / "010_merge_CAD_safetyPAD.ipynb",
+        step="3",
+        inputs=(
+            SQL_DUMP_FILE,
+            PKL_FILE,
+            PRIVATE_DATA_DIR / "ntl_data_tableau.csv",
+            SAFETYPAD_DIR / "safetypad_idsearch_batch*.csv",
+            SAFETYPAD_DIR / "safetypad_idsearch_nonparticipants.csv",
+        ),
+        outputs=(
+            OUTPUT_DIR / "overall_trends_txcont.png",
+            EXTERNAL_DIR / "ntl_participants_forAMR.csv",
+            EXTERNAL_DIR / "ntl_participants_forOUC.csv",
+            INTERMEDIATE_DIR / "ntl_withsafetypad.pkl",
+        ),
+        code=(_module("datafiles"), _module("themes"), _module("utils")),
+    ),
+    Stage(
+        NOTEBOOK_DIR / "300_merge_and_clean" / "011_merge_AMR.ipynb",
+        step="3",
+        inputs=(
+            INTERMEDIATE_DIR / "ntl_withsafetypad.pkl",
+            PRIVATE_DATA_DIR / "amr_df.xlsx",
+            PRIVATE_DATA_DIR / "dc_fems_medicaidids.xlsx",
+        ),
+        outputs=(
+            INTERMEDIATE_DIR / "medicaid_ids.csv",
+            INTERMEDIATE_DIR / "ntl_withsafetypad_withamr.pkl",
+        ),
+        code=(_module("datafiles"),),
+    ),
+    Stage(
+        NOTEBOOK_DIR / "300_merge_and_clean" / "020_createidentifiers.ipynb",
+        step="3",
+        inputs=(
+            INTERMEDIATE_DIR / "ntl_withsafetypad_withamr.pkl",
+            PRIVATE_DATA_DIR / "dem_fromsafetyPAD_20191115.csv",
+            PRIVATE_DATA_DIR / "dem_fromsafetyPAD.csv",
+        ),
+        outputs=(
+            INTERMEDIATE_DIR / "df_forambulanceuse.csv",
+            INTERMEDIATE_DIR / "df_forfuzzy.csv",
+            INTERMEDIATE_DIR / "data_withmatches_amrupdates.csv",
+            INTERMEDIATE_DIR / "df_forrepeatcalls.csv",
+            INTERMEDIATE_DIR / "repeatcalls_bykey.csv",
+            EXTERNAL_DIR / "identifiers_fordhcr.csv",
+            EXTERNAL_DIR / "df_fordhcr_DOBsadded.csv",
+            MostRecent("identity_index"),
+        ),
+        code=(
+            _module("datafiles"),
+            _module("dates"),
+            _module("df_verbs"),
+            _module("linkage"),
+            _module("repeatcalls"),
+            _module("store"),
+            _module("utils"),
+        ),
+    ),
+    Stage(
+        R_ANALYSIS_DIR / "030_ambulance_analysis.Rmd",
+        step="4",
+        inputs=(INTERMEDIATE_DIR / "df_forambulanceuse.csv",),
+        outputs=(
+            INTERMEDIATE_DIR / "callresponse_forposttx.csv",
+            FIGURE_DIR,
+            TABLES_DIR,
+        ),
+        code=R_HELPERS + (R_DIR / "000_rmd_setup.R",),
+    ),
+    Stage(
+        NOTEBOOK_DIR / "400_analysis" / "050_medicaid_sample_characteristics.ipynb",
+        step="4",
+        inputs=(
+            PRIVATE_DATA_DIR / "Member_Matches_wDHCF.xlsx",
+            PRIVATE_DATA_DIR / "MedicareEnrollmentForNTLMembersList.csv",
+            INTERMEDIATE_DIR / "df_fordhcr_DOBsadded.csv",
+            INTERMEDIATE_DIR / "callresponse_forposttx.csv",
+            INTERMEDIATE_DIR / "df_forrepeatcalls.csv",
+            INTERMEDIATE_DIR / "medicaid_multiplentl_RAreview_MR.xlsx",
+            INTERMEDIATE_DIR / "medicaid_multiplentl_RAreview_JG.xlsx",
+            INTERMEDIATE_DIR / "ntlbene_mult_reviewed_by_kevin.csv",
+        ),
+        outputs=(
+            INTERMEDIATE_DIR / "medicaid_multiplentl.xlsx",
+            INTERMEDIATE_DIR / "ntlbene_mult_toreview.csv",
+            MostRecent("ntl_withmedicaidIDS"),
+        ),
+        code=(
+            _module("datafiles"),
+            _module("df_verbs"),
+            _module("inventory"),
+            _module("readers"),
+            _module("store"),
+            _module("utils"),
+        ),
+    ),
+    # Only defines the functions 061 and 062 use
+    Stage(R_ANALYSIS_DIR / "060_clean_ntl_data.R", step="4", code=R_HELPERS),
+    Stage(
+        R_ANALYSIS_DIR / "061_subset_medclaims_outcomeswindow.R",
+        step="4",
+        inputs=(
+            PRIVATE_DATA_DIR / "claimsdata_2018031920190301.csv",
+            PRIVATE_DATA_DIR / "ClaimsDataWithAdditionalFields20170901_To_20190930.csv",
+            PRIVATE_DATA_DIR / "MedicaidEnrollmentForNTLMembersList.xlsx",
+            MostRecent("ntl_withmedicaidIDS"),
+        ),
+        outputs=(
+            MostRecent("Medicaid_analytic_peoplewclaims"),
+            MostRecent("Medicaid_analytic_precallclaims"),
+            MostRecent("Medicaid_staticattributes"),
+            MostRecent("all_analytic_firstcall"),
+            FIGURE_DIR,
+        ),
+        code=R_HELPERS + (R_ANALYSIS_DIR / "060_clean_ntl_data.R",),
+    ),
+    Stage(
+        R_ANALYSIS_DIR / "062_identifiers_diagnostic.R",
+        step="4",
+        inputs=(
+            MostRecent("ntl_withmedicaidIDS"),
+            MostRecent("Medicaid_staticattributes"),
+        ),
+        outputs=(TABLES_DIR,),
+        code=R_HELPERS + (R_ANALYSIS_DIR / "060_clean_ntl_data.R",),
+    ),
+    Stage(
+        NOTEBOOK_DIR / "400_analysis" / "070_medicaid_constructoutcomes.ipynb",
+        step="4",
+        inputs=(
+            MostRecent("Medicaid_analytic_peoplewclaims"),
+            MostRecent("ntl_withmedicaidIDS"),
+            MostRecent("all_analytic_firstcall"),
+            MostRecent("Medicaid_analytic_precallclaims"),
+            MostRecent("Medicaid_staticattributes"),
+            NYU_ED_FILE,
+        ),
+        outputs=(
+            INTERMEDIATE_DIR / "ptlevel_beneficonly.csv",
+            INTERMEDIATE_DIR / "ptlevel_forrobust.csv",
+        ),
+        code=(
+            _module("datafiles"),
+            _module("df_verbs"),
+            _module("edvisits"),
+            _module("readers"),
+            _module("store"),
+            _module("utils"),
+        ),
+    ),
+    Stage(
+        R_ANALYSIS_DIR / "080_medicaid_analysis.R",
+        step="4",
+        inputs=(
+            INTERMEDIATE_DIR / "ptlevel_beneficonly.csv",
+            INTERMEDIATE_DIR / "ptlevel_forrobust.csv",
+        ),
+        outputs=(FIGURE_DIR, TABLES_DIR),
+        code=R_HELPERS,
+    ),
+    # Reads a hand-downloaded copy of the final data, so only the script is tracked
+    Stage(R_ANALYSIS_DIR / "090-reconcile_safety_counts.R", step="4"),
+)
+
+
+def relative_path(path: Path) -> str:
+    """ `path` relative to the repository (as posix), or as is if it is outside it """
+    try:
+        return path.relative_to(BASE_DIR).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def get_stage(path: Path) -> Optional[Stage]:
+    """ Find the stage in `STAGES` for a file, or None if it is not in the manifest """
+    name = relative_path(Path(path).absolute())
+    for stage in STAGES:
+        if stage.name == name:
+            return stage
+    return None
+
+
+def resolve(spec: FileSpec) -> List[Path]:
+    """
+    The files a FileSpec currently refers to. Globs may match several files;
+    missing files and versioned files with no versions yet resolve to nothing.
+    """
+    if isinstance(spec, MostRecent):
+        try:
+            return [get_mostrec(spec.prefix, base_dir=spec.base_dir)]
+        except ValueError:
+            return []
+    if any(char in str(spec) for char in "*?["):
+        return sorted(spec.parent.glob(spec.name))
+    return [spec] if spec.exists() else []
+
+
+def _spec_pattern(spec: FileSpec) -> str:
+    return spec.pattern if isinstance(spec, MostRecent) else str(spec)
+
+
+def specs_overlap(left: FileSpec, right: FileSpec) -> bool:
+    """Whether two FileSpecs (e.g., one stage's output and another's input) can
+    refer to the same file"""
+    left_pattern, right_pattern = _spec_pattern(left), _spec_pattern(right)
+    return (
+        left_pattern == right_pattern
+        or fnmatch.fnmatchcase(left_pattern, right_pattern)
+        or fnmatch.fnmatchcase(right_pattern, left_pattern)
+    )
+
+
+def _any_overlap(left: Iterable[FileSpec], right: Iterable[FileSpec]) -> bool:
+    right = list(right)
+    return any(specs_overlap(spec, other) for spec in left for other in right)
+
+
+def stage_dependencies(stages: Sequence[Optional[Stage]]) -> List[Set[int]]:
+    """
+    Work out which stages have to wait for which. A stage waits for every earlier
+    stage that writes something it reads, and for every earlier stage that reads
+    something it writes. `None` stands for a file missing from the manifest, which
+    we know nothing about, so it waits for every earlier stage and every later
+    stage waits for it.
+
+    Args:
+        stages: The stages in the order they would be run one at a time
+
+    Returns:
+        For each stage, the indices of the earlier stages it depends on
+    """
+    dependencies: List[Set[int]] = []
+    for index, stage in enumerate(stages):
+        this_dependencies = set()
+        for earlier_index, earlier in enumerate(stages[:index]):
+            if (
+                stage is None
+                or earlier is None
+                or _any_overlap(stage.inputs, earlier.outputs)
+                or _any_overlap(stage.outputs, earlier.inputs)
+            ):
+                this_dependencies.add(earlier_index)
+        dependencies.append(this_dependencies)
+    return dependencies
+
+
+def source_sha(path: Path) -> str:
+    """
+    The sha256 of a stage's source. For notebooks only the cell sources count, so
+    that saving a notebook with fresh outputs or metadata does not force a rerun.
+    """
+    if path.suffix != ".ipynb":
+        return compute_sha(path)
+
+    with open(path, "rt") as infile:
+        notebook = json.load(infile)
+    sha = hashlib.sha256()
+    for cell in notebook.get("cells", []):
+        sha.update(cell["cell_type"].encode())
+        sha.update(b"\0")
+        sha.update("".join(cell["source"]).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def fingerprint(stage: Stage) -> str:
+    """
+    A sha256 over the stage's source, the code it depends on and the contents of
+    every input it declares. Missing files are part of the fingerprint too, so a
+    stage reruns when an input appears (or disappears).
+    """
+    sha = hashlib.sha256()
+
+    def _update(*parts: str):
+        sha.update("\t".join(parts).encode())
+        sha.update(b"\n")
+
+    _update("source", stage.name, source_sha(stage.path))
+    for path in stage.code:
+        _update("code", relative_path(path), compute_sha(path) if path.exists() else "")
+    for spec in stage.inputs:
+        paths = resolve(spec)
+        if not paths:
+            _update("input", relative_path(Path(_spec_pattern(spec))), "<missing>")
+        for path in paths:
+            # Versioned files get a new name every run, so only their contents count
+            name = spec.pattern if isinstance(spec, MostRecent) else relative_path(path)
+            _update("input", name, compute_sha(path))
+    return sha.hexdigest()
+
+
+def outputs_exist(stage: Stage) -> bool:
+    """ Whether every output the stage declares (and its executed copy) exists """
+    specs: Iterable[FileSpec] = stage.outputs
+    if stage.executed_path:
+        specs = list(specs) + [stage.executed_path]
+    return all(resolve(spec) for spec in specs)
+
+
+class RunLedger:
+    """
+    The record of the last successful run of each stage, kept as a YAML file
+    mapping each stage's name to its fingerprint and when it finished.
+    """
+
+    def __init__(self, path: Path = LEDGER_FILE):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict[str, str]] = {}
+        if self.path.exists():
+            with open(self.path, "rt") as infile:
+                self.entries = (yaml.safe_load(infile) or {}).get("stages", {})
+
+    def is_current(self, stage: Stage, stage_fingerprint: str) -> bool:
+        """ Whether `stage` last ran with these inputs and its outputs are intact """
+        entry = self.entries.get(stage.name)
+        return (
+            entry is not None
+            and entry.get("fingerprint") == stage_fingerprint
+            and outputs_exist(stage)
+        )
+
+    def record(self, stage: Stage, stage_fingerprint: str):
+        """ Record a successful run of `stage` and save the ledger """
+        self.entries[stage.name] = {
+            "fingerprint": stage_fingerprint,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+        }
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with open(self.path, "wt") as outfile:
+            yaml.safe_dump({"stages": self.entries}, outfile)
@@ -0,0 +1,148 @@
+"""
+A typed, columnar store for the intermediate objects passed between stages.
+
+Each object is a Parquet file in `data/intermediate_objects`, so its schema
+(including categoricals and datetimes) survives the round trip, and readers can
+load only the columns and row groups they need. R can read the same files with
+`read_store` in `src/R/000_constants.R` (or `arrow::read_parquet`).
+
+Names may be versioned: `write(name, df, versioned=True)` adds a timestamp to the
+file name and `read(name)` then picks the most recent version, as `get_mostrec`
+does for our CSVs. Only names of exactly that form count as versions.
+"""
+import glob
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .datafiles import INTERMEDIATE_DIR
+
+SUFFIX = ".parquet"
+TIMESTAMP_FORMAT = "%Y-%m-%d-%H-%M-%S"
+ROW_GROUP_SIZE = 100_000
+
+# pyarrow filters, e.g., [("call_date", ">=", "2018-03-19"), ("in_medicaid", "==", 1)]
+# A list of lists of these is an OR of ANDs
+Filter = Tuple[str, str, Any]
+Filters = Union[List[Filter], List[List[Filter]]]
+
+
+def _versions(name: str, base_dir: Union[str, Path]) -> List[Tuple[datetime, Path]]:
+    """
+    The versions of `name` in base_dir, oldest first. Only files named exactly
+    "{name}_<TIMESTAMP_FORMAT>.parquet" are versions, so another object whose name
+    merely starts with "{name}_" (e.g., "{name}_backup") is never taken for one.
+    """
+    prefix = f"{name}_"
+    versions = []
+    for path in Path(base_dir).glob(f"{glob.escape(prefix)}*{SUFFIX}"):
+        stamp = path.name[len(prefix) : -len(SUFFIX)]
+        try:
+            written = datetime.strptime(stamp, TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+        # strptime also accepts unpadded fields, which `write` never produces
+        if written.strftime(TIMESTAMP_FORMAT) == stamp:
+            versions.append((written, path))
+    return sorted(versions)
+
+
+def path_for(name: str, base_dir: Union[str, Path] = INTERMEDIATE_DIR) -> Path:
+    """
+    Find the file backing `name`: either "{name}.parquet" or, if that does not exist,
+    the most recent "{name}_<timestamp>.parquet"
+
+    Raises:
+        ValueError: If there is no object called `name` in base_dir
+    """
+    exact = Path(base_dir) / f"{name}{SUFFIX}"
+    if exact.exists():
+        return exact.absolute()
+    versions = _versions(name, base_dir)
+    if not versions:
+        raise ValueError(f"No stored object called {name} in {base_dir}")
+    return versions[-1][1].absolute()
+
+
+def write(
+    name: str,
+    df: pd.DataFrame,
+    versioned: bool = False,
+    base_dir: Union[str, Path] = INTERMEDIATE_DIR,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> Path:
+    """
+    Store a DataFrame. The file is written under a temporary name and then moved
+    into place, so readers never see a half-written object.
+
+    Object columns must hold a single type (plus missing values); convert mixed
+    columns, e.g., IDs that are sometimes ints, with `.astype(str)` first.
+
+    Arguments:
+        name: The name of the object
+        df: The data to store
+        versioned: If True, add a timestamp to the name rather than overwriting
+        base_dir: Where to store the object
+        row_group_size: The number of rows per row group. Readers filtering on
+            a column skip row groups whose min/max rule them out, so this works
+            best when the data is sorted by the columns usually filtered on
+
+    Returns:
+        The path the object was written to
+    """
+    base_dir = Path(base_dir)
+    base_dir.mkdir(exist_ok=True, parents=True)
+    if versioned:
+        name = f"{name}_{datetime.now().strftime(TIMESTAMP_FORMAT)}"
+    path = base_dir / f"{name}{SUFFIX}"
+    tmp_path = base_dir / f".{name}{SUFFIX}.tmp"
+
+    table = pa.Table.from_pandas(df)
+    # Microsecond timestamps are the most widely readable, including by older
+    # versions of R's arrow package
+    pq.write_table(
+        table,
+        tmp_path,
+        row_group_size=row_group_size,
+        coerce_timestamps="us",
+        allow_truncated_timestamps=True,
+    )
+    os.replace(tmp_path, path)
+    return path.absolute()
+
+
+def read(
+    name: str,
+    columns: Optional[Sequence[str]] = None,
+    filters: Optional[Filters] = None,
+    base_dir: Union[str, Path] = INTERMEDIATE_DIR,
+) -> pd.DataFrame:
+    """
+    Read a stored DataFrame, with the dtypes it was written with.
+
+    Arguments:
+        name: The name of the object. Versioned objects are read at their most
+            recent version
+        columns: If passed, only read these columns
+        filters: If passed, only return rows matching these pyarrow filters.
+            Whole row groups are skipped when their statistics rule them out.
+            As in SQL, missing values never match a comparison
+        base_dir: Where the object is stored
+
+    Returns:
+        The stored data
+
+    Raises:
+        ValueError: If there is no object called `name` in base_dir
+    """
+    table = pq.read_table(
+        path_for(name, base_dir=base_dir),
+        columns=list(columns) if columns is not None else None,
+        filters=filters,
+    )
+    return table.to_pandas()
@@ -0,0 +1,809 @@
+"""
+Synthetic stand-ins for the private inputs listed in `data/inventory.yml`, so that the
+pipeline can be run, load-tested and benchmarked outside the secure environment.
+
+`synthesize` writes a `data/` tree with the file names and columns the stages read
+from the CAD, SafetyPAD, AMR and DHCF extracts, and the mess they have to cope with:
+caller names with a DOB typed into them, junk phone numbers (`clrnum`), DOBs in
+several formats, several lines per claim (`ClaimTCNText`) and Medicaid enrollment
+spells that end on 9999-12-31. Nothing in it is real. The hand-coded review files
+that 050 reads are not synthesized, since they record decisions about the real data.
+
+Everything is drawn with numpy from one seed, so the same `scale` and `seed` give the
+same files. The claims, which dominate at scale, are drawn a chunk of members at a
+time and streamed to disk with Arrow's CSV writer, so memory stays flat however many
+rows are written.
+"""
+import shutil
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv
+
+from .datafiles import PUBLIC_DATA_DIR
+
+DEFAULT_SEED = 20180319
+
+# The CAD pull starts on the first day of the study and runs a little past its end
+CALLS_START = pd.Timestamp("2018-04-19 09:00")
+CALLS_END = pd.Timestamp("2019-03-08")
+CLAIMS_START = pd.Timestamp("2017-09-01")
+CLAIMS_END = pd.Timestamp("2019-09-30")
+OPEN_END_DATE = datetime(9999, 12, 31)
+
+# The SAS datetime format of the claims extract, e.g., "19MAR2018:00:00:00"
+SAS_DATETIME_FORMAT = "%d%b%Y:%H:%M:%S"
+CAD_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+SAFETYPAD_TIMESTAMP_FORMAT = "%m/%d/%Y %H:%M"
+
+NUM_SAFETYPAD_BATCHES = 6
+
+FIRST_NAMES = (
+    "JAMES JOHN ROBERT MICHAEL WILLIAM DAVID RICHARD JOSEPH THOMAS CHARLES DARNELL "
+    "ANDRE MARCUS KEVIN TYRONE LUIS CARLOS MARY PATRICIA JENNIFER LINDA ELIZABETH "
+    "BARBARA SUSAN JESSICA SARAH KAREN NICOLE KEISHA TANYA MARIA ROSA LATOYA DENISE"
+).split()
+LAST_NAMES = (
+    "SMITH JOHNSON WILLIAMS BROWN JONES GARCIA MILLER DAVIS RODRIGUEZ MARTINEZ "
+    "HERNANDEZ LOPEZ WILSON ANDERSON THOMAS TAYLOR MOORE JACKSON MARTIN LEE THOMPSON "
+    "WHITE HARRIS CLARK LEWIS ROBINSON WALKER YOUNG ALLEN KING WRIGHT SCOTT GREEN "
+    "BAKER ADAMS NELSON HILL CAMPBELL MITCHELL ONEIL O'NEIL MCDONALD"
+).split()
+STREETS = (
+    "MARTIN LUTHER KING JR AVE SE|BENNING RD NE|GEORGIA AVE NW|PENNSYLVANIA AVE SE|"
+    "RHODE ISLAND AVE NE|14TH ST NW|H ST NE|MINNESOTA AVE NE|ALABAMA AVE SE|"
+    "SOUTHERN AVE SE|NEW YORK AVE NE|GOOD HOPE RD SE|FLORIDA AVE NW|U ST NW"
+).split("|")
+WARDS = tuple(f"Ward {ward}" for ward in range(1, 9))
+GENDERS = ("Female", "Male")
+RACES = ("Black", "White", "Hispanic", "Asian", "Other", "Unknown")
+
+# Event statuses of the Tableau extract, and how often each occurs
+EVENT_STATUSES = {
+    "NTL Handled - RSC": 0.18,
+    "NTL Handled - Clinical Referral": 0.12,
+    "NTL Handled - Canceled": 0.04,
+    "NTL - Other": 0.03,
+    "Field Requested NTL - BLS": 0.03,
+    "Transfer from NTL - BLS": 0.07,
+    "Study Reject": 0.38,
+    "Request outside the hours of operation": 0.12,
+    "SERVICE NOT AVAILABLE": 0.01,
+    "Caller Canceled": 0.02,
+}
+STUDY_STATUSES = tuple(
+    status
+    for status in EVENT_STATUSES
+    if status not in ("Request outside the hours of operation", "Caller Canceled")
+)
+AMR_STATUSES = ("NTL Handled - RSC", "NTL Handled - Clinical Referral", "NTL - Other")
+
+# Junk the CAD call-taker typed instead of a phone number
+JUNK_PHONE_NUMBERS = ("1111111111", "NOPHONE", "TESTCALL", "RADIO", "11111111111111")
+# Words AMR call-takers typed into the first name field
+NAME_NOISE = ("CALLER", "MEDICAID", "UNK", "DOB", "MEDICARE", "NO INSURANCE")
+
+# ED visit (045X, 0981), clinic, pharmacy and room and board revenue codes
+REVENUE_CODES = ("0450", "0451", "0456", "0459", "0981", "0510", "0250", "0300", "0120")
+PROCEDURE_CODES = (
+    "99281",
+    "99282",
+    "99283",
+    "99284",
+    "99285",
+    "99213",
+    "99214",
+    "T1015",
+)
+DIAGNOSIS_CODES = (
+    "R51",
+    "R07.9",
+    "J45.20",
+    "J06.9",
+    "S01.00XA",
+    "N39.0",
+    "M54.5",
+    "K52.9",
+    "R10.9",
+    "I10",
+    "Z00.00",
+    "E11.9",
+)
+CLAIM_TYPES = (
+    "Outpatient",
+    "Inpatient",
+    "Professional",
+    "Pharmacy",
+    "Capitation (MC)",
+)
+SPECIALTY_CODES = ("008", "011", "038", "050", "070", "093")
+PROVIDER_TYPE_CODES = ("001", "010", "020", "045", "050")
+ENROLLMENT_PLANS = ("Managed Care", "Fee for Service", "Alliance")
+
+
+class SynthSizes(NamedTuple):
+    """
+    How much to synthesize at a scale of 1, which is roughly the size of the study:
+        * num_people: the people who called the NTL
+        * calls_per_person: the mean number of CAD events per person
+        * medicaid_share: the share of people enrolled in Medicaid
+        * claim_lines_per_member: the mean number of claim lines per member
+        * lines_per_claim: the mean number of lines per claim
+    """
+
+    num_people: int = 6_000
+    calls_per_person: float = 1.5
+    medicaid_share: float = 0.7
+    claim_lines_per_member: float = 250.0
+    lines_per_claim: float = 3.0
+
+
+def _choice(
+    rng: np.random.Generator, values: Sequence, size: int, p: Optional[Sequence] = None
+) -> np.ndarray:
+    """ Draw from `values`, keeping strings as objects rather than fixed-width """
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=size, p=p)]
+
+
+def _random_times(
+    rng: np.random.Generator, start: pd.Timestamp, end: pd.Timestamp, size: int
+) -> pd.Series:
+    seconds = rng.integers(0, int((end - start).total_seconds()), size=size)
+    return pd.Series(start + pd.to_timedelta(seconds, unit="s"))
+
+
+def _draw_people(num_people: int, medicaid_share: float, rng: np.random.Generator):
+    """ The people behind the calls, with the true values of their identifiers """
+    dob = pd.Timestamp("1930-01-01") + pd.to_timedelta(
+        rng.integers(0, 365 * 85, size=num_people), unit="D"
+    )
+    house_numbers = pd.Series(rng.integers(1, 5000, size=num_people)).astype(str)
+    is_member = rng.random(num_people) < medicaid_share
+    member_ids = pd.Series(
+        rng.choice(10 ** 8, size=num_people, replace=False) + 10 ** 8
+    ).astype(str)
+    return pd.DataFrame(
+        {
+            "first_name": _choice(rng, FIRST_NAMES, num_people),
+            "last_name": _choice(rng, LAST_NAMES, num_people),
+            "dob": dob,
+            "phone": rng.integers(2_022_000_000, 2_029_999_999, size=num_people),
+            "address": house_numbers + " " + _choice(rng, STREETS, num_people),
+            "zip_code": rng.integers(20001, 20038, size=num_people),
+            "medicaid_id": member_ids.where(is_member),
+            "gender": _choice(rng, GENDERS, num_people),
+            "race": _choice(rng, RACES, num_people),
+            "ward": _choice(rng, WARDS, num_people),
+        }
+    )
+
+
+def _draw_calls(people: pd.DataFrame, num_calls: int, rng: np.random.Generator):
+    """ CAD events. A few people call very often, as frequent callers do """
+    weights = 1 / np.arange(1, len(people) + 1) ** 0.6
+    person = rng.choice(len(people), size=num_calls, p=weights / weights.sum())
+    times = _random_times(rng, CALLS_START, CALLS_END, num_calls).sort_values()
+    times = times.reset_index(drop=True)
+    # Event numbers count up within each day, e.g., F18041900012
+    serial = times.groupby(times.dt.normalize()).cumcount() + 1
+    num_1 = "F" + times.dt.strftime("%y%m%d") + serial.map("{:05d}".format)
+    statuses = list(EVENT_STATUSES)
+    return pd.DataFrame(
+        {
+            "person": person,
+            "num_1": num_1,
+            "time": times,
+            "event_status": _choice(
+                rng, statuses, num_calls, p=list(EVENT_STATUSES.values())
+            ),
+        }
+    )
+
+
+def _format_dates(
+    dates: pd.Series, formats: Sequence[str], rng: np.random.Generator
+) -> pd.Series:
+    """ Format each date in one of `formats`, chosen at random """
+    which = rng.integers(0, len(formats), size=len(dates))
+    formatted = pd.Series(None, index=dates.index, dtype=object)
+    for index, date_format in enumerate(formats):
+        is_format = which == index
+        formatted[is_format] = dates[is_format].dt.strftime(date_format)
+    return formatted.where(dates.notnull())
+
+
+def _messy_phones(phones: pd.Series, rng: np.random.Generator) -> pd.Series:
+    digits = phones.astype(str)
+    styles = rng.choice(5, size=len(phones), p=[0.5, 0.2, 0.1, 0.1, 0.1])
+    dashed = digits.str[:3] + "-" + digits.str[3:6] + "-" + digits.str[6:]
+    messy = digits.where(styles != 1, dashed)
+    messy = messy.where(styles != 2, digits.str[:3] + " " + digits.str[3:])
+    messy = messy.where(styles != 3, "1" + digits)
+    junk = pd.Series(_choice(rng, JUNK_PHONE_NUMBERS, len(phones)), index=phones.index)
+    return messy.where(styles != 4, junk)
+
+
+def _cad_caller_names(
+    first: pd.Series, last: pd.Series, dob: pd.Series, rng: np.random.Generator
+) -> pd.Series:
+    """ "LAST, FIRST", sometimes with the DOB typed in, or nothing useful at all """
+    names = last + ", " + first
+    styles = rng.choice(4, size=len(names), p=[0.6, 0.15, 0.15, 0.1])
+    with_dob = first + " " + last + " DOB " + _format_dates(dob, ["%-m/%-d/%y"], rng)
+    names = names.where(styles != 1, with_dob)
+    names = names.where(styles != 2, first.str.title() + " " + last.str.title())
+    return names.where(styles != 3, _choice(rng, ("CALLER", "UNK", None), len(names)))
+
+
+def _cad_extract(
+    calls: pd.DataFrame, people: pd.DataFrame, rng: np.random.Generator
+) -> pd.DataFrame:
+    """ The CAD query of 010 (`ntl_summary_raw.pkl`) """
+    num_calls = len(calls)
+    caller = people.iloc[calls.person].reset_index(drop=True)
+
+    def _cad_time(minutes_after: int) -> pd.Series:
+        offsets = pd.to_timedelta(rng.integers(1, minutes_after, num_calls), unit="m")
+        return (calls.time + offsets).dt.strftime(CAD_TIMESTAMP_FORMAT) + "ED"
+
+    is_missing = rng.random(num_calls) < 0.05
+    return pd.DataFrame(
+        {
+            "eid": np.arange(num_calls) + 5_000_000,
+            "num_1": calls.num_1,
+            "sdts": calls.time.dt.strftime(CAD_TIMESTAMP_FORMAT) + "ED",
+            "dgroup": "EMS",
+            "tycod": _choice(rng, ("NTL", "NTLT", "SICK"), num_calls),
+            "typ_eng": "NURSE TRIAGE LINE",
+            "XDTS": _cad_time(180),
+            "ecbd_id": rng.integers(100, 999, size=num_calls),
+            "status_code": "C",
+            "ae_xcmt": _choice(rng, ("NTL", None, "PT REFUSED"), num_calls),
+            "ssec": rng.integers(1, 60, size=num_calls),
+            "ad_sec": rng.integers(1, 60, size=num_calls),
+            "cdts": _cad_time(10),
+            "ds_ts": _cad_time(60).where(~is_missing),
+            "edirpre": None,
+            "estnum": caller.address.str.split(" ").str[0],
+            "efeanme": caller.address.str.split(" ", n=1).str[1],
+            "eapt": _choice(rng, (None, None, "APT 2", "#101", "B"), num_calls),
+            "efeatyp": None,
+            "edirsuf": None,
+            "loc_com": None,
+            "ecompl": None,
+            "ntl_num_1": calls.num_1,
+            "external_event_id": pd.Series(rng.integers(10 ** 6, 10 ** 7, num_calls))
+            .astype(str)
+            .where(~is_missing),
+            "dispo": _choice(rng, ("NTLH", "NTLT", "NTLR", "NTLC"), num_calls),
+            "ntl_xcmt": None,
+            "comm": None,
+            "clname": _cad_caller_names(
+                caller.first_name, caller.last_name, caller.dob, rng
+            ),
+            "clrnum": _messy_phones(caller.phone, rng),
+            # Some with the city, some with a doubled space
+            "cstr_add": caller.address.where(
+                rng.random(num_calls) < 0.7, caller.address + ", WASHINGTON DC"
+            ).str.replace(" ", "  ", n=1),
+        }
+    )
+
+
+def _tableau_extract(calls: pd.DataFrame) -> pd.DataFrame:
+    """ The disposition codes sent by OUC (`ntl_data_tableau.csv`) """
+    return pd.DataFrame(
+        {
+            "Agency Event": calls.num_1,
+            "Reported Event Status": calls.event_status,
+            "Event Status": calls.event_status,
+            "NTL ID": np.arange(len(calls)) + 1,
+        }
+    )
+
+
+def _typo(names: pd.Series, rng: np.random.Generator, share: float) -> pd.Series:
+    """ Swap two letters of a share of the names, as typing does """
+    is_typo = (rng.random(len(names)) < share) & (names.str.len() > 3).values
+    swapped = names.str[:1] + names.str[2] + names.str[1] + names.str[3:]
+    return names.where(~is_typo, swapped)
+
+
+def _safetypad_extract(
+    calls: pd.DataFrame, people: pd.DataFrame, rng: np.random.Generator
+) -> pd.DataFrame:
+    """
+    The SafetyPAD incident search: most incidents, with a row per patient contact
+    and some with none of the unit times
+    """
+    is_found = rng.random(len(calls)) < 0.8
+    found = calls[is_found]
+    rows = found.loc[found.index.repeat(rng.integers(1, 3, size=len(found)))]
+    caller = people.iloc[rows.person].reset_index(drop=True)
+    rows = rows.reset_index(drop=True)
+
+    times = {}
+    elapsed = pd.Series(pd.Timedelta(0), index=rows.index)
+    for column in ("En Route", "At Scene", "At Patient", "Depart Scene"):
+        elapsed = elapsed + pd.to_timedelta(rng.integers(1, 20, len(rows)), unit="m")
+        times[column] = rows.time + elapsed
+    times["At Destination"] = times["Depart Scene"] + pd.Timedelta(minutes=15)
+    times["In Service"] = times["At Destination"] + pd.Timedelta(minutes=30)
+    no_response = rng.random(len(rows)) < 0.3
+
+    first_names = _typo(caller.first_name, rng, 0.05)
+    zip_codes = caller.zip_code.astype(object)
+    plus_four = rng.random(len(rows)) < 0.2
+    zip_codes[plus_four] = caller.zip_code[plus_four].astype(str) + "-0001"
+    return pd.DataFrame(
+        {
+            "Incident Number": rows.num_1,
+            "Incident Date": rows.time.dt.strftime("%m/%d/%Y"),
+            "First Name": first_names.where(
+                rng.random(len(rows)) < 0.9, " " + first_names
+            ),
+            "Last Name": _typo(caller.last_name, rng, 0.05),
+            **{
+                column: values.dt.strftime(SAFETYPAD_TIMESTAMP_FORMAT).where(
+                    ~no_response
+                )
+                for column, values in times.items()
+            },
+            "Zip Code": zip_codes,
+            "is_study": rows.event_status.isin(STUDY_STATUSES).values,
+        }
+    )
+
+
+def _safetypad_demographics(
+    calls: pd.DataFrame, people: pd.DataFrame, rng: np.random.Generator
+) -> pd.DataFrame:
+    """ Dates of birth from the SafetyPAD API (`dem_fromsafetyPAD*.csv`) """
+    found = calls[rng.random(len(calls)) < 0.6]
+    person = people.iloc[found.person].reset_index(drop=True)
+    return pd.DataFrame(
+        {
+            "fems_id": found.num_1.values,
+            "first_name": person.first_name,
+            "last_name": person.last_name,
+            "gender": person.gender,
+            "date_of_birth": _format_dates(
+                person.dob, ["%Y-%m-%d", "%Y-%m-%d", "%m/%d/%Y"], rng
+            ),
+        }
+    )
+
+
+def _amr_first_names(
+    first: pd.Series, dob: pd.Series, rng: np.random.Generator
+) -> pd.Series:
+    """ AMR's first names, often with a DOB or some other note typed in """
+    styles = rng.choice(4, size=len(first), p=[0.55, 0.25, 0.1, 0.1])
+    dobs = _format_dates(dob, ["%m/%d/%Y", "%-m/%-d/%y", "%m%d%Y"], rng)
+    noise = pd.Series(_choice(rng, NAME_NOISE, len(first)), index=first.index)
+    names = first.where(styles != 1, first + " " + dobs)
+    names = names.where(styles != 2, noise + " " + first)
+    return names.where(styles != 3, first.str.lower())
+
+
+def _amr_extract(
+    calls: pd.DataFrame, people: pd.DataFrame, rng: np.random.Generator
+) -> pd.DataFrame:
+    """ The runs AMR found (`amr_df.xlsx`), mostly the ones 010 asked about """
+    asked = calls.event_status.isin(AMR_STATUSES).values
+    found = calls[rng.random(len(calls)) < np.where(asked, 0.7, 0.05)]
+    person = people.iloc[found.person].reset_index(drop=True)
+    num_rows = len(found)
+
+    # A mix of real dates, strings in a few formats and nothing
+    dob_styles = rng.choice(3, size=num_rows, p=[0.5, 0.3, 0.2])
+    dobs = person.dob.dt.to_pydatetime().astype(object)
+    as_text = _format_dates(person.dob, ["%m/%d/%Y", "%Y-%m-%d", "%m-%d-%y"], rng)
+    dobs[dob_styles == 1] = as_text.values[dob_styles == 1]
+    dobs[dob_styles == 2] = None
+
+    phones = _messy_phones(person.phone, rng).astype(object)
+    is_number = phones.str.isdigit().fillna(False).values
+    phones[is_number] = phones[is_number].astype(np.int64)
+    return pd.DataFrame(
+        {
+            "FEMSID": found.num_1.values,
+            "PatientFName": _amr_first_names(person.first_name, person.dob, rng),
+            "PatientLName": person.last_name,
+            "ApplicantsName": person.last_name + ", " + person.first_name,
+            "DateofBirth": dobs,
+            "ApplicantsPhone": phones,
+        }
+    )
+
+
+def _amr_medicaid_ids(
+    amr: pd.DataFrame, people: pd.DataFrame, calls: pd.DataFrame
+) -> pd.DataFrame:
+    """ AMR's list of Medicaid IDs (`dc_fems_medicaidids.xlsx`), by name and DOB """
+    person = people.iloc[
+        calls.set_index("num_1").person.reindex(amr.FEMSID).values
+    ].reset_index(drop=True)
+    return pd.DataFrame(
+        {
+            "FEMSID": amr.FEMSID.values,
+            "PatientFName": person.first_name.str.title(),
+            "PatientLName": person.last_name.str.title(),
+            "DOB": person.dob.dt.strftime("%Y-%m-%d"),
+            "Personal ID Number": person.medicaid_id.fillna("-"),
+        }
+    )
+
+
+def _member_matches(
+    people: pd.DataFrame, calls: pd.DataFrame, rng: np.random.Generator
+) -> pd.DataFrame:
+    """
+    DHCF's matches of the identifiers we sent to Medicaid members
+    (`Member_Matches_wDHCF.xlsx`). Some names match more than one member
+    """
+    callers = people.iloc[np.unique(calls.person)]
+    members = callers[callers.medicaid_id.notnull()].reset_index(drop=True)
+    extra = members.sample(frac=0.05, random_state=rng.integers(2 ** 31))
+    extra = extra.assign(
+        medicaid_id=(extra.medicaid_id.astype(np.int64) + 1).astype(str),
+        dob=extra.dob + pd.Timedelta(days=31),
+    )
+    members = pd.concat([members, extra], ignore_index=True)
+    member_first = _typo(members.first_name, rng, 0.05)
+    return pd.DataFrame(
+        {
+            "firstname_name1": members.first_name,
+            "lastname_name1": members.last_name,
+            "date_of_birth": members.dob.dt.strftime("%Y-%m-%d"),
+            "FirstLastName1": members.first_name + " " + members.last_name,
+            "MedicaidSystemID": members.medicaid_id,
+            "MemberFullName": members.last_name + ", " + member_first,
+            "MemberFirstName": member_first,
+            "MemberLastName": members.last_name,
+            "MemberDateofBirth": members.dob.dt.strftime("%Y-%m-%d"),
+        }
+    )
+
+
+def _medicare_enrollment(
+    members: pd.DataFrame, rng: np.random.Generator
+) -> pd.DataFrame:
+    """ Members also enrolled in Medicare (`MedicareEnrollmentForNTLMembersList.csv`) """
+    duals = members[(members.dob < pd.Timestamp("1953-06-01")).values]
+    duals = duals[rng.random(len(duals)) < 0.8]
+    return pd.DataFrame(
+        {
+            "MedicaidSystemID": duals.medicaid_id.values,
+            "MedicareEnrollmentStartDate": (
+                duals.dob + pd.DateOffset(years=65)
+            ).dt.strftime("%Y-%m-%d"),
+        }
+    )
+
+
+def _enrollment_spells(members: pd.DataFrame, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Medicaid enrollment spells (`MedicaidEnrollmentForNTLMembersList.xlsx`). A
+    member's spells do not overlap, and those still enrolled end on 9999-12-31
+    """
+    num_spells = rng.integers(1, 5, size=len(members))
+    member = np.repeat(np.arange(len(members)), num_spells)
+    starts_at = np.cumsum(num_spells) - num_spells
+    spell_number = np.arange(len(member)) - np.repeat(starts_at, num_spells)
+    is_last = spell_number == np.repeat(num_spells, num_spells) - 1
+
+    # Each spell starts after a gap following the last
+    gaps = rng.integers(1, 400, size=len(member))
+    lengths = rng.integers(30, 900, size=len(member))
+    offsets = np.cumsum(gaps + lengths) - np.repeat(
+        np.cumsum(gaps + lengths)[starts_at] - (gaps + lengths)[starts_at], num_spells
+    )
+    first_start = pd.Timestamp("2012-01-01")
+    starts = first_start + pd.to_timedelta(offsets - lengths, unit="D")
+    ends = pd.Series(first_start + pd.to_timedelta(offsets, unit="D"))
+    ends = ends.dt.to_pydatetime().astype(object)
+    ends[is_last & (rng.random(len(member)) < 0.6)] = OPEN_END_DATE
+    return pd.DataFrame(
+        {
+            "MedicaidSystemID": members.medicaid_id.values[member],
+            "EnrollmentPlanDescription": _choice(rng, ENROLLMENT_PLANS, len(member)),
+            "EnrollmentStartDate": starts,
+            "EnrollmentEndDate": ends,
+        }
+    )
+
+
+def _format_days(start: pd.Timestamp, end: pd.Timestamp) -> np.ndarray:
+    """ Every day from `start` to `end` in the claims' SAS format, to look up """
+    days = pd.date_range(start, end, freq="D")
+    return np.asarray(days.strftime(SAS_DATETIME_FORMAT).str.upper(), dtype=object)
+
+
+def _lookup(
+    values: Sequence, indices: np.ndarray, mask: Optional[np.ndarray] = None
+) -> pa.Array:
+    """ `values[indices]` as an Arrow string array, missing where `mask` is set """
+    return pa.DictionaryArray.from_arrays(
+        pa.array(indices, mask=mask), pa.array(values, type=pa.string())
+    ).dictionary_decode()
+
+
+def _claim_lines(
+    members: pd.DataFrame,
+    first_claim: int,
+    sizes: SynthSizes,
+    rng: np.random.Generator,
+) -> pa.Table:
+    """
+    The claim lines of a chunk of members, numbering claims from `first_claim`.
+    Text columns are built as lookups into their few distinct values, so no
+    Python string is made per line.
+    """
+    claims_per_member = sizes.claim_lines_per_member / sizes.lines_per_claim
+    num_claims = rng.poisson(claims_per_member, size=len(members))
+    claim_member = np.repeat(np.arange(len(members)), num_claims)
+    total_claims = len(claim_member)
+
+    service_days = _format_days(CLAIMS_START, CLAIMS_END)
+    claim_type = rng.choice(len(CLAIM_TYPES), size=total_claims)
+    claim_day = rng.integers(0, len(service_days), size=total_claims)
+    claim_dx = rng.choice(len(DIAGNOSIS_CODES), size=total_claims)
+    header_total = np.round(rng.lognormal(5, 1.2, size=total_claims), 2)
+    is_detail = rng.random(total_claims) < 0.5
+
+    lines_per_claim = rng.geometric(1 / sizes.lines_per_claim, size=total_claims)
+    line_claim = np.repeat(np.arange(total_claims), lines_per_claim)
+    num_lines = len(line_claim)
+    line_starts = np.cumsum(lines_per_claim) - lines_per_claim
+    line_number = np.arange(num_lines) - np.repeat(line_starts, lines_per_claim) + 1
+
+    def _draw(values: Sequence, mask: Optional[np.ndarray] = None) -> pa.Array:
+        return _lookup(values, rng.choice(len(values), size=num_lines), mask)
+
+    # Only institutional claims have revenue codes
+    line_type = claim_type[line_claim]
+    line_member = claim_member[line_claim]
+    member = {
+        column: _lookup(members[column].values, line_member)
+        for column in ("medicaid_id", "full_name", "sas_dob", "gender", "race", "ward")
+    }
+    return pa.table(
+        {
+            "ClaimTCNText": first_claim + line_claim,
+            "DetailLineNumber": line_number,
+            "MedicaidSystemID": member["medicaid_id"],
+            "MemberFullName": member["full_name"],
+            "MemberDateofBirth": member["sas_dob"],
+            "MemberGenderDescription": member["gender"],
+            "MemberRaceDescription": member["race"],
+            "MemberWardName": member["ward"],
+            "ClaimTypeDescription": _lookup(CLAIM_TYPES, line_type),
+            "ClaimProcessLevel": _lookup(
+                ["Header", "Detail"], is_detail[line_claim].astype(np.int64)
+            ),
+            "FirstServiceCalendarDate": _lookup(service_days, claim_day[line_claim]),
+            "PrimaryDiagnosisCode": _lookup(DIAGNOSIS_CODES, claim_dx[line_claim]),
+            "RevenueCode": _draw(REVENUE_CODES, mask=line_type > 1),
+            "ProcedureCode": _draw(PROCEDURE_CODES),
+            "HeaderTotalReimbursement": header_total[line_claim],
+            "DetailReimbursementAmount": np.round(
+                rng.lognormal(3.5, 1.2, size=num_lines), 2
+            ),
+            "DetailRenderingSpecialtyCode": _draw(SPECIALTY_CODES),
+            "BillingProviderTypeCode": _draw(PROVIDER_TYPE_CODES),
+        }
+    )
+
+
+# The columns of the claims extract that only the second pull added; both pulls
+# share the columns that identify a line
+ADDITIONAL_CLAIM_COLUMNS = ("DetailRenderingSpecialtyCode", "BillingProviderTypeCode")
+CLAIM_LINE_KEY = ("ClaimTCNText", "DetailLineNumber", "MedicaidSystemID")
+
+
+def write_claims(
+    members: pd.DataFrame,
+    claims_file: Path,
+    additional_fields_file: Path,
+    sizes: SynthSizes = SynthSizes(),
+    seed: int = DEFAULT_SEED,
+    chunk_size: int = 2_000,
+) -> int:
+    """
+    Draw the claim lines of `members` and stream them to the two claims extracts a
+    chunk of members at a time, so only a chunk is ever in memory.
+
+    Arguments:
+        members: A row per member, with `medicaid_id`, `first_name`, `last_name`,
+            `dob`, `gender`, `race` and `ward`
+        claims_file: Where to write the original extract
+        additional_fields_file: Where to write the extract with the additional
+            fields, which has a row for each line of the original
+        sizes: How many claims, and lines per claim, to draw
+        seed: Each chunk is drawn from this and its position, so the same seed and
+            chunk size give the same lines
+        chunk_size: How many members to draw the claims of at once
+
+    Returns:
+        The number of claim lines written
+    """
+    members = members.assign(
+        full_name=members.last_name + ", " + members.first_name,
+        sas_dob=members.dob.dt.strftime(SAS_DATETIME_FORMAT).str.upper(),
+    ).reset_index(drop=True)
+    first_claim = 10 ** 16
+    num_lines = 0
+    with ExitStack() as stack:
+        writers = {}
+        for chunk_number, start in enumerate(
+            range(0, max(len(members), 1), chunk_size)
+        ):
+            rng = np.random.default_rng([seed, chunk_number])
+            lines = _claim_lines(
+                members.iloc[start : start + chunk_size], first_claim, sizes, rng
+            )
+            tables = {
+                claims_file: lines.drop(list(ADDITIONAL_CLAIM_COLUMNS)),
+                additional_fields_file: lines.select(
+                    list(CLAIM_LINE_KEY + ADDITIONAL_CLAIM_COLUMNS)
+                ),
+            }
+            for path, table in tables.items():
+                if path not in writers:
+                    writers[path] = stack.enter_context(
+                        csv.CSVWriter(str(path), table.schema)
+                    )
+                writers[path].write_table(table)
+            if lines.num_rows:
+                first_claim = lines["ClaimTCNText"][-1].as_py() + 1
+            num_lines += lines.num_rows
+    return num_lines
+
+
+def _write_excel(df: pd.DataFrame, path: Path, title: Optional[str] = None):
+    """
+    Write a sheet, optionally under a title and a blank row as some were sent. The
+    rows are streamed with a write-only workbook, which is several times faster
+    than `to_excel` for the larger scales.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    if title:
+        sheet.append([title])
+        sheet.append([])
+    sheet.append(list(df.columns))
+    for row in df.astype(object).where(df.notnull(), None).itertuples(index=False):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def synthesize(
+    data_dir: Union[str, Path],
+    scale: float = 1.0,
+    seed: int = DEFAULT_SEED,
+    sizes: SynthSizes = SynthSizes(),
+    chunk_size: int = 2_000,
+    public_data_dir: Optional[Path] = PUBLIC_DATA_DIR,
+) -> Dict[str, int]:
+    """
+    Write a synthetic `data/` tree.
+
+    Example::
+        synthesize("synthetic_data", scale=10)  # about 10 million claim lines
+
+    Arguments:
+        data_dir: Where to write the tree
+        scale: How many times the size of the study to make it. Everything (people,
+            calls, members and claims) grows in proportion
+        seed: What to draw from. The same seed and scale give the same files
+        sizes: The size of each input at a scale of 1
+        chunk_size: How many members' claims to draw and write at once
+        public_data_dir: Where to copy the public data from, as it is not
+            private. Pass None to leave `public_data` empty
+
+    Returns:
+        The number of rows written to each file, by its path relative to `data_dir`
+    """
+    data_dir = Path(data_dir)
+    private_dir = data_dir / "private_data"
+    safetypad_dir = private_dir / "safetypad"
+    for directory in (
+        safetypad_dir,
+        data_dir / "intermediate_objects",
+        data_dir / "data_shared_externally",
+        data_dir / "public_data",
+    ):
+        directory.mkdir(parents=True, exist_ok=True)
+
+    if public_data_dir is not None and Path(public_data_dir).exists():
+        for path in Path(public_data_dir).iterdir():
+            shutil.copy(path, data_dir / "public_data" / path.name)
+
+    rng = np.random.default_rng(seed)
+    num_people = max(int(round(sizes.num_people * scale)), 1)
+    people = _draw_people(num_people, sizes.medicaid_share, rng)
+    num_calls = max(int(round(num_people * sizes.calls_per_person)), 1)
+    calls = _draw_calls(people, num_calls, rng)
+    written: Dict[str, int] = {}
+
+    def _record(path: Path, num_rows: int):
+        written[path.relative_to(data_dir).as_posix()] = num_rows
+
+    # CAD
+    cad = _cad_extract(calls, people, rng)
+    cad.to_pickle(private_dir / "ntl_summary_raw.pkl")
+    _record(private_dir / "ntl_summary_raw.pkl", len(cad))
+    tableau = _tableau_extract(calls)
+    tableau.to_csv(private_dir / "ntl_data_tableau.csv", index=False)
+    _record(private_dir / "ntl_data_tableau.csv", len(tableau))
+
+    # SafetyPAD, searched in batches of study participants and once for the rest
+    safetypad = _safetypad_extract(calls, people, rng)
+    is_study = safetypad.pop("is_study").values
+    participants = safetypad[is_study]
+    batch = pd.factorize(participants["Incident Number"])[0] % NUM_SAFETYPAD_BATCHES
+    for number in range(NUM_SAFETYPAD_BATCHES):
+        path = safetypad_dir / f"safetypad_idsearch_batch{number + 1}.csv"
+        participants[batch == number].to_csv(path, index=False)
+        _record(path, int((batch == number).sum()))
+    path = safetypad_dir / "safetypad_idsearch_nonparticipants.csv"
+    safetypad[~is_study].to_csv(path, index=False)
+    _record(path, int((~is_study).sum()))
+
+    demographics = _safetypad_demographics(calls, people, rng)
+    for name, share in [
+        ("dem_fromsafetyPAD_20191115.csv", 1.0),
+        ("dem_fromsafetyPAD.csv", 0.8),
+    ]:
+        subset = demographics[: int(len(demographics) * share)]
+        subset.to_csv(private_dir / name, index=False)
+        _record(private_dir / name, len(subset))
+
+    # AMR
+    amr = _amr_extract(calls, people, rng)
+    _write_excel(amr, private_dir / "amr_df.xlsx")
+    _record(private_dir / "amr_df.xlsx", len(amr))
+    amr_ids = _amr_medicaid_ids(amr, people, calls)
+    _write_excel(
+        amr_ids, private_dir / "dc_fems_medicaidids.xlsx", "DC FEMS Medicaid IDs"
+    )
+    _record(private_dir / "dc_fems_medicaidids.xlsx", len(amr_ids))
+
+    # DHCF
+    matches = _member_matches(people, calls, rng)
+    _write_excel(matches, private_dir / "Member_Matches_wDHCF.xlsx")
+    _record(private_dir / "Member_Matches_wDHCF.xlsx", len(matches))
+
+    members = people[people.medicaid_id.notnull()].reset_index(drop=True)
+    medicare = _medicare_enrollment(members, rng)
+    medicare.to_csv(
+        private_dir / "MedicareEnrollmentForNTLMembersList.csv", index=False
+    )
+    _record(private_dir / "MedicareEnrollmentForNTLMembersList.csv", len(medicare))
+    spells = _enrollment_spells(members, rng)
+    path = private_dir / "MedicaidEnrollmentForNTLMembersList.xlsx"
+    _write_excel(spells, path)
+    _record(path, len(spells))
+
+    claims_file = private_dir / "claimsdata_2018031920190301.csv"
+    num_lines = write_claims(
+        members,
+        claims_file,
+        private_dir / "ClaimsDataWithAdditionalFields20170901_To_20190930.csv",
+        sizes=sizes,
+        seed=seed,
+        chunk_size=chunk_size,
+    )
+    _record(claims_file, num_lines)
+    _record(
+        private_dir / "ClaimsDataWithAdditionalFields20170901_To_20190930.csv",
+        num_lines,
+    )
+    return written
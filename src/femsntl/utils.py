@@ -3,12 +3,28 @@ import re
 import sys
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, List, Optional, Union, cast
+from typing import Callable, Iterable, List, Optional, Union, cast
 
+import numpy as np
 import pandas as pd
 
 from .datafiles import INTERMEDIATE_DIR
 
+NON_WORD_PATTERN = re.compile(r"\W+")
+NON_DOB_PATTERN = re.compile(r"[^0-9/]")
+DOB_PATTERN = re.compile(r"[0-9/]")
+SPACES_PATTERN = re.compile(r" +")
+PHONE_JUNK_PATTERN = re.compile(r"\-|\s+|\.")
+ADDRESS_JUNK_PATTERN = re.compile(r"\.|WASHINGTON$|WASHINGTON DC$")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+SHA_CHUNK_SIZE = 1 << 20
+
+# Values of the CAD phone number field that are not phone numbers
+NON_PHONE_NUMBERS = frozenset(
+    ["1111111111", "NOPHONE", "TESTCALL", "RADIO", "11111111111111"]
+)
+
 
 @contextmanager
 def _open_or_yield(filename: Optional[str] = None, mode: str = "rt"):
@@ -24,14 +40,21 @@ def _open_or_yield(filename: Optional[str] = None, mode: str = "rt"):
             yield open_file
 
 
-def compute_sha(filename: Union[str, Path]) -> str:
+def compute_sha(filename: Union[str, Path], chunk_size: int = SHA_CHUNK_SIZE) -> str:
+    """
+    Compute the sha256 of a file, reading it `chunk_size` bytes at a time into a
+    single reused buffer. hashlib releases the GIL while hashing large chunks, so
+    several files can be hashed at once in threads.
+    """
     sha = hashlib.sha256()
-    with open(filename, "rb") as infile:
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(filename, "rb", buffering=0) as infile:
         while True:
-            chunk = infile.read(8192)
-            if not chunk:
+            num_read = infile.readinto(buffer)
+            if not num_read:
                 break
-            sha.update(chunk)
+            sha.update(view[:num_read])
     return sha.hexdigest()
 
 
@@ -91,7 +114,7 @@ def extract_DOB_fromname(one_name: Optional[str]) -> Optional[str]:
         return None
 
     one_name = cast(str, one_name)  # mypy doesn't recognize pd.isna
-    return re.sub(r"[^0-9/]", "", one_name)
+    return NON_DOB_PATTERN.sub("", one_name)
 
 
 def clean_amr_names(
@@ -114,19 +137,21 @@ def clean_amr_names(
     if pd.isna(one_name):
         return None
 
+    non_names = set(non_names or ())
+
     # Capitalize
     one_name = one_name.upper()
 
     ## then, remove words that aren't names
     one_name = " ".join(
-        [char for char in re.split("\W+", one_name) if char not in non_names]
+        [char for char in NON_WORD_PATTERN.split(one_name) if char not in non_names]
     )
 
     # Remove things that look like birthdates
-    one_name = re.sub(r"[0-9/]", "", one_name)
+    one_name = DOB_PATTERN.sub("", one_name)
 
     # Remove extraneous whitespace
-    one_name = re.sub(r" +", " ", one_name).strip()
+    one_name = SPACES_PATTERN.sub(" ", one_name).strip()
 
     return one_name
 
@@ -174,6 +199,166 @@ def standardize_month(date: Optional[str]) -> Optional[str]:
     return f"{date:0>2s}"
 
 
+def clean_phone_number(number) -> Optional[str]:
+    """
+    Clean a phone number from the CAD data by removing dashes, dots and whitespace.
+    Values that are known not to be phone numbers are treated as missing.
+
+    Arguments:
+        number: The phone number to clean
+
+    Returns:
+        The cleaned phone number (or None if `number` is null-like or junk)
+    """
+    if pd.isna(number):
+        return None
+
+    number = PHONE_JUNK_PATTERN.sub("", str(number))
+    if number in NON_PHONE_NUMBERS:
+        return None
+    return number
+
+
+def clean_address(address) -> str:
+    """
+    Clean an address from the CAD data: upper case it, collapse whitespace and
+    remove periods and a trailing "WASHINGTON" or "WASHINGTON DC"
+
+    Arguments:
+        address: The address to clean
+
+    Returns:
+        The cleaned address (or "" if `address` is null-like)
+    """
+    if pd.isna(address):
+        return ""
+
+    return ADDRESS_JUNK_PATTERN.sub(
+        "", WHITESPACE_PATTERN.sub(" ", str(address).upper())
+    ).rstrip()
+
+
+def _map_unique(
+    values: pd.Series,
+    func: Callable[[pd.Series], Iterable],
+    na_value: Optional[str] = None,
+) -> pd.Series:
+    """
+    Apply `func` to each distinct non-null value of `values` exactly once and
+    broadcast the results back to every row. Null-like rows get `na_value`.
+
+    Arguments:
+        values: The column to transform
+        func: Takes a Series of the distinct values and returns the transformed
+            values in the same order
+        na_value: The value to return for null-like rows
+
+    Returns:
+        A Series of objects with the same index and name as `values`
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    if uniques.dtype == object and pd.api.types.infer_dtype(uniques) != "string":
+        # Mixed columns: 1 and 1.0 hash the same but are different strings
+        typed = values.map(lambda value: (type(value), value)).where(values.notna())
+        codes, typed_uniques = pd.factorize(typed)
+        uniques = [value for _, value in typed_uniques]
+
+    results = np.empty(len(uniques) + 1, dtype=object)
+    results[:-1] = list(func(pd.Series(uniques, dtype=object)))
+    results[-1] = na_value
+    # Null-like values are coded -1, which picks up na_value
+    return pd.Series(results[codes], index=values.index, name=values.name)
+
+
+def extract_DOB_fromname_series(names: pd.Series) -> pd.Series:
+    """
+    The column-wise version of `extract_DOB_fromname`
+    """
+    return _map_unique(
+        names, lambda uniques: uniques.str.replace(NON_DOB_PATTERN, "", regex=True)
+    )
+
+
+def clean_amr_names_series(
+    names: pd.Series, non_names: Optional[Iterable[str]] = None
+) -> pd.Series:
+    """
+    The column-wise version of `clean_amr_names`
+    """
+    non_names = set(non_names or ())
+
+    def clean(uniques: pd.Series) -> pd.Series:
+        tokens = uniques.str.upper().str.split(NON_WORD_PATTERN.pattern)
+        names_only = pd.Series(
+            [
+                " ".join([token for token in name if token not in non_names])
+                for name in tokens
+            ],
+            dtype=object,
+        )
+        return (
+            names_only.str.replace(DOB_PATTERN, "", regex=True)
+            .str.replace(SPACES_PATTERN, " ", regex=True)
+            .str.strip()
+        )
+
+    return _map_unique(names, clean)
+
+
+def standardize_year_series(dates: pd.Series) -> pd.Series:
+    """
+    The column-wise version of `standardize_year`
+    """
+
+    def standardize(uniques: pd.Series) -> np.ndarray:
+        lengths = uniques.str.len()
+        return np.select(
+            [lengths == 2, lengths >= 4], ["19" + uniques, uniques.str[:4]], None
+        )
+
+    return _map_unique(dates, standardize)
+
+
+def standardize_month_series(dates: pd.Series) -> pd.Series:
+    """
+    The column-wise version of `standardize_month`
+    """
+    return _map_unique(
+        dates,
+        lambda uniques: np.where(
+            uniques.str.len() <= 2, uniques.str.pad(2, fillchar="0"), None
+        ),
+    )
+
+
+def clean_phone_numbers(numbers: pd.Series) -> pd.Series:
+    """
+    The column-wise version of `clean_phone_number`
+    """
+
+    def clean(uniques: pd.Series) -> np.ndarray:
+        cleaned = uniques.map(str).str.replace(PHONE_JUNK_PATTERN, "", regex=True)
+        return np.where(cleaned.isin(NON_PHONE_NUMBERS), None, cleaned)
+
+    return _map_unique(numbers, clean)
+
+
+def clean_addresses(addresses: pd.Series) -> pd.Series:
+    """
+    The column-wise version of `clean_address`
+    """
+    return _map_unique(
+        addresses,
+        lambda uniques: uniques.map(str)
+        .str.upper()
+        .str.replace(WHITESPACE_PATTERN, " ", regex=True)
+        .str.replace(ADDRESS_JUNK_PATTERN, "", regex=True)
+        .str.rstrip(),
+        na_value="",
+    )
+
+
 def get_mostrec(prefix: str, base_dir: Union[Path, str] = INTERMEDIATE_DIR) -> Path:
     """
     Retrieve the most recent version of a file named "{prefix}-YYYY-MM-DD*" in base_dir
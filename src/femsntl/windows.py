@@ -0,0 +1,372 @@
+"""
+Place Medicaid claims in windows of time around NTL calls (e.g., within 24 hours or
+6 months after a call) without joining every claim to every call, and count the days
+beneficiaries were enrolled in Medicaid in those windows.
+
+The windows follow `061_subset_medclaims_outcomeswindow.R`. Everything is by date:
+after a call on day 0, the "24_hours" window is days [0, 1] and the "6_months"
+window is (day 1, 6 months later]; before it, "6_months_before_call" is
+[6 months earlier, day 0). Months are calendar months, as lubridate's `%m+%` and
+`%m-%` count them.
+"""
+from typing import NamedTuple, Sequence
+
+import numpy as np
+import pandas as pd
+
+AFTER_WINDOWS = "after"
+BEFORE_WINDOWS = "before"
+
+
+class Horizon(NamedTuple):
+    """ A window that ends `offset` after (or, for pre-call windows, before) a call """
+
+    name: str
+    offset: pd.DateOffset
+
+
+POST_CALL_HORIZONS = (
+    Horizon("24_hours", pd.DateOffset(days=1)),
+    Horizon("6_months", pd.DateOffset(months=6)),
+)
+PRE_CALL_HORIZONS = (Horizon("6_months_before_call", pd.DateOffset(months=6)),)
+
+
+def _days(dates: pd.Series) -> np.ndarray:
+    """ Dates as integer days since the epoch (missing dates become the minimum) """
+    return (
+        pd.to_datetime(dates)
+        .dt.normalize()
+        .values.astype("datetime64[D]")
+        .view(np.int64)
+    )
+
+
+def _bounds(
+    call_dates: pd.Series, horizons: Sequence[Horizon], sign: int
+) -> np.ndarray:
+    """
+    The day each horizon ends for each call, as a (horizons, calls) array
+
+    Raises:
+        ValueError: If the horizons are not in order, nearest first
+    """
+    dates = pd.to_datetime(call_dates).dt.normalize()
+    bounds = np.array(
+        [
+            _days(dates + horizon.offset if sign > 0 else dates - horizon.offset)
+            for horizon in horizons
+        ]
+    ).reshape(len(horizons), len(dates))
+    if (np.diff(sign * bounds, axis=0) < 0).any():
+        raise ValueError("Horizons must be in order, nearest to the call first")
+    return bounds
+
+
+def sort_key(id_codes: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """
+    A single integer key which sorts by ID and then by day, so that one binary
+    search finds a day within an ID. IDs must be non-negative and below 2**31,
+    and days (or any other integer times, e.g., seconds) within 2**31 of zero
+    """
+    return (id_codes.astype(np.int64) << 32) + (days + (1 << 31))
+
+
+def assign_windows(
+    calls: pd.DataFrame,
+    claims: pd.DataFrame,
+    id_col: str = "MedicaidSystemID",
+    call_col: str = "call_date",
+    service_col: str = "FirstServiceCalendarDate_dt",
+    relative_to: str = "first",
+    post_horizons: Sequence[Horizon] = POST_CALL_HORIZONS,
+    pre_horizons: Sequence[Horizon] = PRE_CALL_HORIZONS,
+) -> pd.DataFrame:
+    """
+    Label every claim with the window it falls in relative to its beneficiary's
+    calls. Calls and claims are each sorted once and matched with a binary search
+    within each ID, so memory is linear in the number of claims rather than in
+    calls times claims.
+
+    Arguments:
+        calls: A row per call, with `id_col` and the call time in `call_col`
+        claims: A row per claim, with `id_col` and the service date in
+            `service_col`
+        id_col: The beneficiary ID column in both tables
+        call_col: The call time column in `calls`
+        service_col: The service date column in `claims`
+        relative_to: Either "first", to place every claim relative to the
+            beneficiary's first call (as 061 does), or "any", to place it after
+            the latest call on or before its service date (or, if the claim
+            came before all of the beneficiary's calls, before the first one)
+        post_horizons: The windows after the call, nearest first. Add, e.g.,
+            `Horizon("30_days", pd.DateOffset(days=30))` for a new horizon
+        pre_horizons: The windows before the call, nearest first
+
+    Returns:
+        A copy of `claims` with the `call_date` each claim was placed relative to
+        (missing if the beneficiary has no calls), its `window`, a categorical of
+        the horizon names plus "after" and "before" for claims beyond them all,
+        and an `is_within_{name}` column for every horizon
+
+    Raises:
+        ValueError: If `relative_to` is neither "first" nor "any", or the horizons
+            are out of order
+    """
+    if relative_to not in ("first", "any"):
+        raise ValueError(f"Unknown relative_to {relative_to}")
+
+    calls = calls[[id_col, call_col]].dropna()
+    calls = calls.assign(**{call_col: pd.to_datetime(calls[call_col]).dt.normalize()})
+    if relative_to == "first":
+        calls = calls.groupby(id_col, as_index=False)[call_col].min()
+    calls = calls.drop_duplicates()
+
+    # Code the IDs of both tables together so that they can be compared as ints
+    id_codes, _ = pd.factorize(pd.concat([calls[id_col], claims[id_col]]))
+    call_ids, claim_ids = id_codes[: len(calls)], id_codes[len(calls) :]
+    call_days = _days(calls[call_col])
+    call_order = np.lexsort((call_days, call_ids))
+    call_ids, call_days = call_ids[call_order], call_days[call_order]
+    call_dates = calls[call_col].iloc[call_order].reset_index(drop=True)
+
+    # The latest call on or before each claim within its ID or, failing that, the
+    # ID's first call, which is the next one in the sort order. Position
+    # len(calls) is a sentinel that matches no ID
+    service_days = _days(claims[service_col])
+    latest = (
+        np.searchsorted(
+            sort_key(call_ids, call_days),
+            sort_key(claim_ids, service_days),
+            side="right",
+        )
+        - 1
+    )
+    padded_ids = np.append(call_ids, -2)
+    after_call = (latest >= 0) & (padded_ids[latest] == claim_ids)
+    matched = np.where(after_call, latest, latest + 1)
+    has_call = (
+        (padded_ids[matched] == claim_ids)
+        & (claim_ids >= 0)
+        & claims[service_col].notna().values
+    )
+    matched = np.where(has_call, matched, len(call_ids))
+
+    sentinel = ((0, 0), (0, 1))
+    post_bounds = np.pad(_bounds(call_dates, post_horizons, 1), sentinel)[:, matched]
+    pre_bounds = np.pad(_bounds(call_dates, pre_horizons, -1), sentinel)[:, matched]
+    post_window = (service_days > post_bounds).sum(axis=0)
+    pre_window = (service_days < pre_bounds).sum(axis=0)
+
+    # Codes: pre-call windows farthest first, then post-call windows nearest first
+    names = (
+        [BEFORE_WINDOWS]
+        + [horizon.name for horizon in reversed(pre_horizons)]
+        + [horizon.name for horizon in post_horizons]
+        + [AFTER_WINDOWS]
+    )
+    codes = np.where(
+        after_call,
+        len(pre_horizons) + 1 + post_window,
+        len(pre_horizons) - pre_window,
+    )
+
+    claims = claims.copy()
+    claims["call_date"] = pd.Series(
+        np.append(call_dates.values, np.datetime64("NaT", "ns"))[matched],
+        index=claims.index,
+    )
+    claims["window"] = pd.Categorical.from_codes(
+        np.where(has_call, codes, -1), categories=names
+    )
+    for horizon in list(pre_horizons) + list(post_horizons):
+        claims[f"is_within_{horizon.name}"] = (claims.window == horizon.name).values
+    return claims
+
+
+# Spells still open when enrollment was pulled end on 9999-12-31, which pandas cannot
+# represent; `merge_spells` ends them here instead, long after any window we look at
+OPEN_END_DATE = pd.Timestamp.max.floor("D")
+
+
+def _spell_days(values: pd.Series) -> np.ndarray:
+    """
+    Dates as integer days since the epoch, including dates pandas cannot hold (e.g.,
+    9999-12-31, which `read_excel` leaves as `datetime`s). Missing dates are NaT
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        days = pd.Series(values).values.astype("datetime64[D]")
+    else:
+        days = np.array(
+            [None if pd.isnull(value) else value for value in values],
+            dtype="datetime64[D]",
+        )
+    return days.view(np.int64)
+
+
+class _Spells(NamedTuple):
+    """
+    Merged spells as days, sorted by ID and start:
+        * ids: the integer code of each spell's ID
+        * starts, ends: the first and last days of each spell (inclusive)
+        * enrolled_before: the days the ID was enrolled before each spell started
+    """
+
+    ids: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    enrolled_before: np.ndarray
+
+
+def _merge_spells(ids: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> _Spells:
+    """ Merge overlapping or touching spells with one sort and one sweep """
+    order = np.lexsort((starts, ids))
+    ids, starts, ends = ids[order], starts[order], ends[order]
+
+    # IDs are sorted, so a running max of the (ID, end) key never crosses IDs. A
+    # spell starting the day after the last one ended continues it
+    latest_end = np.maximum.accumulate(sort_key(ids, ends))
+    is_new = np.r_[True, sort_key(ids[1:], starts[1:]) > latest_end[:-1] + 1]
+    firsts = np.flatnonzero(is_new[: len(ids)])
+    ends = np.maximum.reduceat(ends, firsts) if len(firsts) else ends
+    ids, starts = ids[firsts], starts[firsts]
+
+    lengths = ends - starts + 1
+    enrolled_before = np.cumsum(lengths) - lengths
+    id_firsts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]][: len(ids)])
+    enrolled_before -= np.repeat(
+        enrolled_before[id_firsts], np.diff(np.r_[id_firsts, len(ids)])
+    )
+    return _Spells(ids, starts, ends, enrolled_before)
+
+
+def _spells_from(
+    spells: pd.DataFrame, id_codes: np.ndarray, start_col: str, end_col: str
+) -> _Spells:
+    """ Merge the spells of a DataFrame, dropping those that are missing dates """
+    starts = _spell_days(spells[start_col])
+    ends = _spell_days(spells[end_col])
+    missing = np.iinfo(np.int64).min
+    valid = (id_codes >= 0) & (starts != missing) & (ends != missing) & (ends >= starts)
+    return _merge_spells(id_codes[valid], starts[valid], ends[valid])
+
+
+def _enrolled_through(spells: _Spells, ids: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """ The number of days each ID was enrolled on or before each day """
+    latest = (
+        np.searchsorted(
+            sort_key(spells.ids, spells.starts), sort_key(ids, days), side="right"
+        )
+        - 1
+    )
+    padded_ids = np.append(spells.ids, -2)
+    found = (latest >= 0) & (padded_ids[latest] == ids)
+    latest = np.where(found, latest, 0)
+    if not len(spells.ids):
+        return np.zeros(len(ids), dtype=np.int64)
+    through = (
+        spells.enrolled_before[latest]
+        + np.minimum(days, spells.ends[latest])
+        - spells.starts[latest]
+        + 1
+    )
+    return np.where(found, through, 0)
+
+
+def merge_spells(
+    spells: pd.DataFrame,
+    id_col: str = "MedicaidSystemID",
+    start_col: str = "EnrollmentStartDate",
+    end_col: str = "EnrollmentEndDate",
+) -> pd.DataFrame:
+    """
+    Merge each beneficiary's enrollment spells that overlap or touch (one starts the
+    day after another ends) into single spells.
+
+    Returns:
+        A row per merged spell with `id_col`, `start_col` and `end_col`, sorted by
+        ID and start. Open spells (ending 9999-12-31) end on `OPEN_END_DATE`
+    """
+    id_codes, id_values = pd.factorize(spells[id_col])
+    merged = _spells_from(spells, id_codes, start_col, end_col)
+    open_end = _days(pd.Series([OPEN_END_DATE]))[0]
+    return pd.DataFrame(
+        {
+            id_col: id_values.take(merged.ids),
+            start_col: merged.starts.astype("datetime64[D]").astype("datetime64[ns]"),
+            end_col: np.minimum(merged.ends, open_end)
+            .astype("datetime64[D]")
+            .astype("datetime64[ns]"),
+        }
+    )
+
+
+def enrollment_exposure(
+    calls: pd.DataFrame,
+    spells: pd.DataFrame,
+    id_col: str = "MedicaidSystemID",
+    call_col: str = "call_date",
+    start_col: str = "EnrollmentStartDate",
+    end_col: str = "EnrollmentEndDate",
+    post_horizons: Sequence[Horizon] = POST_CALL_HORIZONS,
+    pre_horizons: Sequence[Horizon] = PRE_CALL_HORIZONS,
+) -> pd.DataFrame:
+    """
+    Count the days each beneficiary was enrolled in Medicaid before and after each
+    of their calls, as `compute_medicaid_enrollment_precall` and
+    `compute_medicaid_enrollment_postcall` in `061_subset_medclaims_outcomeswindow.R`
+    do for first calls. Spells are merged first, so overlapping spells are not
+    double counted, and any number of calls per beneficiary is fine.
+
+    Spells are truncated at the end of each window, as `EnrollmentEndDate_study`
+    truncates them (including those that end 9999-12-31).
+
+    Arguments:
+        calls: A row per call, with `id_col` and the call time in `call_col`
+        spells: A row per enrollment spell, with `id_col`, `start_col` and
+            `end_col`
+        id_col: The beneficiary ID column in both tables
+        call_col: The call time column in `calls`
+        start_col: The first day of each spell
+        end_col: The last day of each spell
+        post_horizons: The windows after the call to count days in
+        pre_horizons: The windows before the call to count days in
+
+    Returns:
+        A copy of `calls` with:
+            * total_days_precall: the days enrolled up to and including the day of
+              the call
+            * days_enrolled_{name}: the days enrolled in each window; post-call
+              windows run from the day of the call to `offset` after it, pre-call
+              windows from `offset` before it to the day before
+            * is_enrolled_{name}: whether the beneficiary was enrolled for all of
+              the window. For "24_hours" this is R's `enr_24h`
+        Beneficiaries with no spells have no days enrolled
+    """
+    id_codes, _ = pd.factorize(pd.concat([spells[id_col], calls[id_col]]))
+    spell_ids, call_ids = id_codes[: len(spells)], id_codes[len(spells) :]
+    merged = _spells_from(spells, spell_ids, start_col, end_col)
+
+    call_dates = pd.to_datetime(calls[call_col]).dt.normalize()
+    call_days = _days(call_dates)
+    has_call = call_dates.notna().values
+
+    exposure = calls.copy()
+    exposure["total_days_precall"] = np.where(
+        has_call, _enrolled_through(merged, call_ids, call_days), 0
+    )
+    for horizons, sign in ((post_horizons, 1), (pre_horizons, -1)):
+        bounds = _bounds(call_dates.where(has_call, pd.Timestamp(0)), horizons, sign)
+        for horizon, bound in zip(horizons, bounds):
+            if sign > 0:
+                first, last = call_days, bound
+            else:
+                first, last = bound, call_days - 1
+            days = _enrolled_through(merged, call_ids, last) - _enrolled_through(
+                merged, call_ids, first - 1
+            )
+            exposure[f"days_enrolled_{horizon.name}"] = np.where(has_call, days, 0)
+            exposure[f"is_enrolled_{horizon.name}"] = has_call & (
+                days == last - first + 1
+            )
+    return exposure
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from femsntl.dates import DateFormat, parse_dates
+
+
+def test_parse_dates():
+    values = pd.Series(
+        [
+            "01/15/1980",
+            "1/5/80",
+            "1980/1/5",
+            "1980-01-05",
+            "1980-01-05 00:00:00",
+            "13/01/1980",
+            "02/30/1980",
+            "garbage",
+            None,
+            np.nan,
+            "01/15/1980",
+        ],
+        index=np.arange(11)[::-1],
+    )
+    result = parse_dates(values)
+
+    assert result.dates.index.equals(values.index)
+    assert result.dates.dt.strftime("%Y-%m-%d").fillna("").tolist() == [
+        "1980-01-15",
+        "1980-01-05",
+        "1980-01-05",
+        "1980-01-05",
+        "1980-01-05",
+        # dateutil swaps day and month when the month can't be one
+        "1980-01-13",
+        "",
+        "",
+        "",
+        "",
+        "1980-01-15",
+    ]
+    assert result.formats.tolist() == [
+        DateFormat.MDY.name,
+        DateFormat.MDY_SHORT_YEAR.name,
+        DateFormat.YMD.name,
+        DateFormat.ISO.name,
+        DateFormat.ISO_MIDNIGHT.name,
+        DateFormat.FALLBACK.name,
+        DateFormat.FAILED.name,
+        DateFormat.FAILED.name,
+        DateFormat.MISSING.name,
+        DateFormat.MISSING.name,
+        DateFormat.MDY.name,
+    ]
+    assert result.n_failed == 2
+
+
+def test_parse_dates_no_fallback():
+    result = parse_dates(
+        pd.Series(["1/5/20", "Jan 5 1980"]), century=2000, fallback=False
+    )
+
+    assert result.dates.iloc[0] == pd.Timestamp("2020-01-05")
+    assert pd.isna(result.dates.iloc[1])
+    assert result.n_failed == 1
@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+import pytest
 
 from femsntl import df_verbs
 
@@ -24,6 +25,90 @@ def test_case_when_even():
     ).all()
 
 
+@pytest.fixture
+def ids() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "has_name": [True, True, False, False, True],
+            "has_dob": [True, False, True, False, None],
+            "phone": ["555", None, None, "555", None],
+        },
+        index=[10, 11, 12, 13, 14],
+    )
+
+
+def test_case_when_lazy(ids):
+    calls = []
+
+    def has_phone(df):
+        calls.append(df.index.tolist())
+        return df.phone.notnull()
+
+    id_status = df_verbs.case_when(
+        "has_name & has_dob",
+        "Name and DOB",
+        lambda df: df.has_name,
+        "Name but no DOB",
+        has_phone,
+        lambda df: "Phone " + df.phone,
+        "None",
+        data=ids,
+    )
+    assert id_status.tolist() == [
+        "Name and DOB",
+        "Name but no DOB",
+        "None",
+        "Phone 555",
+        "Name but no DOB",
+    ]
+    # Later conditions only see the rows earlier ones were false for
+    assert calls == [[12, 13]]
+
+    # ... and are not evaluated at all once every row has a value
+    df_verbs.case_when(ids.has_name | ~ids.has_name, 1, has_phone, 2, data=ids)
+    assert len(calls) == 1
+
+    with pytest.raises(ValueError):
+        df_verbs.case_when(has_phone, 1, 0)
+
+
+def test_case_when_levels(ids):
+    levels = ["Has both", "Missing dob", "Neither"]
+    status = df_verbs.case_when(
+        ids.has_name & ids.has_dob,
+        "Has both",
+        ids.has_name,
+        "Missing dob",
+        ids.has_dob,
+        None,
+        "Neither",
+        levels=levels,
+    )
+    assert isinstance(status, pd.Categorical)
+    assert status.categories.tolist() == levels
+    assert status.tolist()[:4] == ["Has both", "Missing dob", np.nan, "Neither"]
+
+    # Without a default, rows no condition was true for are missing
+    status = df_verbs.case_when(ids.has_name, ids.phone, levels=["555"])
+    assert pd.isna(status).tolist() == [False, True, True, True, True]
+
+    with pytest.raises(ValueError):
+        df_verbs.case_when(ids.has_name, "Has name", "No name", levels=["Has name"])
+
+
+def test_case_when_aligns_series(ids):
+    # Series are aligned by index rather than position
+    shuffled = ids.sample(frac=1, random_state=0)
+    labels = pd.Series(["a", "b", "c", "d", "e"], index=ids.index)
+    values = df_verbs.case_when(
+        shuffled.has_name, labels, shuffled.phone.notnull(), shuffled.phone, "-"
+    )
+    expected = np.where(
+        shuffled.has_name, labels[shuffled.index], shuffled.phone.fillna("-")
+    )
+    assert (values == expected).all()
+
+
 def test_cross_join():
     # Whether or not the inplace flag is True, we should have the
     # same results
@@ -42,6 +127,51 @@ def test_cross_join():
     )
 
 
+def test_cross_join_with_predicate():
+    calls = pd.DataFrame(
+        {"id": [1, 2, 3], "date": pd.to_datetime(["2018-03-19", "2018-06-01", None])}
+    )
+    claims = pd.DataFrame(
+        {
+            "id": [1, 1, 2, 4],
+            "date": pd.to_datetime(
+                ["2018-03-20", "2018-05-01", "2018-06-05", "2018-06-01"]
+            ),
+        }
+    )
+
+    def within_a_week(pairs):
+        return (pairs.date_y - pairs.date_x).dt.days.between(0, 7)
+
+    chunks = list(df_verbs.iter_cross_join(calls, claims, within_a_week, chunk_size=5))
+    # Chunks with no pairs kept are skipped, and the rest keep their positions
+    assert [chunk.index.tolist() for chunk in chunks] == [[0], [6, 7]]
+    assert chunks[0].columns.tolist() == ["id_x", "date_x", "id_y", "date_y"]
+
+    expected = df_verbs.cross_join(calls, claims)
+    expected = expected[within_a_week(expected)].reset_index(drop=True)
+    for chunk_size in [1, 5, 100]:
+        pd.testing.assert_frame_equal(
+            df_verbs.cross_join(calls, claims, within_a_week, chunk_size), expected
+        )
+
+    nothing = df_verbs.cross_join(calls, claims, lambda pairs: pairs.id_x > 5)
+    assert nothing.empty and nothing.columns.equals(expected.columns)
+
+
+def test_cross_join_with_empty_frame():
+    # As an outer merge, an empty frame adds its columns as missing values
+    left_df = pd.DataFrame({"a": [1, 2, 3]})
+    right_df = pd.DataFrame.from_records([], columns=["b", "c"])
+
+    merged_df = df_verbs.cross_join(left_df, right_df, chunk_size=2)
+    assert merged_df.a.tolist() == [1, 2, 3]
+    assert merged_df[["b", "c"]].isna().all(axis=None)
+
+    merged_df = df_verbs.cross_join(right_df, left_df)
+    assert merged_df.columns.tolist() == ["b", "c", "a"] and len(merged_df) == 3
+
+
 def test_find_ids():
     df = pd.DataFrame(
         {
@@ -57,6 +187,106 @@ def test_find_ids():
     assert set(df_verbs.find_ids(df, "id_var", "subset_var_3")) == set()
 
 
+@pytest.fixture
+def calls() -> pd.DataFrame:
+    rng = np.random.RandomState(19)
+    df = pd.DataFrame(
+        {
+            "MedicaidSystemID": rng.choice(["a", "b", "c", None], size=60),
+            "date": pd.Timestamp("2018-03-19")
+            + pd.to_timedelta(rng.randint(0, 20, size=60), unit="D"),
+            "match_points": rng.randint(0, 4, size=60).astype(float),
+        },
+        index=rng.permutation(60) + 100,
+    )
+    df.loc[df.index[::7], "match_points"] = np.nan
+    return df
+
+
+def test_window(calls):
+    outputs = df_verbs.window(
+        calls,
+        "MedicaidSystemID",
+        order_by="date",
+        max_points=("match_points", "max"),
+        num_points=("match_points", "count"),
+        num_calls=(None, "size"),
+        call_number=(None, "row_number"),
+        call_rank=(None, "rank"),
+        same_day=(None, "ties"),
+        first_points=("match_points", "first"),
+        last_points=("match_points", "last"),
+        previous_date=("date", "lag"),
+        two_calls_later=("date", "lead", 2),
+    )
+    assert outputs.index.equals(calls.index)
+
+    has_id = calls.MedicaidSystemID.notnull()
+    in_order = calls.sort_values("date", kind="mergesort")
+    grouped = calls.groupby("MedicaidSystemID")
+    grouped_in_order = in_order.groupby("MedicaidSystemID")
+    expected = pd.DataFrame(
+        {
+            "max_points": grouped.match_points.transform("max"),
+            "num_points": grouped.match_points.transform("count"),
+            "num_calls": grouped.date.transform("size"),
+            "call_number": grouped_in_order.cumcount() + 1,
+            "call_rank": grouped.date.rank(method="min"),
+            "same_day": calls.groupby(["MedicaidSystemID", "date"]).date.transform(
+                "size"
+            ),
+            "first_points": grouped_in_order.match_points.transform(
+                lambda points: points.iloc[0]
+            ),
+            "last_points": grouped_in_order.match_points.transform(
+                lambda points: points.iloc[-1]
+            ),
+            "previous_date": grouped_in_order.date.shift(1),
+            "two_calls_later": grouped_in_order.date.shift(-2),
+        }
+    )
+    expected = expected.reindex(calls.index).where(has_id)
+    pd.testing.assert_frame_equal(outputs, expected, check_dtype=False)
+    # Integer outputs stay integers even though some rows have no group
+    integers = ["num_points", "num_calls", "call_number", "call_rank", "same_day"]
+    assert (outputs[integers].dtypes == "Int64").all()
+    assert outputs.call_number.astype(str)[has_id].str.isdigit().all()
+
+    # Descending order puts the latest call first
+    latest = df_verbs.window(
+        calls,
+        ["MedicaidSystemID"],
+        order_by=["date"],
+        ascending=False,
+        latest=("date", "first"),
+    ).latest
+    assert (latest[has_id] == grouped.date.transform("max")[has_id]).all()
+
+    with pytest.raises(ValueError):
+        df_verbs.window(calls, "MedicaidSystemID", rank=(None, "rank"))
+    with pytest.raises(ValueError):
+        df_verbs.window(calls, "MedicaidSystemID", median=("match_points", "median"))
+
+
+def test_append_max_and_count_matches_transform(calls):
+    df = df_verbs.append_max_and_count(
+        calls.copy(), id_col="MedicaidSystemID", inplace=False
+    )
+    grouped = calls.groupby("MedicaidSystemID").match_points
+    pd.testing.assert_series_equal(
+        df.max_match_points, grouped.transform("max"), check_names=False
+    )
+    pd.testing.assert_series_equal(
+        df.count_of_match_points,
+        calls.groupby(["MedicaidSystemID", "match_points"]).match_points.transform(
+            "count"
+        ),
+        check_names=False,
+        check_dtype=False,
+    )
+    assert df.count_of_match_points.dtype == "Int64"
+
+
 def test_append_max_and_count():
     # Inplace
     df = pd.DataFrame(
@@ -0,0 +1,173 @@
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from femsntl import edvisits, readers
+from femsntl.edvisits import classify_diagnoses, code_claims, read_lookup, revenue_flags
+
+
+@pytest.fixture
+def nyu_ed() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "icd10cm": ["A000", "S0100", "s01.00 ", "J45", "J4520", "R51"],
+            "Non_Emergent": [0.0, 0.1, 0.2, 0.3, 0.4, 0.5],
+            "Emergent__PC_Treatable": [1.0, 0.0, 0.5, 0.25, 0.0, 0.5],
+        }
+    )
+
+
+@pytest.fixture
+def cache_dir(tmp_path: Path, monkeypatch) -> Path:
+    monkeypatch.setattr(readers, "SHA_CACHE_PATH", tmp_path / "sha_cache.json")
+    return tmp_path / "cache"
+
+
+def test_read_lookup(tmp_path, nyu_ed, cache_dir, monkeypatch):
+    filename = tmp_path / "nyu_ed.xlsx"
+    nyu_ed.to_excel(filename, index=False)
+
+    lookup = read_lookup(filename, cache_dir=None)
+    assert lookup.classes.index.tolist() == ["A000", "J45", "J4520", "R51", "S0100"]
+    assert lookup.prefix_lengths == (5, 4, 3)
+    # Only the first of codes which are the same once normalized is kept
+    assert lookup.classes.Non_Emergent["S0100"] == 0.1
+
+    assert not cache_dir.exists()
+    pd.testing.assert_frame_equal(
+        read_lookup(filename, cache_dir=cache_dir).classes, lookup.classes
+    )
+    assert len(list(cache_dir.glob("*.parquet"))) == 1
+
+    # Later reads come from the cache
+    monkeypatch.setattr(edvisits.pd, "read_excel", None)
+    cached = read_lookup(filename, cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(cached.classes, lookup.classes)
+    assert cached.prefix_lengths == lookup.prefix_lengths
+
+
+def test_classify_diagnoses(nyu_ed):
+    # Without the code which is only listed once normalized
+    nyu_ed = nyu_ed.drop(index=2)
+    lookup = edvisits._as_lookup(edvisits.compile_lookup(nyu_ed), "icd10cm")
+    codes = pd.Series(
+        ["A00.0", "J45.20", "j45.909", "S01.00XA", None, "Z99", "A000"],
+        index=list("abcdefg"),
+    )
+
+    # Exact matches are what 070 got by merging on the codes without dots
+    expected = (
+        pd.DataFrame({"primarydx_tomerge": codes.str.replace(".", "", regex=False)})
+        .merge(
+            nyu_ed,
+            left_on="primarydx_tomerge",
+            right_on="icd10cm",
+            how="left",
+        )
+        .drop(columns="primarydx_tomerge")
+        .set_index(codes.index)
+    )
+    expected.loc["c", "icd10cm"] = np.nan
+    classes = classify_diagnoses(codes, lookup)
+    pd.testing.assert_frame_equal(classes, expected)
+
+    # The fallback classifies codes by their longest listed prefix
+    classes = classify_diagnoses(codes, lookup, prefix_fallback=True)
+    assert classes.icd10cm.tolist()[:4] == ["A000", "J4520", "J45", "S0100"]
+    assert classes.icd10cm.isna().tolist()[4:] == [True, True, False]
+
+
+def _construct_edvisit(df: pd.DataFrame) -> pd.DataFrame:
+    """ construct_edvisit as 070 used to code it, on string revenue codes """
+    ed_visit_codes = [f"045{idx}" for idx in range(10)] + ["0981"]
+    room_board_codes = [f"0{idx}" for idx in range(100, 220)]
+    df = df.assign(
+        is_ed_visit=df.RevenueCode.isin(ed_visit_codes),
+        is_inpatient_admit=df.RevenueCode.isin(room_board_codes),
+    )
+    output_df = (
+        df.groupby("ClaimTCNText")
+        .agg(
+            {
+                "is_ed_visit": "max",
+                "is_inpatient_admit": "max",
+                "MedicaidSystemID": "first",
+                "PrimaryDiagnosisCode": "first",
+            }
+        )
+        .reset_index()
+    )
+    output_df["is_ed_visit_not_inpatient"] = (
+        output_df.is_ed_visit & ~output_df.is_inpatient_admit
+    )
+    output_df["is_ed_visit_with_inpatient"] = (
+        output_df.is_ed_visit & output_df.is_inpatient_admit
+    )
+    return output_df
+
+
+@pytest.fixture
+def claim_lines() -> pd.DataFrame:
+    rng = np.random.RandomState(16)
+    num_claims = 300
+    claim_ids = rng.randint(0, num_claims, size=2000)
+    revenue_codes = np.concatenate(
+        [np.arange(99, 104), np.arange(440, 460), [219, 220, 300, 981, 982]]
+    )
+    df = pd.DataFrame(
+        {
+            "ClaimTCNText": [f"{i:012d}" for i in claim_ids],
+            "RevenueCode": [f"{code:04d}" for code in rng.choice(revenue_codes, 2000)],
+            "MedicaidSystemID": [f"{i % 40:09d}" for i in claim_ids],
+            "PrimaryDiagnosisCode": [f"R{i:03d}" for i in claim_ids],
+        }
+    )
+    df.loc[::50, "RevenueCode"] = None
+    df.loc[::70, "ClaimTCNText"] = None
+    return df
+
+
+def test_code_claims(claim_lines):
+    expected = _construct_edvisit(claim_lines)
+    assert expected.is_ed_visit_not_inpatient.any()
+    assert expected.is_ed_visit_with_inpatient.any()
+
+    pd.testing.assert_frame_equal(code_claims(claim_lines), expected)
+
+    # Categorical revenue codes are coded the same, but, as in 070, integer
+    # codes do not match the string codes
+    pd.testing.assert_frame_equal(
+        code_claims(
+            claim_lines.assign(RevenueCode=claim_lines.RevenueCode.astype("category"))
+        ),
+        expected,
+    )
+    as_numbers = claim_lines.RevenueCode.astype(float)
+    pd.testing.assert_frame_equal(
+        code_claims(claim_lines.assign(RevenueCode=as_numbers)),
+        _construct_edvisit(claim_lines.assign(RevenueCode=as_numbers)),
+    )
+
+
+def test_revenue_flags():
+    revenue_codes = pd.read_csv(
+        StringIO("RevenueCode\n0450\n0981\n0120\n\n0300\n"),
+        dtype=str,
+        skip_blank_lines=False,
+    ).RevenueCode
+    flags = revenue_flags(
+        revenue_codes,
+        {"ed_visit": edvisits.ED_VISIT_CODES, "admit": edvisits.ROOM_BOARD_CODES},
+    )
+    assert flags["ed_visit"].tolist() == [True, True, False, False, False]
+    assert flags["admit"].tolist() == [False, False, True, False, False]
+
+    # As read_csv parses RevenueCode when no dtype is given, which 070 never
+    # coded as ED visits
+    as_numbers = pd.read_csv(
+        StringIO("RevenueCode\n0450\n0981\n"), skip_blank_lines=False
+    ).RevenueCode
+    assert not revenue_flags(as_numbers, {"ed": edvisits.ED_VISIT_CODES})["ed"].any()
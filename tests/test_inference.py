@@ -0,0 +1,88 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from femsntl.inference import randomization_test, randomization_tests, read_outcomes
+
+
+@pytest.fixture
+def patients():
+    rng = np.random.RandomState(13)
+    num_patients = 400
+    is_treatment = rng.permutation(np.arange(num_patients) % 2 == 0)
+    df = pd.DataFrame(
+        {
+            "dispo_broad": np.where(is_treatment, "NTL treatment", "Control"),
+            "is_PCP_oneormore_optimistic_24ho": rng.rand(num_patients) < 0.1,
+            "is_PCP_oneormore_optimistic_6mo": rng.rand(num_patients)
+            < np.where(is_treatment, 0.5, 0.3),
+            "total_expenditures_24ho": rng.exponential(100, size=num_patients),
+        }
+    )
+    df.loc[::10, "total_expenditures_24ho"] = np.nan
+    return df
+
+
+def test_read_outcomes(patients, tmp_path):
+    patients.to_csv(tmp_path / "ptlevel.csv", index=False)
+    df = read_outcomes(tmp_path / "ptlevel.csv")
+    assert (df.is_treatment == (patients.dispo_broad == "NTL treatment")).all()
+    assert df.logged_expenditures_24[::10].isnull().all()
+    assert df.logged_expenditures_24.notnull().sum() == len(df) - len(df[::10])
+    assert "logged_expenditures_6" not in df.columns
+
+
+def test_randomization_test(patients):
+    df = patients.assign(is_treatment=patients.dispo_broad == "NTL treatment")
+    results = randomization_tests(df, num_permutations=2000, jobs=1, block_size=300)
+    assert results.outcome.tolist() == [
+        "is_PCP_oneormore_optimistic_24ho",
+        "is_PCP_oneormore_optimistic_6mo",
+    ]
+    means = df.groupby("is_treatment")[results.outcome].mean()
+    np.testing.assert_allclose(results.estimate, means.loc[True] - means.loc[False])
+
+    no_effect, effect = results.p_value
+    assert no_effect > 0.05
+    assert effect == 1 / 2001
+
+
+def test_randomization_test_with_missing_outcomes(patients):
+    is_treatment = patients.dispo_broad == "NTL treatment"
+    results = randomization_test(
+        patients[["total_expenditures_24ho"]], is_treatment, jobs=1
+    )
+    observed = patients.total_expenditures_24ho.notnull()
+    means = patients[observed].groupby(is_treatment).total_expenditures_24ho.mean()
+    np.testing.assert_allclose(results.estimate, means[True] - means[False])
+
+
+def test_randomization_test_matches_exact_p_value():
+    outcome = np.array([1.0, 3.0, 2.0, 5.0, 4.0, 0.0, 7.0, 6.0])
+    is_treatment = np.array([1, 0, 0, 1, 0, 0, 1, 1], dtype=bool)
+
+    observed = outcome[is_treatment].mean() - outcome[~is_treatment].mean()
+    differences = [
+        outcome[list(treated)].mean() - np.delete(outcome, list(treated)).mean()
+        for treated in combinations(range(8), 4)
+    ]
+    exact = np.mean(np.abs(differences) >= abs(observed) - 1e-10)
+
+    results = randomization_test(
+        pd.DataFrame({"outcome": outcome}), is_treatment, num_permutations=20_000
+    )
+    assert results.p_value[0] == pytest.approx(exact, abs=0.01)
+
+
+def test_randomization_test_is_reproducible(patients):
+    outcomes = patients[["is_PCP_oneormore_optimistic_24ho"]]
+    is_treatment = patients.dispo_broad == "NTL treatment"
+    kwargs = dict(num_permutations=1000, block_size=250, seed=4)
+    serial = randomization_test(outcomes, is_treatment, jobs=1, **kwargs)
+    parallel = randomization_test(outcomes, is_treatment, jobs=2, **kwargs)
+    pd.testing.assert_frame_equal(serial, parallel)
+
+    with pytest.raises(ValueError):
+        randomization_test(outcomes, np.ones(len(outcomes), dtype=bool))
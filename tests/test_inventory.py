@@ -0,0 +1,76 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+import yaml
+from click.testing import CliRunner
+
+from femsntl.cli import cli
+from femsntl.inventory import SHA_CACHE_FILE, ShaCache, compute_shas
+from femsntl.utils import compute_sha
+
+
+@pytest.fixture
+def fixtures_path() -> Path:
+    """ The location of any fixtures for tests """
+    return Path(__file__).parent / "fixtures"
+
+
+def _summary(output: str) -> dict:
+    """ The JSON summary printed by verify, after anything echoed to stderr """
+    return json.loads(output[output.index("{") :])
+
+
+def test_compute_shas(tmp_path: Path, fixtures_path: Path):
+    paths = []
+    for size in [0, 1, 1 << 10, (1 << 20) + 7]:
+        path = tmp_path / f"file_{size}"
+        path.write_bytes(os.urandom(size))
+        paths.append(path)
+    paths.append(fixtures_path / "small_text_file.txt")
+
+    expected = {path: compute_sha(path, chunk_size=8192) for path in paths}
+    cache = ShaCache(tmp_path / SHA_CACHE_FILE)
+    assert compute_shas(paths, cache=cache, jobs=2) == expected
+    assert all(cache.get(path) == sha for path, sha in expected.items())
+
+    # A changed file is not taken from the cache
+    paths[1].write_bytes(b"x")
+    assert cache.get(paths[1]) is None
+    assert compute_shas(paths[1:2], cache=cache)[paths[1]] == compute_sha(paths[1])
+
+
+def test_inventory_commands(tmp_path: Path):
+    data_dir = tmp_path / "data"
+    (data_dir / "private_data").mkdir(parents=True)
+    (data_dir / "private_data" / "claims.csv").write_text("a,b\n1,2\n")
+    (data_dir / "public_data.csv").write_text("c\n3\n")
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ["inventory", "create", "-d", str(data_dir)])
+    assert result.exit_code == 0, result.output
+    with open(data_dir / "inventory.yml") as infile:
+        inventory = yaml.safe_load(infile)
+    assert sorted(obj["path"] for obj in inventory["files"]) == [
+        "private_data/claims.csv",
+        "public_data.csv",
+    ]
+
+    result = runner.invoke(cli, ["inventory", "verify", "-d", str(data_dir)])
+    assert result.exit_code == 0, result.output
+    summary = _summary(result.output)
+    assert summary["ok"] and summary["checked"] == 2 and summary["hashed"] == 0
+
+    result = runner.invoke(cli, ["inventory", "verify", "-d", str(data_dir), "--deep"])
+    assert _summary(result.output)["hashed"] == 2
+
+    (data_dir / "private_data" / "claims.csv").write_text("a,b\n1,3\n")
+    (data_dir / "public_data.csv").unlink()
+    result = runner.invoke(cli, ["inventory", "verify", "-d", str(data_dir)])
+    assert result.exit_code == 1
+    summary = _summary(result.output)
+    assert not summary["ok"]
+    assert summary["mismatched"] == ["private_data/claims.csv"]
+    assert summary["missing"] == ["public_data.csv"]
+    assert "does not match sha" in result.output
@@ -0,0 +1,376 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fuzzywuzzy import process
+
+from femsntl import linkage
+from femsntl.linkage import (
+    FuzzyNameMatcher,
+    IdentityIndex,
+    LinkFields,
+    LinkThresholds,
+    connected_components,
+    link_records,
+    resolve_identities,
+)
+
+NAMES = [
+    "KEVIN WILSON",
+    "KEVEN WILSON",
+    "WILSON KEVIN",
+    "KEVIN WILLSON JR",
+    "KEVIN",
+    "WILSON",
+    "MARY ANN SMITH",
+    "MARYANN SMITH",
+    "MARY SMITH",
+    "SMITH MARY ANN ANN",
+    "A B",
+    "A B C",
+    "B A",
+    "J",
+    "J SMITH",
+    "JO SMITH",
+    "JOHN O'NEIL",
+    "JOHN ONEIL",
+    "JOHN O NEIL",
+    "ROBERT DE LA CRUZ",
+    "ROBERT DELACRUZ",
+    "ROB DE LA CRUZ",
+    "BOB",
+    "BOBBY",
+    "LI",
+    "LI LEE",
+    "ANNA GARCIA",
+    "ANA GARCIA",
+    "ANNA GARCIAS",
+    "GARCIA ANNA MARIA",
+    "",
+    "--",
+]
+
+
+def _extract_bests(names, threshold=90, limit=5):
+    out = []
+    for name in names:
+        other_choices = [choice for choice in names if choice != name]
+        df = pd.DataFrame(
+            list(
+                process.extractBests(
+                    name, other_choices, score_cutoff=threshold, limit=limit
+                )
+            ),
+            columns=["matched_name", "score"],
+        )
+        df["original_name"] = name
+        out.append(df)
+    return pd.concat(out).reset_index(drop=True)
+
+
+def test_fuzzy_name_matcher_matches_extract_bests():
+    expected = _extract_bests(NAMES)
+    actual = FuzzyNameMatcher(NAMES).match()
+
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_fuzzy_name_matcher_limit_and_threshold():
+    expected = _extract_bests(NAMES, threshold=95, limit=None)
+    actual = FuzzyNameMatcher(NAMES, threshold=95, limit=None).match()
+
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_fuzzy_name_matcher_new_queries():
+    matcher = FuzzyNameMatcher(NAMES)
+    actual = matcher.match(["KEVIN WILSON", "KEVNI WILSON"])
+
+    assert set(actual.original_name) == {"KEVIN WILSON", "KEVNI WILSON"}
+    # Identical names are never matched
+    assert not (actual.original_name == actual.matched_name).any()
+    assert (
+        "KEVIN WILSON"
+        in actual.loc[actual.original_name == "KEVNI WILSON", "matched_name"].tolist()
+    )
+
+
+def test_connected_components():
+    rng = np.random.RandomState(20)
+    num_nodes = 500
+    left, right = rng.randint(0, num_nodes, size=(2, 300))
+    labels = connected_components(left, right, num_nodes)
+
+    # Linked nodes share a label, which is the smallest node of the component
+    assert (labels[left] == labels[right]).all()
+    assert (labels <= np.arange(num_nodes)).all()
+    assert (labels[labels] == labels).all()
+
+    # Each label is one component: following edges from it reaches all its nodes
+    neighbours = {node: set() for node in range(num_nodes)}
+    for i, j in zip(left, right):
+        neighbours[i].add(j)
+        neighbours[j].add(i)
+    for label in np.unique(labels):
+        seen, frontier = {label}, [label]
+        while frontier:
+            new = neighbours[frontier.pop()] - seen
+            seen |= new
+            frontier.extend(new)
+        assert seen == set(np.flatnonzero(labels == label))
+
+    # A long chain takes a single component
+    chain = np.arange(999, 0, -1)
+    assert (connected_components(chain, chain - 1, 1000) == 0).all()
+    assert connected_components([], [], 3).tolist() == [0, 1, 2]
+
+
+@pytest.fixture
+def records() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "num_1": ["5", "3", "3", "1", "2", "4", "6", "7", None],
+            "name": [
+                "KEVIN WILSON",
+                "KEVEN WILSON",
+                "KEVIN WILSON",
+                "KEVN WILSON",
+                "MARY SMITH",
+                None,
+                "MARY SMITH",
+                "ANNA GARCIA",
+                "ANNA GARCIA",
+            ],
+            "phone": [None, None, None, None, "555", "555", None, None, None],
+        }
+    )
+
+
+def test_resolve_identities(records):
+    # Only KEVN~KEVEN and KEVEN~KEVIN were matched, but all three are one person
+    matches = pd.DataFrame(
+        {
+            "original_name": ["KEVN WILSON", "KEVEN WILSON", "NOBODY"],
+            "matched_name": ["KEVEN WILSON", "KEVIN WILSON", "MARY SMITH"],
+        }
+    )
+    lookup = resolve_identities(
+        records, link_on=["name", "phone"], matches=matches, match_on="name"
+    )
+    assert lookup.num_1.tolist() == ["1", "3", "5", "2", "4", "6", "7"]
+    assert lookup.constructed_id.tolist() == [1, 1, 1, 2, 2, 2, 3]
+
+    # Without the phone, 4 is its own person, and without the matches each name is
+    lookup = resolve_identities(records.sample(frac=1, random_state=0), "num_1", "name")
+    assert lookup.num_1.tolist() == ["1", "2", "6", "3", "5", "4", "7"]
+    assert lookup.constructed_id.tolist() == [1, 2, 2, 3, 3, 4, 5]
+
+    with pytest.raises(ValueError):
+        resolve_identities(records, link_on="phone", matches=matches, match_on="name")
+
+
+def _people(lookup: pd.DataFrame) -> set:
+    """ The ids of each person, whatever their constructed_id """
+    return set(map(frozenset, lookup.groupby("constructed_id").num_1.agg(set)))
+
+
+def test_identity_index(records, tmp_path):
+    matches = pd.DataFrame(
+        {
+            "original_name": ["KEVN WILSON", "ANNA GARCIA"],
+            "matched_name": ["KEVEN WILSON", "ANNA GARCIAS"],
+        }
+    )
+    kwargs = dict(link_on=["name", "phone"], matches=matches)
+    expected = resolve_identities(records, **kwargs)
+
+    # Everything at once is resolve_identities
+    index = IdentityIndex()
+    pd.testing.assert_frame_equal(index.add(records, **kwargs), expected)
+    pd.testing.assert_frame_equal(index.lookup, expected)
+
+    # In batches, existing people keep their ids and new ones get new ids
+    index = IdentityIndex()
+    first = index.add(records.iloc[:3], **kwargs)
+    assert first.constructed_id.tolist() == [1, 1]
+    path = index.write(base_dir=tmp_path)
+    assert path.parent == tmp_path
+
+    # Writing the same keys again adds no version
+    assert index.write(base_dir=tmp_path) == path
+    assert len(list(tmp_path.glob("identity_index_*.parquet"))) == 1
+
+    index = IdentityIndex.read(base_dir=tmp_path)
+    later = pd.concat(
+        [
+            records.iloc[3:],
+            pd.DataFrame({"num_1": ["8", "5"], "name": ["ANNA GARCIAS", None]}),
+        ]
+    )
+    lookup = index.add(later, **kwargs)
+    assert lookup.num_1.tolist() == ["1", "5", "2", "4", "6", "7", "8"]
+    assert lookup.constructed_id.tolist() == [1, 1, 2, 2, 2, 3, 3]
+    assert _people(index.lookup) == _people(
+        resolve_identities(pd.concat([records, later]), **kwargs)
+    )
+
+    # A batch that links two people merges them under the smaller id
+    index.add(
+        pd.DataFrame({"num_1": ["9"], "name": ["ANNA GARCIA"], "phone": ["555"]}),
+        **kwargs,
+    )
+    assert index.lookup.constructed_id.tolist() == [1] * 3 + [2] * 6
+
+    # Only new ids, and new names (or names of other people) for known ids, are
+    # unseen
+    batch = pd.DataFrame(
+        {
+            "num_1": ["1", "3", "3", "10", "2", "4", None],
+            "name": [
+                "KEVN WILSON",
+                "KEVEN WILSON",
+                "K WILSON",
+                None,
+                "KEVIN WILSON",
+                "ANNA GARCIA",
+                "K WILSON",
+            ],
+        }
+    )
+    assert index.unseen(batch, "name").num_1.tolist() == ["3", "10", "2"]
+    assert index.unseen(batch).num_1.tolist() == ["10"]
+    # A new name for a known id joins that id's person
+    index.add(index.unseen(batch, "name"), link_on="name")
+    assert index.values("name")["K WILSON"] == index.values("num_1")["3"]
+
+    # Numbers sort differently as strings, so the ids must be strings
+    with pytest.raises(ValueError):
+        IdentityIndex().add(pd.DataFrame({"num_1": [9, 10, 11, 2]}))
+
+
+def test_identity_index_match_names():
+    index = IdentityIndex()
+    index.add(pd.DataFrame({"num_1": ["1", "2"], "name": NAMES[:2]}), link_on="name")
+
+    matches = index.match_names(NAMES[:4] + [None], "name")
+    # Names in the index are only matched by new ones
+    assert set(matches.original_name) <= {"WILSON KEVIN", "KEVIN WILLSON JR"}
+    assert len(matches)
+    expected = FuzzyNameMatcher(NAMES[:4]).match(NAMES[2:4])
+    pd.testing.assert_frame_equal(matches, expected)
+
+
+@pytest.fixture
+def ntl_and_medicaid():
+    ntl = pd.DataFrame(
+        {
+            "firstname_name1": ["KEVIN", "MARY", "JOHN", "ANNA", "LI", None],
+            "lastname_name1": ["WILSON", "SMITH", "O'NEIL", "GARCIA", "LEE", None],
+            "firstname_name2": [None, None, None, "ANA", None, None],
+            "lastname_name2": [None, None, None, "GARCIA", None, None],
+            "date_of_birth": [
+                "1980-01-02",
+                "1975-06-07",
+                "1990-03-04",
+                "1962-12-01",
+                "2001-01-01",
+                "1999-09-09",
+            ],
+        },
+        index=[f"ntl{i}" for i in range(6)],
+    )
+    medicaid = pd.DataFrame(
+        {
+            "MemberFirstName": ["Kevin", "Smith", "Jon", "Ana", "Bob", "Mary"],
+            "MemberLastName": ["Wilson", "Mary", "ONeil", "Garcia", "Jones", "Smyth"],
+            "MemberDateofBirth": pd.to_datetime(
+                [
+                    "1980-01-02",
+                    "1975-06-07",
+                    "1990-04-03",
+                    "1962-12-01",
+                    "2001-01-01",
+                    "1985-02-03",
+                ]
+            ),
+        },
+        index=[f"M{i}" for i in range(6)],
+    )
+    return ntl, medicaid
+
+
+def test_link_records(ntl_and_medicaid):
+    ntl, medicaid = ntl_and_medicaid
+    links = link_records(ntl, medicaid, thresholds=LinkThresholds(2.7, 2.0))
+    best = links.drop_duplicates("left").set_index("left")
+
+    # Exact, swapped first and last names, and an alternative name all match
+    assert best.loc[["ntl0", "ntl1", "ntl3"], "right"].tolist() == ["M0", "M1", "M3"]
+    assert (best.loc[["ntl0", "ntl1", "ntl3"], "status"] == "match").all()
+    assert best.loc["ntl3", "fields"] == 1
+    # A typo in the name and swapped month and day are for review
+    assert best.loc["ntl2", "right"] == "M2"
+    assert best.loc["ntl2", "status"] == "review"
+    # The same DOB alone is not a match
+    assert best.loc["ntl4", "status"] == "non-match"
+    assert "ntl5" not in best.index
+    assert links.score.is_monotonic_decreasing
+    assert not links.duplicated(["left", "right"]).any()
+
+
+def test_link_records_dob_formats(ntl_and_medicaid):
+    ntl, medicaid = ntl_and_medicaid
+    expected = link_records(ntl, medicaid)
+
+    # The claims extracts write DOBs in SAS's format, which needs its format
+    sas_dobs = medicaid.MemberDateofBirth.dt.strftime("%d%b%Y:%H:%M:%S").str.upper()
+    sas_medicaid = medicaid.assign(MemberDateofBirth=sas_dobs)
+    sas_fields = LinkFields(
+        "MemberFirstName", "MemberLastName", "MemberDateofBirth", "%d%b%Y:%H:%M:%S"
+    )
+    pd.testing.assert_frame_equal(
+        link_records(ntl, sas_medicaid, right_fields=sas_fields), expected
+    )
+    with pytest.warns(UserWarning, match="6 of 6 DOBs in MemberDateofBirth"):
+        link_records(ntl, sas_medicaid)
+
+    # Mixed formats are read with parse_dates
+    mixed = medicaid.assign(
+        MemberDateofBirth=[
+            "1/2/1980",
+            "6/7/75",
+            "1990-04-03",
+            "1962-12-01 00:00:00",
+            "2001/1/1",
+            "1985-02-03",
+        ]
+    )
+    pd.testing.assert_frame_equal(link_records(ntl, mixed), expected)
+
+
+def test_candidate_pairs_find_close_pairs():
+    rng = np.random.RandomState(23)
+    names = pd.Series(NAMES[:30])
+    people = pd.DataFrame(
+        {
+            "first": names.str.split().str[0],
+            "last": names.str.split().str[-1],
+            "dob": pd.Timestamp("1950-01-01")
+            + pd.to_timedelta(rng.randint(0, 50, size=len(names)), unit="D"),
+        }
+    )
+    fields = LinkFields("first", "last", "dob")
+    links = link_records(people, people, fields, fields)
+
+    # Every pair that scores close to a match is a candidate
+    left, right = np.meshgrid(np.arange(len(people)), np.arange(len(people)))
+    all_pairs = np.column_stack([left.ravel(), right.ravel()])
+    left_keys = linkage._link_keys(people, fields)
+    first, second = left_keys.iloc[all_pairs[:, 0]], left_keys.iloc[all_pairs[:, 1]]
+    scores = (
+        linkage._compare_names(first.first_name, second.first_name, 1, 100)
+        + linkage._compare_names(first.last_name, second.last_name, 1, 100)
+        + linkage._compare_dobs(first.dob, second.dob)
+    )
+    close = {tuple(pair) for pair in all_pairs[scores >= 2.5]}
+    assert close <= set(zip(links.left, links.right))
+    assert len(links) < len(all_pairs)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from statsmodels.stats import api as sms
+
+from femsntl.power import (
+    binary_mde_grid,
+    cohens_h,
+    continuous_mde_grid,
+    inverse_cohens_h,
+    mde,
+    power,
+    scenario_grid,
+    simulate_binary_power,
+)
+
+SAMPLE_SIZES = np.array([240, 2400, 5400, 16665])
+
+
+@pytest.mark.parametrize(
+    "test,statsmodels_power",
+    [("normal", sms.NormalIndPower()), ("t", sms.TTestIndPower())],
+)
+def test_matches_statsmodels(test, statsmodels_power):
+    for alpha, num_hypotheses, target in [(0.05, 8, 0.8), (0.1, 1, 0.9)]:
+        effects = mde(
+            SAMPLE_SIZES,
+            alpha=alpha,
+            power=target,
+            num_hypotheses=num_hypotheses,
+            test=test,
+        )
+        expected = [
+            float(
+                statsmodels_power.solve_power(
+                    nobs1=sample_size / 2, alpha=alpha / num_hypotheses, power=target
+                )
+            )
+            for sample_size in SAMPLE_SIZES
+        ]
+        np.testing.assert_allclose(effects, expected, rtol=1e-4)
+        np.testing.assert_allclose(
+            power(effects, SAMPLE_SIZES, alpha, num_hypotheses, test=test), target
+        )
+
+    np.testing.assert_allclose(
+        power(0.1, SAMPLE_SIZES, test=test),
+        [statsmodels_power.power(0.1, n / 2, 0.05) for n in SAMPLE_SIZES],
+    )
+
+
+def test_cohens_h_round_trip():
+    base_rates = np.linspace(0.05, 0.95, 19)
+    lower, upper = inverse_cohens_h(0.1, base_rates)
+    np.testing.assert_allclose(cohens_h(lower, base_rates), 0.1)
+    np.testing.assert_allclose(cohens_h(base_rates, upper), 0.1)
+
+
+def test_mde_grids():
+    grid = binary_mde_grid(
+        base_rate=np.linspace(0.07, 0.12, 30),
+        sample_size=[2400, 5400, 16665],
+        power=[0.8, 0.9],
+        num_hypotheses=[1, 8],
+    )
+    assert len(grid) == 30 * 3 * 2 * 2
+    assert (grid.lower < grid.base_rate).all() and (grid.base_rate < grid.upper).all()
+    # Bigger samples detect smaller effects; more power or hypotheses need bigger ones
+    by_scenario = grid.groupby(["sample_size", "power", "num_hypotheses"])
+    effects = by_scenario.effect_size.first()
+    assert (effects.xs(2400) > effects.xs(16665)).all()
+    assert (effects.xs(0.9, level="power") > effects.xs(0.8, level="power")).all()
+
+    grid = continuous_mde_grid(
+        base_mean=[400, 500], sd=[225], sample_size=[3600], num_hypotheses=[8]
+    )
+    expected = sms.TTestIndPower().solve_power(nobs1=1800, alpha=0.05 / 8, power=0.8)
+    np.testing.assert_allclose(grid.effect_size, expected, rtol=1e-4)
+    np.testing.assert_allclose(grid.upper - grid.base_mean, expected * 225, rtol=1e-4)
+
+
+def test_simulate_binary_power():
+    # No effect and a small effect, at two sample sizes
+    scenarios = scenario_grid(
+        base_rate=[0.1], treated_rate=[0.1, 0.13], sample_size=[2400, 5400]
+    )
+
+    simulated = simulate_binary_power(
+        scenarios, num_simulations=4000, seed=3, jobs=1, batch_size=1500, chunk_size=2
+    )
+    analytic = power(
+        cohens_h(scenarios.base_rate.values, scenarios.treated_rate.values),
+        scenarios.sample_size.values,
+    )
+    np.testing.assert_allclose(simulated, analytic, atol=0.03)
+
+    parallel = simulate_binary_power(
+        scenarios, num_simulations=4000, seed=3, jobs=2, batch_size=1500, chunk_size=2
+    )
+    np.testing.assert_array_equal(simulated, parallel)
@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import pytest
+
+from femsntl.profiling import (
+    StageProfile,
+    cell_durations,
+    compare_reports,
+    find_reports,
+    read_report,
+    report_frame,
+    run_profiled,
+    write_report,
+)
+
+
+def _use_memory(num_mb: int):
+    data = np.ones(num_mb * 1024 ** 2 // 8)
+    while data.sum() > 0 and len(data) > 1:
+        data = data[: len(data) // 2]
+
+
+def _fail():
+    raise KeyError("missing")
+
+
+def test_run_profiled():
+    usage = run_profiled(_use_memory, 200)
+    assert usage.wall_seconds > 0 and usage.cpu_seconds > 0
+    assert usage.max_rss_mb > 200
+
+    # Each call is measured on its own, so a smaller one uses less memory
+    assert run_profiled(_use_memory, 10).max_rss_mb < 200
+
+    with pytest.raises(KeyError, match="missing"):
+        run_profiled(_fail)
+
+
+def test_cell_durations(tmp_path):
+    path = tmp_path / "executed.ipynb"
+    with open(path, "wt") as outfile:
+        json.dump(
+            {
+                "cells": [
+                    {"cell_type": "markdown", "source": ["# Title"], "metadata": {}},
+                    {
+                        "cell_type": "code",
+                        "source": ["\n", "import pandas as pd\n", "df = 1"],
+                        "metadata": {"papermill": {"duration": 1.5}},
+                    },
+                    {
+                        "cell_type": "code",
+                        "source": "",
+                        "metadata": {"papermill": {"duration": None}},
+                    },
+                ]
+            },
+            outfile,
+        )
+    assert cell_durations(path) == [
+        {"cell": 1, "first_line": "import pandas as pd", "wall_seconds": 1.5},
+        {"cell": 2, "first_line": "", "wall_seconds": None},
+    ]
+
+
+def _profile(stage, wall_seconds, cell_seconds=(), max_rss_mb=100.0):
+    cells = tuple(
+        {"cell": index, "first_line": f"x = {index}", "wall_seconds": seconds}
+        for index, seconds in enumerate(cell_seconds)
+    )
+    return StageProfile(stage, wall_seconds, wall_seconds, max_rss_mb, cells)
+
+
+def test_write_and_compare_reports(tmp_path):
+    old = [
+        _profile("src/a.ipynb", 100.0, [10.0, 0.1, 90.0]),
+        _profile("src/b.R", 50.0),
+        _profile("src/c.R", 1.0),
+    ]
+    path = write_report(old, tmp_path, jobs=1)
+    assert find_reports(tmp_path) == [path]
+    report = read_report(path)
+    assert report["jobs"] == 1
+
+    table = report_frame(report)
+    assert table.stage.tolist() == ["src/a.ipynb"] * 4 + ["src/b.R", "src/c.R"]
+    assert table.cell.isnull().tolist() == [True, False, False, False, True, True]
+    assert (path.with_suffix(".csv")).exists()
+
+    new = {
+        "stages": [
+            # A slower cell, a tiny cell that doubled and a faster one
+            _profile("src/a.ipynb", 100.0, [20.0, 0.2, 79.8])._asdict(),
+            # Twice the memory, in the same time
+            _profile("src/b.R", 50.0, max_rss_mb=200.0)._asdict(),
+            _profile("src/d.R", 1000.0)._asdict(),
+        ]
+    }
+    comparison = compare_reports(report, new, threshold=0.25, min_seconds=1.0)
+    regressions = comparison[comparison.is_regression]
+    assert regressions[["stage", "metric"]].values.tolist() == [
+        ["src/a.ipynb", "wall_seconds"],
+        ["src/b.R", "max_rss_mb"],
+    ]
+    assert regressions.cell.tolist()[0] == 0
+    assert regressions.cell.isnull().tolist() == [False, True]
+
+    # Stages in only one of the reports are listed, but are not regressions
+    only_one = comparison[comparison.stage.isin(["src/c.R", "src/d.R"])]
+    assert len(only_one) == 6 and not only_one.is_regression.any()
+
+    # With no minimum time, the tiny cell is flagged too
+    comparison = compare_reports(report, new, threshold=0.25, min_seconds=0.0)
+    assert comparison.is_regression.sum() == 3
@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from femsntl import readers
+from femsntl.readers import Schema, iter_file, read_file
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "MedicaidSystemID": ["00123", None, "04567", "00089"],
+            "call_date": ["2018-03-19", "2018-04-01", None, "2019-02-28"],
+            "num_calls": [1, 2, 3, 4],
+        }
+    )
+
+
+@pytest.fixture
+def schema() -> Schema:
+    return Schema(
+        dtype={"MedicaidSystemID": str, "num_calls": "float64"},
+        parse_dates=["call_date"],
+        usecols=["MedicaidSystemID", "call_date", "num_calls"],
+    )
+
+
+@pytest.fixture
+def cache_dir(tmp_path: Path, monkeypatch) -> Path:
+    monkeypatch.setattr(readers, "SHA_CACHE_PATH", tmp_path / "sha_cache.json")
+    return tmp_path / "cache"
+
+
+def test_read_csv(tmp_path: Path, df: pd.DataFrame, schema: Schema):
+    filename = tmp_path / "file.csv"
+    df.to_csv(filename, index=False)
+
+    # Missing values stay missing rather than becoming "nan"
+    result = read_file(filename)
+    assert result.MedicaidSystemID.tolist()[::2] == ["123.0", "4567.0"]
+    assert result.MedicaidSystemID.isna().tolist() == [False, True, False, False]
+
+    result = read_file(filename, schema=schema._replace(usecols=schema.usecols[:2]))
+    assert result.columns.tolist() == ["MedicaidSystemID", "call_date"]
+    assert result.MedicaidSystemID.tolist()[::2] == ["00123", "04567"]
+    assert result.call_date.dtype == "datetime64[ns]"
+
+    chunks = list(iter_file(filename, chunksize=3, schema=schema))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks), read_file(filename, schema=schema))
+
+
+def test_read_excel(tmp_path, df, schema, cache_dir, monkeypatch):
+    filename = tmp_path / "file.xlsx"
+    df.to_excel(filename, index=False)
+    csv_filename = tmp_path / "file.csv"
+    df.to_csv(csv_filename, index=False)
+
+    expected = read_file(csv_filename, schema=schema)
+    pd.testing.assert_frame_equal(
+        read_file(filename, schema=schema, cache_dir=None), expected
+    )
+
+    assert not cache_dir.exists()
+    pd.testing.assert_frame_equal(
+        read_file(filename, schema=schema, cache_dir=cache_dir), expected
+    )
+    assert len(list(cache_dir.glob("*.parquet"))) == 1
+
+    # Later reads come from the cache
+    monkeypatch.setattr(readers.pd, "read_excel", None)
+    pd.testing.assert_frame_equal(
+        read_file(filename, schema=schema, cache_dir=cache_dir), expected
+    )
+    chunks = iter_file(filename, 3, schema=schema, cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(pd.concat(chunks), expected)
+
+
+def test_read_excel_mixed_types(tmp_path: Path, cache_dir: Path):
+    filename = tmp_path / "file.xlsx"
+    pd.DataFrame({"MedicaidSystemID": [1, "A2", None]}).to_excel(filename, index=False)
+
+    first = read_file(filename, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob("*.pkl"))) == 1
+    assert first.MedicaidSystemID.tolist()[:2] == ["1", "A2"]
+    pd.testing.assert_frame_equal(read_file(filename, cache_dir=cache_dir), first)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from femsntl.repeatcalls import REPEAT_HORIZONS, find_repeat_calls
+from femsntl.windows import Horizon
+
+
+@pytest.fixture
+def calls() -> pd.DataFrame:
+    rng = np.random.RandomState(22)
+    num_calls = 400
+    df = pd.DataFrame(
+        {
+            "constructed_id": rng.randint(0, 60, size=num_calls),
+            "cleaned_numbers_CAD": rng.choice(
+                ["2025550100", "2025550101", "2025550102", None], size=num_calls
+            ),
+            "date_call": pd.Timestamp("2018-03-19")
+            + pd.to_timedelta(rng.randint(0, 120 * 24 * 60, size=num_calls), unit="m"),
+        },
+        index=rng.permutation(num_calls) + 1000,
+    )
+    df.loc[df.index[::37], "date_call"] = pd.NaT
+    # Calls at the same time
+    df.iloc[1] = df.iloc[0]
+    return df
+
+
+def _self_join(calls, key, horizons):
+    """ The repeats by joining each call to every call with the same key """
+    calls = calls.assign(call=np.arange(len(calls)))
+    pairs = calls.merge(calls, on=key, suffixes=("", "_other"))
+    pairs = pairs.loc[pairs.call != pairs.call_other]
+    # Calls at the same time are in the order of the table
+    is_after = (pairs.date_call_other > pairs.date_call) | (
+        (pairs.date_call_other == pairs.date_call) & (pairs.call_other > pairs.call)
+    )
+    after, before = pairs.loc[is_after], pairs.loc[~is_after]
+    grouped_after = after.groupby("call")
+    expected = pd.DataFrame(
+        {
+            "previous_call": before.groupby("call").date_call_other.max(),
+            "next_call": grouped_after.date_call_other.min(),
+        }
+    )
+    for horizon in horizons:
+        expected[f"num_calls_before_{horizon.name}"] = (
+            (before.date_call_other >= before.date_call - horizon.offset)
+            .groupby(before.call)
+            .sum()
+        )
+        expected[f"num_calls_within_{horizon.name}"] = (
+            (after.date_call_other <= after.date_call + horizon.offset)
+            .groupby(after.call)
+            .sum()
+        )
+    expected = expected.reindex(np.arange(len(calls)))
+    expected.index = calls.index
+    return expected
+
+
+@pytest.mark.parametrize("key", ["constructed_id", "cleaned_numbers_CAD"])
+def test_find_repeat_calls(calls, key):
+    horizons = REPEAT_HORIZONS + (Horizon("6_months", pd.DateOffset(months=6)),)
+    calls = calls.dropna()
+    repeats = find_repeat_calls(calls, key, horizons=horizons)
+    expected = _self_join(calls, key, horizons)
+
+    for column in expected.columns:
+        if column.startswith("num_calls"):
+            assert (repeats[column] == expected[column].fillna(0)).all(), column
+        else:
+            pd.testing.assert_series_equal(repeats[column], expected[column])
+
+    time_to_next = repeats.next_call - calls.date_call
+    pd.testing.assert_series_equal(
+        repeats.time_to_next_call, time_to_next, check_names=False
+    )
+    pd.testing.assert_series_equal(
+        repeats.time_to_next_call_72_hours,
+        time_to_next.where(repeats.num_calls_within_72_hours > 0),
+        check_names=False,
+    )
+
+
+def test_find_repeat_calls_missing(calls):
+    repeats = find_repeat_calls(calls, "cleaned_numbers_CAD")
+    assert repeats.index.equals(calls.index)
+
+    missing = calls.cleaned_numbers_CAD.isnull() | calls.date_call.isnull()
+    assert repeats.loc[missing, "next_call"].isnull().all()
+    assert (repeats.loc[missing, "num_calls_within_30_days"] == 0).all()
+    # Calls missing a key are not repeats of calls with one
+    complete = find_repeat_calls(calls.loc[~missing], "cleaned_numbers_CAD")
+    pd.testing.assert_frame_equal(repeats.loc[~missing], complete)
+
+    # Several columns make up a key
+    both = find_repeat_calls(calls, ["constructed_id", "cleaned_numbers_CAD"])
+    assert (both.num_calls_within_30_days <= repeats.num_calls_within_30_days).all()
@@ -0,0 +1,244 @@
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from femsntl.cli import cli
+from femsntl.safetypad import (
+    DEMOGRAPHIC_GROUPS,
+    DISPOSITION_FIELDS,
+    IDENTIFIER_FIELDS,
+    SafetyPadClient,
+    SafetyPadError,
+    TokenBucket,
+    extract_pcrs,
+    iter_pulled_pcrs,
+    pull_pcrs,
+    read_manifest,
+)
+
+RESPONSE = """<safetypadapiresponse>
+<status>{status}</status>
+<message><pcrs><pcr>
+<eCase.01m>{pcr_id}</eCase.01m><ePatient.02>DOE</ePatient.02><ePatient.03 />
+</pcr></pcrs></message>
+</safetypadapiresponse>"""
+
+# PCRs the stand-in server fails on: once with a 503, or always
+FLAKY_PCR = 3
+BAD_PCR = 5
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        pcr_id = int(params["v1"][0])
+        self.server.hits[pcr_id] += 1
+        if pcr_id == FLAKY_PCR and self.server.hits[pcr_id] == 1:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        status = "FAILURE" if pcr_id == BAD_PCR else "SUCCESS"
+        body = RESPONSE.format(status=status, pcr_id=pcr_id).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.hits = Counter()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server) -> SafetyPadClient:
+    return SafetyPadClient(
+        "KEY",
+        base_url=f"http://127.0.0.1:{server.server_port}/api/",
+        rate=1000,
+        burst=10,
+        backoff=0.01,
+    )
+
+
+def test_token_bucket():
+    now = [0.0]
+    sleeps = []
+
+    def _sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=_sleep)
+    for _ in range(6):
+        bucket.acquire()
+    # Two tokens up front, then one every half second
+    assert now[0] == pytest.approx(2.0)
+    assert sleeps == pytest.approx([0.5] * 4)
+
+
+def test_view_pcr(client: SafetyPadClient, server):
+    result = client.view_pcr(1)
+    assert [field["tag"] for field in result["parsed"]] == [
+        "eCase.01m",
+        "ePatient.02",
+        "ePatient.03",
+    ]
+    assert result["parsed"][1]["text"] == "DOE"
+    assert result["parsed"][2]["text"] == "None"
+
+    # Retried after the 503
+    assert client.view_pcr(FLAKY_PCR)["parsed"][0]["text"] == str(FLAKY_PCR)
+    assert server.hits[FLAKY_PCR] == 2
+
+    with pytest.raises(SafetyPadError):
+        client.view_pcr(BAD_PCR)
+
+
+def test_pull_pcrs_resumes(client: SafetyPadClient, server, tmp_path: Path):
+    manifest = tmp_path / "pcrs.jsonl"
+    summary = pull_pcrs(client, [1, 2, FLAKY_PCR, BAD_PCR], manifest, jobs=3)
+    assert summary.skipped == 0 and summary.pulled == 3
+    assert summary.failed == [BAD_PCR]
+
+    # An interrupted write at the end of the manifest is ignored
+    with open(manifest, "at") as outfile:
+        outfile.write('{"pcr_id": 6, "sta')
+
+    summary = pull_pcrs(client, range(1, 8), manifest, jobs=3)
+    assert summary.skipped == 3 and summary.pulled == 3
+    assert summary.failed == [BAD_PCR]
+    assert server.hits[1] == 1 and server.hits[BAD_PCR] == 2
+
+    entries = [entry for entry in read_manifest(manifest) if entry["status"] == "ok"]
+    assert sorted(entry["pcr_id"] for entry in entries) == [1, 2, 3, 4, 6, 7]
+
+
+def test_pull_command(server, tmp_path: Path):
+    pcr_file = tmp_path / "pcrs.csv"
+    pcr_file.write_text("pcr_id\n1\n2\n2\nnot a pcr\n")
+    manifest = tmp_path / "pcrs.jsonl"
+    args = ["safetypad", "pull", "-p", str(pcr_file), "-m", str(manifest)]
+    args += ["--base-url", f"http://127.0.0.1:{server.server_port}/api/"]
+    args += ["--rate", "1000"]
+
+    runner = CliRunner()
+    result = runner.invoke(cli, args, env={"SAFETYPAD_API_KEY": "KEY"})
+    assert result.exit_code == 0, result.output
+    assert server.hits == {1: 1, 2: 1}
+
+    pcr_file.write_text(f"{BAD_PCR}\n")
+    result = runner.invoke(cli, args, env={"SAFETYPAD_API_KEY": "KEY"})
+    assert result.exit_code == 1
+    assert json.loads(result.output[result.output.index("{") :])["failed"] == [BAD_PCR]
+
+
+def _parsed(pcr_id, last_name):
+    return [
+        {"tag": "eCase.01m", "attributes": {}, "text": str(pcr_id)},
+        {"tag": "ePatient.02", "attributes": {}, "text": last_name},
+        {"tag": "ePatient.21", "attributes": {}, "text": "None"},
+        {"tag": "eDisposition.12", "attributes": {}, "text": "Treated"},
+    ]
+
+
+@pytest.fixture
+def pulls(tmp_path: Path):
+    names = ["DOE", "ROE", 'Smith, "Jr" [x]']
+    pulled = [{"raw": "", "parsed": _parsed(i, name)} for i, name in enumerate(names)]
+
+    array = tmp_path / "final.json"
+    array.write_text(json.dumps(pulled, indent=1))
+
+    manifest = tmp_path / "pulled_pcrs.jsonl"
+    with open(manifest, "wt") as outfile:
+        for i, datum in enumerate(pulled):
+            outfile.write(json.dumps({"pcr_id": i, "status": "ok", **datum}) + "\n")
+        outfile.write(json.dumps({"pcr_id": 9, "status": "failed", "error": "x"}))
+
+    xml = tmp_path / "pcrs.xml"
+    xml.write_text(
+        "<pcrs>"
+        + "".join(
+            f"<pcr><eCase.01m>{i}</eCase.01m><ePatient.02>{name}</ePatient.02>"
+            "<eDisposition.12>Treated</eDisposition.12></pcr>"
+            for i, name in enumerate(["DOE", "ROE", "Smith, &quot;Jr&quot; [x]"])
+        )
+        + "</pcrs>"
+    )
+    return [array, manifest, xml]
+
+
+def test_iter_pulled_pcrs(pulls):
+    for pull in pulls:
+        pcrs = list(iter_pulled_pcrs(pull))
+        assert [pcr["eCase.01m"] for pcr in pcrs] == ["0", "1", "2"]
+        assert pcrs[2]["ePatient.02"] == 'Smith, "Jr" [x]'
+        assert pcrs[0].get("ePatient.21") is None
+
+
+def test_iter_pulled_pcrs_in_small_chunks(pulls, monkeypatch):
+    from femsntl import safetypad
+
+    expected = list(iter_pulled_pcrs(pulls[0]))
+    original = safetypad._iter_json_array
+    monkeypatch.setattr(
+        safetypad,
+        "_iter_json_array",
+        lambda infile: original(infile, chunk_size=7),
+    )
+    assert list(iter_pulled_pcrs(pulls[0])) == expected
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".csv"])
+def test_extract_pcrs(pulls, tmp_path: Path, suffix):
+    for pull in pulls:
+        output = tmp_path / f"demographic_data{suffix}"
+        assert extract_pcrs(pull, output, batch_size=2) == 3
+        if suffix == ".csv":
+            df = pd.read_csv(output, dtype=str)
+        else:
+            df = pd.read_parquet(output)
+
+        columns = [col for group in DEMOGRAPHIC_GROUPS for col in group.columns]
+        assert list(df.columns) == columns
+        assert df.pcr_id.tolist() == ["0", "1", "2"]
+        assert df.last_name.tolist() == ["DOE", "ROE", 'Smith, "Jr" [x]']
+        assert df.drivers_license_number.isnull().all()
+
+
+def test_extract_pcrs_groups(pulls, tmp_path: Path):
+    output = tmp_path / "dispositions.parquet"
+    extract_pcrs(pulls[1], output, groups=(IDENTIFIER_FIELDS, DISPOSITION_FIELDS))
+    df = pd.read_parquet(output)
+    assert list(df.columns) == [
+        "pcr_id",
+        "fems_id",
+        "destination_name",
+        "incident_disposition",
+    ]
+    assert (df.incident_disposition == "Treated").all()
+
+    # No PCRs still gives a table with every column
+    empty = pulls[1].with_name("empty.jsonl")
+    empty.write_text("")
+    assert extract_pcrs(empty, output.with_suffix(".csv")) == 0
+    assert len(pd.read_csv(output.with_suffix(".csv")).columns) == 26
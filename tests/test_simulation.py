@@ -0,0 +1,119 @@
+import heapq
+from collections import deque
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from femsntl.simulation import assign_slots, sweep
+
+
+def _dropped_timestamps(timestamps, delta=timedelta(minutes=10), num_slots=6):
+    """ The original simulation in 100_dropped_calls.ipynb """
+    timestamps = sorted(timestamps)
+
+    on_call = deque([])
+    nurse_idx = []
+
+    for i, next_call in enumerate(timestamps):
+        while on_call and on_call[0] < next_call:
+            on_call.popleft()
+
+        if len(on_call) < num_slots:
+            nurse_idx.append((i, next_call, len(on_call)))
+            on_call.append(next_call + delta)
+        else:
+            nurse_idx.append((i, next_call, num_slots))
+    return nurse_idx
+
+
+def _heap_slots(timestamps, durations, num_slots):
+    """ The same simulation for calls of different lengths, in the original order """
+    slots = np.empty(len(timestamps), dtype=int)
+    on_call = []
+    for i in np.argsort(timestamps.values, kind="stable"):
+        next_call = timestamps.iloc[i]
+        while on_call and on_call[0] < next_call:
+            heapq.heappop(on_call)
+        if len(on_call) < num_slots:
+            slots[i] = len(on_call)
+            heapq.heappush(on_call, next_call + pd.Timedelta(minutes=durations[i]))
+        else:
+            slots[i] = num_slots
+    return slots
+
+
+@pytest.fixture
+def timestamps():
+    rng = np.random.RandomState(25)
+    # A busy month, rounded to the minute so that some calls arrive together
+    minutes = rng.uniform(0, 31 * 24 * 60, size=3000).round()
+    return pd.Series(pd.Timestamp("2016-01-01") + pd.to_timedelta(minutes, unit="m"))
+
+
+@pytest.mark.parametrize("num_slots", [1, 2, 4, 6])
+@pytest.mark.parametrize("minutes", [10, 12.5, 60])
+def test_assign_slots_matches_original(timestamps, minutes, num_slots):
+    slots = assign_slots(timestamps, minutes, num_slots)
+    expected = _dropped_timestamps(
+        timestamps, delta=timedelta(minutes=minutes), num_slots=num_slots
+    )
+    order = np.argsort(timestamps.values, kind="stable")
+    assert slots[order].tolist() == [slot for _, _, slot in expected]
+
+
+@pytest.mark.parametrize("num_slots", [1, 3, 5])
+def test_assign_slots_random_durations(timestamps, num_slots):
+    durations = np.random.RandomState(0).exponential(15, size=len(timestamps))
+    slots = assign_slots(timestamps, durations, num_slots)
+    assert slots.tolist() == _heap_slots(timestamps, durations, num_slots).tolist()
+
+
+def test_sweep(timestamps):
+    result = sweep(timestamps, duration_minutes=[10, 15], num_slots=[2, 4], jobs=1)
+    assert len(result.by_hour) == 2 * 2 * 24
+
+    for (minutes, num_slots), by_slot in result.by_slot.groupby(
+        ["duration_minutes", "num_slots"]
+    ):
+        slots = assign_slots(timestamps, minutes, num_slots)
+        assert by_slot.num_calls.tolist() == np.bincount(slots).tolist()
+
+        by_week = result.by_week[
+            (result.by_week.duration_minutes == minutes)
+            & (result.by_week.num_slots == num_slots)
+        ]
+        expected = (
+            pd.Series(slots >= num_slots, index=timestamps)
+            .groupby(pd.Grouper(freq="W"))
+            .agg(["size", "sum"])
+        )
+        assert by_week.week.tolist() == expected.index.tolist()
+        assert by_week.num_calls.tolist() == expected["size"].tolist()
+        assert by_week.num_dropped.tolist() == expected["sum"].tolist()
+
+    # More nurses never drop more calls
+    totals = result.by_hour.groupby(["duration_minutes", "num_slots"]).sum()
+    assert (
+        totals.num_dropped.xs(4, level="num_slots")
+        <= totals.num_dropped.xs(2, level="num_slots")
+    ).all()
+
+
+def test_sweep_random_durations_are_reproducible(timestamps):
+    kwargs = dict(
+        duration_minutes=[10, 15],
+        num_slots=[2, 4],
+        random_durations=True,
+        num_draws=3,
+        seed=7,
+    )
+    serial = sweep(timestamps, jobs=1, **kwargs)
+    parallel = sweep(timestamps, jobs=2, **kwargs)
+    for name in serial._fields:
+        pd.testing.assert_frame_equal(getattr(serial, name), getattr(parallel, name))
+
+    assert sorted(serial.by_slot.draw.unique()) == [0, 1, 2]
+    other_seed = sweep(timestamps, jobs=1, **{**kwargs, "seed": 8})
+    assert not serial.by_slot.equals(other_seed.by_slot)
@@ -0,0 +1,213 @@
+import json
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from femsntl import cli
+from femsntl.cli import _find_stage_files
+from femsntl.stages import (
+    MostRecent,
+    RunLedger,
+    Stage,
+    fingerprint,
+    get_stage,
+    specs_overlap,
+    stage_dependencies,
+)
+
+
+def _write_notebook(path, source, outputs=()):
+    with open(path, "wt") as outfile:
+        json.dump(
+            {
+                "cells": [
+                    {
+                        "cell_type": "code",
+                        "source": [source],
+                        "outputs": list(outputs),
+                        "metadata": {},
+                    }
+                ]
+            },
+            outfile,
+        )
+
+
+def test_every_stage_is_in_the_manifest():
+    for filename, _ in _find_stage_files(None):
+        assert get_stage(filename) is not None, filename
+
+
+def test_fingerprint(tmp_path):
+    notebook = tmp_path / "stage.ipynb"
+    _write_notebook(notebook, "print(1)")
+    data = tmp_path / "data.csv"
+    data.write_text("a,b\n1,2\n")
+    stage = Stage(notebook, step="1", inputs=(data, MostRecent("versioned", tmp_path)))
+
+    original = fingerprint(stage)
+    assert fingerprint(stage) == original
+
+    # Outputs saved in the notebook do not matter, its source does
+    _write_notebook(notebook, "print(1)", outputs=[{"text": "1"}])
+    assert fingerprint(stage) == original
+    _write_notebook(notebook, "print(2)")
+    changed_source = fingerprint(stage)
+    assert changed_source != original
+
+    data.write_text("a,b\n1,3\n")
+    changed_data = fingerprint(stage)
+    assert changed_data != changed_source
+
+    # A new version of a versioned file only matters if its contents differ
+    (tmp_path / "versioned_01.csv").write_text("x\n")
+    first_version = fingerprint(stage)
+    assert first_version != changed_data
+    (tmp_path / "versioned_02.csv").write_text("x\n")
+    assert fingerprint(stage) == first_version
+    (tmp_path / "versioned_03.csv").write_text("y\n")
+    assert fingerprint(stage) != first_version
+
+
+def test_run_ledger(tmp_path):
+    script = tmp_path / "stage.R"
+    script.write_text("1 + 1\n")
+    output = tmp_path / "output.csv"
+    stage = Stage(script, step="4", outputs=(output,))
+    stage_fingerprint = fingerprint(stage)
+
+    ledger = RunLedger(tmp_path / "ledger.yml")
+    assert not ledger.is_current(stage, stage_fingerprint)
+
+    output.write_text("done\n")
+    ledger.record(stage, stage_fingerprint)
+    ledger = RunLedger(tmp_path / "ledger.yml")
+    assert ledger.is_current(stage, stage_fingerprint)
+    assert not ledger.is_current(stage, "0" * 64)
+
+    output.unlink()
+    assert not ledger.is_current(stage, stage_fingerprint)
+
+
+def test_specs_overlap(tmp_path):
+    assert specs_overlap(tmp_path / "a.csv", tmp_path / "a.csv")
+    assert not specs_overlap(tmp_path / "a.csv", tmp_path / "b.csv")
+    assert specs_overlap(tmp_path / "batch*.csv", tmp_path / "batch1.csv")
+    assert specs_overlap(MostRecent("ids", tmp_path), tmp_path / "ids_01.csv")
+    assert specs_overlap(MostRecent("ids", tmp_path), MostRecent("ids", tmp_path))
+    assert not specs_overlap(MostRecent("ids", tmp_path), tmp_path / "other.csv")
+
+
+def test_stage_dependencies(tmp_path):
+    raw, intermediate, final = (tmp_path / name for name in ("a", "b", "c"))
+    stages = [
+        Stage(tmp_path / "1.R", step="4", inputs=(raw,), outputs=(intermediate,)),
+        Stage(tmp_path / "2.R", step="4", inputs=(raw,)),
+        Stage(tmp_path / "3.R", step="4", inputs=(intermediate,), outputs=(final,)),
+        # Overwrites what the first stage reads, so has to wait for it
+        Stage(tmp_path / "4.R", step="4", outputs=(raw,)),
+        None,
+        Stage(tmp_path / "6.R", step="4"),
+    ]
+    assert stage_dependencies(stages) == [
+        set(),
+        set(),
+        {0},
+        {0, 1},
+        {0, 1, 2, 3},
+        {4},
+    ]
+
+
+def _fake_execute_stage(filename: Path, output_dir: Path, log_path: Path = None):
+    """ Each fake stage script lists the files it needs and the files it writes """
+    needs, writes = filename.read_text().split("|")
+    for path in needs.split():
+        if not Path(path).exists():
+            raise RuntimeError(f"{path} does not exist yet")
+    for path in writes.split():
+        Path(path).write_text(filename.name)
+
+
+@pytest.fixture
+def fake_stages(tmp_path, monkeypatch):
+    a, b, c = (tmp_path / name for name in ("a.csv", "b.csv", "c.csv"))
+    scripts = {
+        "1.R": ("", a),
+        "2.R": (a, b),
+        "3.R": ("", c),
+    }
+    stages = {}
+    for name, (needs, writes) in scripts.items():
+        path = tmp_path / name
+        path.write_text(f"{needs}|{writes}")
+        stages[path] = Stage(
+            path, step="4", inputs=(Path(needs),) if needs else (), outputs=(writes,)
+        )
+
+    ledger_path = tmp_path / "ledger.yml"
+    monkeypatch.setattr(cli, "_execute_stage", _fake_execute_stage)
+    monkeypatch.setattr(
+        cli, "_find_stage_files", lambda step: [(path, tmp_path) for path in stages]
+    )
+    monkeypatch.setattr(cli, "get_stage", stages.get)
+    monkeypatch.setattr(cli, "RunLedger", lambda: RunLedger(ledger_path))
+    return stages
+
+
+@pytest.mark.parametrize("jobs", ["1", "3"])
+def test_run_all_skips_unchanged_stages(fake_stages, jobs):
+    runner = CliRunner()
+    result = runner.invoke(cli.cli, ["run-all", "--jobs", jobs])
+    assert result.exit_code == 0, result.output
+    assert result.output.count("Running") == 3
+
+    result = runner.invoke(cli.cli, ["run-all", "--jobs", jobs])
+    assert result.exit_code == 0, result.output
+    assert result.output.count("Skipping") == 3
+
+    first, second, _ = fake_stages
+    first.write_text(first.read_text() + " ")
+    result = runner.invoke(cli.cli, ["run-all", "--dry-run"])
+    assert result.output.count("Would run") == 2
+    assert result.output.count("Skipping") == 1
+
+    result = runner.invoke(cli.cli, ["run-all", "--jobs", jobs])
+    assert result.exit_code == 0, result.output
+    # The second stage's input was rewritten with the same contents
+    assert result.output.count("Running") == 1
+
+
+def test_run_all_fails_fast(fake_stages):
+    _, second, _ = fake_stages
+    second.write_text("missing.csv|")
+    result = CliRunner().invoke(cli.cli, ["run-all", "--jobs", "2"])
+    assert result.exit_code != 0
+    assert "2.R failed" in result.output
+    assert "Finished" in result.output
+
+
+def test_run_all_profile(fake_stages, tmp_path, monkeypatch):
+    profile_dir = tmp_path / "profiles"
+    monkeypatch.setattr(cli, "PROFILE_DIR", profile_dir)
+    runner = CliRunner()
+    for jobs in ["1", "2"]:
+        result = runner.invoke(cli.cli, ["run-all", "--force", "--profile", "-j", jobs])
+        assert result.exit_code == 0, result.output
+        assert "Wrote the profile" in result.output
+
+    old, new = sorted(profile_dir.glob("*.json"))
+    with open(new, "rt") as infile:
+        report = json.load(infile)
+    assert report["complete"] and report["jobs"] == 2
+    assert sorted(stage["stage"] for stage in report["stages"]) == [
+        str(path) for path in fake_stages
+    ]
+    assert all(stage["wall_seconds"] > 0 for stage in report["stages"])
+
+    result = runner.invoke(
+        cli.cli, ["profile", "compare", str(old), str(new), "--min-seconds", "10"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "No regressions" in result.output
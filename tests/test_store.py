@@ -0,0 +1,59 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from femsntl import store
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "MedicaidSystemID": ["00123", None, "04567", "00089"] * 5,
+            "call_date": pd.to_datetime(
+                ["2018-03-19", "2018-04-01 12:30:00", None, "2019-02-28"] * 5
+            ),
+            "treatment": pd.Categorical(["control", "treatment"] * 10),
+            "num_calls": np.arange(20),
+        }
+    )
+
+
+def test_round_trip(tmp_path: Path, df: pd.DataFrame):
+    path = store.write("ntl_calls", df, base_dir=tmp_path, row_group_size=5)
+    assert path == tmp_path / "ntl_calls.parquet"
+    assert pq.ParquetFile(path).num_row_groups == 4
+
+    pd.testing.assert_frame_equal(store.read("ntl_calls", base_dir=tmp_path), df)
+
+    result = store.read(
+        "ntl_calls",
+        columns=["MedicaidSystemID", "num_calls"],
+        filters=[("num_calls", ">=", 15), ("MedicaidSystemID", "!=", "00089")],
+        base_dir=tmp_path,
+    )
+    assert result.columns.tolist() == ["MedicaidSystemID", "num_calls"]
+    # As in SQL, missing values never match a comparison
+    assert result.num_calls.tolist() == [16, 18]
+    assert result.MedicaidSystemID.tolist() == ["00123", "04567"]
+
+
+def test_versioned(tmp_path: Path, df: pd.DataFrame):
+    with pytest.raises(ValueError):
+        store.read("ntl_calls", base_dir=tmp_path)
+
+    path = store.write("ntl_calls", df, versioned=True, base_dir=tmp_path)
+    assert path.name.startswith("ntl_calls_20")
+    store.write("ntl_calls_2000-01-01-00-00-00", df.head(1), base_dir=tmp_path)
+    # Other objects sharing the prefix are not versions, even those that sort
+    # after it or are versioned themselves
+    store.write("ntl_callsigns", df.head(2), base_dir=tmp_path)
+    store.write("ntl_calls_backup", df.head(2), versioned=True, base_dir=tmp_path)
+    store.write("ntl_calls_2099-1-1-0-0-0", df.head(2), base_dir=tmp_path)
+    store.write("ntl_calls_2099-01-01-00-00-00_old", df.head(2), base_dir=tmp_path)
+
+    assert store.path_for("ntl_calls", base_dir=tmp_path) == path
+    assert len(store.read("ntl_calls", base_dir=tmp_path)) == len(df)
@@ -0,0 +1,98 @@
+import json
+
+import pandas as pd
+import pytest
+import yaml
+from click.testing import CliRunner
+
+from femsntl.cli import cli
+from femsntl.datafiles import DATA_DIR
+from femsntl.synth import CLAIM_LINE_KEY, OPEN_END_DATE, synthesize
+
+CLAIMS_FILE = "private_data/claimsdata_2018031920190301.csv"
+ADDITIONAL_FIELDS_FILE = (
+    "private_data/ClaimsDataWithAdditionalFields20170901_To_20190930.csv"
+)
+
+
+@pytest.fixture(scope="module")
+def synthetic(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("synthetic_data")
+    written = synthesize(data_dir, scale=0.05, seed=1, public_data_dir=None)
+    return data_dir, written
+
+
+def test_synthesize_writes_the_private_inputs(synthetic):
+    data_dir, written = synthetic
+    with open(DATA_DIR / "inventory.yml", "rt") as infile:
+        inventory = yaml.safe_load(infile)
+    private = {
+        file_obj["path"]
+        for file_obj in inventory["files"]
+        if file_obj["path"].startswith("private_data/")
+    }
+    assert set(written) == private
+    assert all((data_dir / path).exists() for path in private)
+    assert (data_dir / "intermediate_objects").is_dir()
+
+
+def test_synthesize_is_messy(synthetic):
+    data_dir, _ = synthetic
+    private_dir = data_dir / "private_data"
+
+    cad = pd.read_pickle(private_dir / "ntl_summary_raw.pkl")
+    assert cad.clname.str.contains(r"DOB \d+/\d+/\d+", na=False).any()
+    assert cad.clrnum.isin(["1111111111", "NOPHONE", "TESTCALL"]).any()
+    assert cad.clrnum.str.contains("-", na=False).any()
+
+    amr = pd.read_excel(private_dir / "amr_df.xlsx")
+    assert {type(dob) for dob in amr.DateofBirth.dropna()} > {str}
+    ids = pd.read_excel(private_dir / "dc_fems_medicaidids.xlsx", skiprows=2)
+    assert "Personal ID Number" in ids.columns
+
+    spells = pd.read_excel(private_dir / "MedicaidEnrollmentForNTLMembersList.xlsx")
+    assert (spells.EnrollmentEndDate == OPEN_END_DATE).any()
+
+    claims = pd.read_csv(data_dir / CLAIMS_FILE)
+    assert claims.groupby("ClaimTCNText").size().max() > 1
+    assert claims.MemberDateofBirth.str.match(r"\d{2}[A-Z]{3}\d{4}:00:00:00$").all()
+    assert claims.RevenueCode.isnull().any() and claims.RevenueCode.notnull().any()
+
+
+def test_synthesize_is_seeded(synthetic, tmp_path):
+    data_dir, written = synthetic
+    # Chunking changes which draws the claims get, but not the other files
+    again = synthesize(
+        tmp_path, scale=0.05, seed=1, chunk_size=50, public_data_dir=None
+    )
+    claims_files = (CLAIMS_FILE, ADDITIONAL_FIELDS_FILE)
+    assert {path: again[path] for path in written if path not in claims_files} == {
+        path: rows for path, rows in written.items() if path not in claims_files
+    }
+    for path in (
+        "private_data/ntl_data_tableau.csv",
+        "private_data/dem_fromsafetyPAD.csv",
+    ):
+        assert (tmp_path / path).read_bytes() == (data_dir / path).read_bytes()
+
+    claims = pd.read_csv(tmp_path / CLAIMS_FILE)
+    additional = pd.read_csv(tmp_path / ADDITIONAL_FIELDS_FILE)
+    assert len(claims) == again[CLAIMS_FILE] == len(additional)
+    assert not claims.duplicated(list(CLAIM_LINE_KEY)).any()
+    assert len(claims.merge(additional, on=list(CLAIM_LINE_KEY))) == len(claims)
+
+    other = synthesize(tmp_path / "other", scale=0.05, seed=2, public_data_dir=None)
+    assert other != written
+
+
+def test_synth_command(tmp_path):
+    runner = CliRunner()
+    data_dir = tmp_path / "synthetic_data"
+    result = runner.invoke(cli, ["synth", "-s", "0.01", "-d", str(data_dir)])
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output)[CLAIMS_FILE] > 0
+
+    # A tree with an inventory is taken for the real data and left alone
+    (data_dir / "inventory.yml").write_text("files: []\n")
+    result = runner.invoke(cli, ["synth", "-d", str(data_dir)])
+    assert result.exit_code != 0 and "real data" in result.output
@@ -6,14 +6,22 @@ import pandas as pd
 import pytest
 
 from femsntl.utils import (
+    clean_address,
+    clean_addresses,
     clean_amr_names,
+    clean_amr_names_series,
     clean_column_names,
+    clean_phone_number,
+    clean_phone_numbers,
     compute_sha,
     extract_DOB_fromname,
+    extract_DOB_fromname_series,
     get_mostrec,
     process_safetypad_names,
     standardize_month,
+    standardize_month_series,
     standardize_year,
+    standardize_year_series,
 )
 
 
@@ -73,6 +81,56 @@ def test_standardize_month():
     assert standardize_month("101") is None
 
 
+def test_clean_phone_number():
+    assert clean_phone_number("202-555 12.34") == "2025551234"
+    assert clean_phone_number("NOPHONE") is None
+    assert clean_phone_number("111-111-1111") is None
+    assert clean_phone_number(None) is None
+
+
+def test_clean_address():
+    assert clean_address("123  main st.  washington dc") == "123 MAIN ST"
+    assert clean_address("1 A ST WASHINGTON") == "1 A ST"
+    assert clean_address(np.nan) == ""
+
+
+@pytest.mark.parametrize(
+    "scalar_func,series_func,values",
+    [
+        (
+            extract_DOB_fromname,
+            extract_DOB_fromname_series,
+            ["foo 33 bar / 30/10 ///", "kevin", None, np.nan, ""],
+        ),
+        (
+            lambda name: clean_amr_names(name, ["UNK"]),
+            lambda names: clean_amr_names_series(names, ["UNK"]),
+            ["KEVIN   UNK 1/1/92 WILSON", "kevin", None, pd.NA, "unk"],
+        ),
+        (
+            clean_amr_names,
+            clean_amr_names_series,
+            ["KEVIN UNK 1/1/92     WILSON", "o'neil, mary", None],
+        ),
+        (standardize_year, standardize_year_series, ["20", "1", "2020", "None", None]),
+        (standardize_month, standardize_month_series, ["1", "10", "101", "", None]),
+        (
+            clean_phone_number,
+            clean_phone_numbers,
+            ["202-555-1234", "RADIO", 2025551234.0, 2025551234, None],
+        ),
+        (clean_address, clean_addresses, ["1 A St. Washington DC", 5, None]),
+    ],
+)
+def test_series_cleaners_match_scalar(scalar_func, series_func, values):
+    series = pd.Series(values * 2, index=np.arange(2 * len(values))[::-1], name="x")
+    actual = series_func(series)
+
+    assert actual.index.equals(series.index)
+    assert actual.name == "x"
+    assert actual.tolist() == [scalar_func(value) for value in series]
+
+
 def test_get_mostrec():
     with tempfile.TemporaryDirectory() as tmpdir:
         tempdir = Path(tmpdir)
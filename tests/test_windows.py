@@ -0,0 +1,257 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from femsntl.windows import (
+    OPEN_END_DATE,
+    POST_CALL_HORIZONS,
+    Horizon,
+    assign_windows,
+    enrollment_exposure,
+    merge_spells,
+)
+
+
+@pytest.fixture
+def calls_and_claims():
+    rng = np.random.RandomState(61)
+    ids = [f"{i:09d}" for i in range(50)]
+    calls = pd.DataFrame(
+        {
+            "MedicaidSystemID": rng.choice(ids[:40], size=80),
+            "call_date": pd.Timestamp("2018-03-19")
+            + pd.to_timedelta(rng.randint(0, 365 * 24, size=80), unit="h"),
+        }
+    )
+    claims = pd.DataFrame(
+        {
+            "MedicaidSystemID": rng.choice(ids, size=2000),
+            "FirstServiceCalendarDate_dt": pd.Timestamp("2017-06-01")
+            + pd.to_timedelta(rng.randint(0, 900, size=2000), unit="D"),
+        }
+    )
+    claims.loc[::97, "FirstServiceCalendarDate_dt"] = pd.NaT
+    # A claim on a month end, where calendar months and fixed lengths differ
+    claims.loc[2000] = [calls.MedicaidSystemID[0], pd.Timestamp("2018-08-31")]
+    return calls, claims
+
+
+def _full_join_windows(calls, claims, relative_to):
+    """ The windows as 061_subset_medclaims_outcomeswindow.R computes them """
+    calls = calls.assign(call_date=calls.call_date.dt.normalize())
+    if relative_to == "first":
+        calls = calls.groupby("MedicaidSystemID", as_index=False).call_date.min()
+    joined = claims.reset_index().merge(calls, on="MedicaidSystemID", how="left")
+    service = joined.FirstServiceCalendarDate_dt
+    if relative_to == "any":
+        # The latest call on or before the claim, or else the first call
+        joined["after"] = service >= joined.call_date
+        joined = joined.sort_values(["index", "after", "call_date"]).drop_duplicates(
+            "index", keep="last"
+        )
+        joined = joined.set_index("index").loc[claims.index]
+        joined["call_date"] = joined.call_date.where(
+            joined.after,
+            calls.groupby("MedicaidSystemID")
+            .call_date.min()
+            .reindex(joined.MedicaidSystemID)
+            .values,
+        )
+        service = joined.FirstServiceCalendarDate_dt
+    else:
+        joined = joined.set_index("index")
+
+    call_date = joined.call_date
+    is_after = service >= call_date
+    within_24_hours = is_after & (service <= call_date + pd.DateOffset(days=1))
+    return pd.DataFrame(
+        {
+            "call_date": call_date.where(service.notna()),
+            "is_within_6_months_before_call": ~is_after
+            & (service >= call_date - pd.DateOffset(months=6)),
+            "is_within_24_hours": within_24_hours,
+            "is_within_6_months": is_after
+            & ~within_24_hours
+            & (service <= call_date + pd.DateOffset(months=6)),
+        },
+        index=claims.index,
+    )
+
+
+@pytest.mark.parametrize("relative_to", ["first", "any"])
+def test_assign_windows(calls_and_claims, relative_to):
+    calls, claims = calls_and_claims
+    windows = assign_windows(calls, claims, relative_to=relative_to)
+    expected = _full_join_windows(calls, claims, relative_to)
+
+    assert windows.index.equals(claims.index)
+    pd.testing.assert_series_equal(
+        windows.call_date, expected.call_date, check_names=False
+    )
+    for column in expected.columns[1:]:
+        assert (windows[column] == expected[column].fillna(False)).all(), column
+
+    # Claims of people who never called are in no window
+    no_call = ~claims.MedicaidSystemID.isin(calls.MedicaidSystemID)
+    assert windows.window[no_call].isnull().all()
+    assert (
+        windows.window[~no_call & claims.FirstServiceCalendarDate_dt.notna()]
+        .notnull()
+        .all()
+    )
+
+
+def test_assign_windows_new_horizon():
+    calls = pd.DataFrame(
+        {"MedicaidSystemID": ["a"], "call_date": [pd.Timestamp("2018-08-31 13:00")]}
+    )
+    claims = pd.DataFrame(
+        {
+            "MedicaidSystemID": ["a"] * 7,
+            "FirstServiceCalendarDate_dt": pd.to_datetime(
+                [
+                    "2018-02-27",
+                    "2018-02-28",
+                    "2018-08-31",
+                    "2018-09-01",
+                    "2018-09-30",
+                    "2019-02-28",
+                    "2019-03-01",
+                ]
+            ),
+        }
+    )
+    horizons = (
+        POST_CALL_HORIZONS[:1]
+        + (Horizon("30_days", pd.DateOffset(days=30)),)
+        + POST_CALL_HORIZONS[1:]
+    )
+    windows = assign_windows(calls, claims, post_horizons=horizons)
+    assert windows.window.tolist() == [
+        "before",
+        "6_months_before_call",
+        "24_hours",
+        "24_hours",
+        "30_days",
+        "6_months",
+        "after",
+    ]
+    assert windows.is_within_30_days.sum() == 1
+
+    with pytest.raises(ValueError):
+        assign_windows(calls, claims, post_horizons=horizons[::-1])
+
+
+@pytest.fixture
+def spells_and_calls():
+    """ One call per beneficiary and spells that do not overlap, as 061 assumes """
+    rng = np.random.RandomState(15)
+    rows = []
+    for i in range(60):
+        start = pd.Timestamp("2015-01-01") + pd.Timedelta(days=int(rng.randint(0, 400)))
+        for _ in range(rng.randint(1, 5)):
+            end = start + pd.Timedelta(days=int(rng.randint(0, 500)))
+            rows.append((f"{i:09d}", start, end))
+            start = end + pd.Timedelta(days=int(rng.randint(1, 90)))
+    spells = pd.DataFrame(
+        rows,
+        columns=["MedicaidSystemID", "EnrollmentStartDate", "EnrollmentEndDate"],
+    )
+    calls = pd.DataFrame(
+        {
+            "MedicaidSystemID": [f"{i:09d}" for i in range(65)],
+            "call_date": pd.Timestamp("2016-01-01")
+            + pd.to_timedelta(rng.randint(0, 900 * 24, size=65), unit="h"),
+        }
+    )
+    return spells, calls
+
+
+def _r_enrollment(spells, calls):
+    """ compute_medicaid_enrollment_precall and _postcall from 061 """
+    data = calls.assign(call_date_dt=calls.call_date.dt.normalize()).merge(
+        spells, on="MedicaidSystemID"
+    )
+    one_day_postcall = data.call_date_dt + pd.DateOffset(days=1)
+    end_study = data.EnrollmentEndDate.clip(
+        upper=data.call_date_dt + pd.DateOffset(months=6)
+    )
+    data["total_days_precall"] = (
+        (
+            np.minimum(data.call_date_dt, end_study)
+            + pd.Timedelta(days=1)
+            - data.EnrollmentStartDate
+        ).dt.days
+    ).clip(lower=0)
+    data["enr_24h"] = (
+        (data.EnrollmentStartDate <= data.call_date_dt)
+        & (one_day_postcall <= end_study)
+    ).astype(int)
+    data["enr_6mo"] = (
+        (
+            end_study
+            + pd.Timedelta(days=1)
+            - np.maximum(data.call_date_dt, data.EnrollmentStartDate)
+        ).dt.days
+    ).clip(lower=0)
+    return data.groupby("MedicaidSystemID")[
+        ["total_days_precall", "enr_24h", "enr_6mo"]
+    ].sum()
+
+
+def test_enrollment_exposure_matches_061(spells_and_calls):
+    spells, calls = spells_and_calls
+    exposure = enrollment_exposure(calls, spells).set_index("MedicaidSystemID")
+    expected = _r_enrollment(spells, calls)
+
+    assert (
+        exposure.total_days_precall.reindex(expected.index)
+        == expected.total_days_precall
+    ).all()
+    assert (
+        exposure.days_enrolled_6_months.reindex(expected.index) == expected.enr_6mo
+    ).all()
+    assert (
+        exposure.is_enrolled_24_hours.reindex(expected.index) == expected.enr_24h
+    ).all()
+    # Beneficiaries without spells were never enrolled
+    no_spells = exposure.drop(expected.index)
+    assert len(no_spells) == 5 and (no_spells.total_days_precall == 0).all()
+
+
+def test_enrollment_exposure_merges_spells():
+    spells = pd.DataFrame(
+        {
+            "MedicaidSystemID": ["a", "a", "a", "a", "b"],
+            "EnrollmentStartDate": pd.to_datetime(
+                ["2018-01-01", "2018-02-01", "2018-03-01", "2018-06-01", "2018-01-01"]
+            ),
+            "EnrollmentEndDate": [
+                datetime(2018, 3, 15),
+                datetime(2018, 2, 15),
+                datetime(2018, 3, 31),
+                datetime(9999, 12, 31),
+                None,
+            ],
+        }
+    )
+    merged = merge_spells(spells)
+    assert merged.MedicaidSystemID.tolist() == ["a", "a"]
+    assert merged.EnrollmentEndDate.tolist() == [
+        pd.Timestamp("2018-03-31"),
+        OPEN_END_DATE,
+    ]
+
+    calls = pd.DataFrame(
+        {
+            "MedicaidSystemID": ["a", "a", "b"],
+            "call_date": pd.to_datetime(["2018-03-10", "2018-07-01", "2018-07-01"]),
+        }
+    )
+    exposure = enrollment_exposure(calls, spells)
+    assert exposure.total_days_precall.tolist() == [69, 90 + 31, 0]
+    assert exposure.days_enrolled_6_months.tolist() == [22 + 102, 185, 0]
+    assert exposure.days_enrolled_6_months_before_call.tolist() == [68, 90 + 30, 0]
+    assert exposure.is_enrolled_24_hours.tolist() == [True, True, False]